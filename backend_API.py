@@ -1,15 +1,17 @@
  ################## ИМПОРТЫ ##################
-import os, time, traceback, json, threading, re, httpx,  io
-from typing import Optional, Dict, Any, List, Tuple
+import os, time, traceback, json, threading, re, requests, io, copy, hashlib, zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from contextvars import ContextVar
+from typing import Optional, Dict, Any, List, Tuple, TYPE_CHECKING
 from zoneinfo import ZoneInfo
 from fastapi import UploadFile, File, Form, FastAPI, APIRouter, HTTPException, Query, Body, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response, PlainTextResponse
+from fastapi.responses import Response, PlainTextResponse, StreamingResponse
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from datetime import date
 from pydantic import BaseModel, EmailStr
 from contextlib import asynccontextmanager
-from openai import OpenAI
 from datetime import datetime
 from decimal import Decimal
 from db import (
@@ -57,60 +59,39 @@ from db import (
     set_user_block,
     credits_ledger_list,
     set_user_password_and_flag,
+    graphs_cache_get,
+    graphs_cache_put,
+    list_declaration_ids,
 )
 
-from yandex_ocr import extract_text_with_meta
-from openpyxl import load_workbook
+import http_client
+import singleflight
 from graph import extract_index 
-import fitz
-from lxml import etree
-from docx import Document
+from graph_engine import (
+    GraphRegistry,
+    GraphEvaluation,
+    scoped_memo,
+    Memo,
+    shared_memo,
+    GraphMetrics,
+    external_call,
+    section_fingerprints,
+    changed_sections,
+    changed_override_keys,
+    GRAPHS_IO_WORKERS,
+)
 
 import logging
 from datetime import timedelta
 from jose import jwt, JWTError
-from passlib.context import CryptContext
-from collections import defaultdict, deque
-
-from xmlmap.ESADout_CU import (
-    DocumentID as ESADout_CU_DocumentID,
-    CustomsProcedure,
-    CustomsModeCode,
-    ElectronicDocumentSign,
-    RecipientCountryCode,
-    EECEDocHeaderAddInfo,
-    ESADout_CU,
-)
+from collections import defaultdict, deque, OrderedDict
 
-from xmlmap.ESADout_CUGoodsShipment import (
-    ESADout_CUGoodsShipment,
-    ESADout_CUConsignor,
-    SubjectAddressDetails,
-    ESADout_CUConsignee,
-    ESADout_CUFinancialAdjustingResponsiblePerson,
-    RFOrganizationFeatures,
-    ESADout_CUDeclarant,
-    ESADout_CUConsigment,
-    BorderCustomsOffice,
-    RUTransportMeans,
-    ESADout_CUDepartureArrivalTransport,
-    ESADout_CUBorderTransport,
-    CUESADDeliveryTerms,
-    ESADout_CUMainContractTerms,
-    ESADout_CUGoodsLocation,
-    RegisterDocumentIdDetails,
-    GoodsGroupQuantity,
-    GoodsGroupInformation,
-    GoodsGroupDescription,
-    Preferencii,
-    DocumentPresentingDetails,
-    ESADout_CUPresentedDocument,
-    PackagePalleteInformation,
-    ESADGoodsPackaging,
-    ESADCustomsProcedure,
-    SupplementaryGoodsQuantity,
-    ESADout_CUGoods,
-)
+# Тяжёлые зависимости (fitz, lxml, openpyxl, python-docx, OpenAI SDK, passlib, xmlmap, OCR)
+# импортируются при первом использовании: воркеры стартуют быстрее и занимают меньше памяти.
+# Отчёт по времени импорта: python -m bench.import_report
+if TYPE_CHECKING:
+    from openai import OpenAI
+    from xmlmap.ESADout_CU import ESADout_CU
 
 from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
@@ -162,6 +143,7 @@ def client_ip(request: Request) -> str:
     return request.client.host if request.client else "unknown"
 
 def pdf_page_count(data: bytes) -> int:
+    import fitz
     doc = fitz.open(stream=data, filetype="pdf")
     n = doc.page_count
     doc.close()
@@ -170,7 +152,10 @@ def pdf_page_count(data: bytes) -> int:
 def gpt_client():
     return openai_client()
 
-def openai_client() -> OpenAI:
+@lru_cache(maxsize=1)
+def openai_client() -> "OpenAI":
+    # один клиент на процесс: у SDK свой пул соединений, новый клиент — новый TLS-handshake
+    from openai import OpenAI
     if not OPENAI_API_KEY:
         raise RuntimeError("OPENAI_API_KEY is not set")
     return OpenAI(api_key=OPENAI_API_KEY)
@@ -1544,7 +1529,9 @@ def extract_json_fallback(raw: str) -> Optional[Dict[str, Any]]:
         except Exception: pass
     return None
 
-def yandex_client() -> OpenAI:
+@lru_cache(maxsize=1)
+def yandex_client() -> "OpenAI":
+    from openai import OpenAI
     if not (YANDEX_API_KEY and YANDEX_FOLDER):
         raise RuntimeError("YANDEX_API_KEY или YANDEX_FOLDER_ID не заданы")
     return OpenAI(
@@ -1554,6 +1541,7 @@ def yandex_client() -> OpenAI:
     )
 
 def extract_docx_text_with_meta(file_bytes: bytes, filename: str = "") -> tuple[str, dict]:
+    from docx import Document
     buf = io.BytesIO(file_bytes)
     doc = Document(buf)
 
@@ -1583,6 +1571,7 @@ def extract_docx_text_with_meta(file_bytes: bytes, filename: str = "") -> tuple[
 
 
 def extract_xlsx_text_with_meta(file_bytes: bytes, filename: str = "") -> tuple[str, dict]:
+    from openpyxl import load_workbook
     wb = load_workbook(io.BytesIO(file_bytes), data_only=True)
 
     parts: list[str] = []
@@ -1658,6 +1647,7 @@ def call_yandexgpt(file_bytes: bytes, filename: str, doc_key: str, mime: Optiona
     elif is_xlsx:
         plain_text, ocr_meta = extract_xlsx_text_with_meta(file_bytes, filename)
     else:
+        from yandex_ocr import extract_text_with_meta
         plain_text, ocr_meta = extract_text_with_meta(
             file_bytes,
             mime or "application/octet-stream",
@@ -1747,9 +1737,15 @@ _stop = threading.Event()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    from refdata import get_refdata
+    print(f"[refdata] Справочники загружены: {get_refdata().summary()}")
     threading.Thread(target=worker_loop, daemon=True).start()
+    if CBR_PREFETCH_INTERVAL > 0:
+        threading.Thread(target=cbr_prefetch_loop, daemon=True).start()
     yield
     _stop.set()
+    await http_client.aclose()
+    http_client.close()
 
 app = FastAPI(title="AI-Декларант API", version="1.0", lifespan=lifespan)
 
@@ -2080,6 +2076,7 @@ def job_status(job_id: int, current=Depends(get_current_user)):
 
 @debug_router.post("/ocr")
 async def debug_ocr(file: UploadFile = File(...), current=Depends(require_admin)):
+    from yandex_ocr import extract_text_with_meta
     file_bytes = await file.read()
     text, meta = extract_text_with_meta(
         file_bytes=file_bytes,
@@ -2301,6 +2298,20 @@ def api_enrich_tnved_for_invoice(decl_id: int, body: TnvedEnrichRequest, current
         "tnved": parsed_after.get("_tnved", {}),
     }
 
+CBR_PREFETCH_INTERVAL = float(os.getenv("CBR_PREFETCH_INTERVAL", "3600"))  # 0 — не загружать курсы заранее
+
+def cbr_prefetch_loop():
+    # Курсы ЦБ на сегодня и завтра загружаются заранее — расчёт графов берёт их из cbr_rates
+    import parser_cbrf
+    while not _stop.is_set():
+        try:
+            loaded = parser_cbrf.prefetch(days_ahead=1)
+            if loaded:
+                print(f"[cbr] Загружены курсы: {loaded}")
+        except Exception as e:
+            print(f"[cbr] Не удалось загрузить курсы заранее: {e!r}")
+        _stop.wait(CBR_PREFETCH_INTERVAL)
+
 def worker_loop():
     while not _stop.is_set():
         job = jobs_claim_next()
@@ -2387,6 +2398,9 @@ def parse_ofdata_company(payload: Dict[str, Any]) -> Dict[str, Any]:
         "house": house,
     }
 
+# один и тот же ИНН, введённый одновременно, — один запрос к OfData (у ключа суточный лимит)
+_ofdata_flight = singleflight.SingleFlight("ofdata")
+
 @company_router.get("/ofdata")
 def get_company_ofdata(inn: str = Query(..., min_length=10, max_length=12),):
     if not inn.isdigit():
@@ -2409,8 +2423,8 @@ def get_company_ofdata(inn: str = Query(..., min_length=10, max_length=12),):
 
     try:
         payload = {"key": OFDATA_API_KEY, "inn": inn}
-        r = httpx.post(OFDATA_URL, json=payload, timeout=5.0)
-    except httpx.RequestError as e:
+        r = _ofdata_flight.do(inn, http_client.post, OFDATA_URL, json=payload, timeout=5.0)
+    except requests.RequestException as e:
         api_error(
             502,
             "OFDATA_REQUEST_FAILED",
@@ -2898,14 +2912,17 @@ class FileUploadResp(BaseModel):
 APP_TZ = ZoneInfo("Europe/Moscow") 
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+@lru_cache(maxsize=1)
+def pwd_context():
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+    return pwd_context().hash(password)
 
 def verify_password(password: str, password_hash: str) -> bool:
     try:
-        return pwd_context.verify(password, password_hash)
+        return pwd_context().verify(password, password_hash)
     except Exception:
         return False
 
@@ -3529,6 +3546,18 @@ class AdminJobRow(BaseModel):
     error_text: Optional[str] = None
     created_at: Optional[datetime] = None
 
+class AdminGraphsBatchIn(BaseModel):
+    decl_ids: Optional[List[int]] = None          # явный список; иначе — по фильтрам ниже
+    user_id: Optional[int] = None
+    created_from: Optional[datetime] = None
+    created_to: Optional[datetime] = None
+    stale_only: bool = False
+    limit: int = 500
+    kind: str = "graphs"                          # graphs | xml
+    zip: bool = False                             # только для kind=xml: архив вместо NDJSON
+    fields: Optional[List[str]] = None            # как ?fields= у /declarations/{id}/graphs
+    workers: Optional[int] = None
+
 class AdminMetricsOut(BaseModel):
     jobs_24h: Dict[str, int]
     jobs_avg_seconds_24h: float
@@ -3540,6 +3569,14 @@ class AdminMetricsOut(BaseModel):
     payments_24h: Dict[str, int]
     last_payment_succeeded_at: Optional[str] = None
 
+    # с момента старта процесса; перцентили — по последним GRAPHS_METRICS_WINDOW замерам
+    graphs: Dict[str, Dict[str, float]] = {}
+    graph_lookups: Dict[str, Dict[str, float]] = {}
+    cbr_rates_cache: Dict[str, int] = {}     # попадания LRU / cbr_rates / походы на cbr.ru
+    svh_cache: Dict[str, int] = {}           # свежие / устаревшие (обновлены в фоне) / промахи
+    http_hosts: Dict[str, Dict[str, int]] = {}   # запросы / повторы / ошибки по внешним хостам
+    singleflight: Dict[str, Dict[str, int]] = {} # вызовы / дождавшиеся чужого запроса
+
 class AdminJobDetails(AdminJobRow):
     pass
 
@@ -4043,6 +4080,7 @@ def admin_metrics(current=Depends(require_admin)):
 
         cur.close()
 
+    graph_stats = GRAPH_METRICS.snapshot()
     return AdminMetricsOut(
         jobs_24h=jobs_24h,
         jobs_avg_seconds_24h=jobs_avg_seconds,
@@ -4051,9 +4089,103 @@ def admin_metrics(current=Depends(require_admin)):
         tnved_avg_latency_ms_24h=tnved_avg_latency,
         payments_24h=payments_24h,
         last_payment_succeeded_at=last_succ,
+        graphs=graph_stats.get("graph", {}),
+        graph_lookups=graph_stats.get("lookup", {}),
+        cbr_rates_cache=_cbr_cache_stats(),
+        svh_cache=_svh_cache_stats(),
+        http_hosts=http_client.stats(),
+        singleflight=singleflight.stats(),
     )
 
 
+@admin_router.post("/refdata/reload")
+def admin_refdata_reload(current=Depends(require_admin)):
+    # Перечитать classifier/*.csv без рестарта; версия справочников входит в ключ кэша графов
+    from refdata import get_refdata, reload_refdata
+    before = get_refdata().version
+    try:
+        ref = reload_refdata()
+    except Exception as e:
+        api_error(
+            500,
+            "REFDATA_RELOAD_FAILED",
+            "Не удалось перечитать справочники.",
+            hint="Проверьте CSV в classifier/: прежние справочники остаются в работе.",
+            details={"reason": str(e)},
+        )
+    return {"previous_version": before, "changed": ref.version != before, **ref.summary()}
+
+
+@misc_router.get("/customs-posts/search")
+def api_customs_posts_search(
+    q: str = Query(..., min_length=1, description="Код поста (префикс) или часть названия"),
+    limit: int = Query(20, ge=1, le=100),
+    current=Depends(get_current_user),
+):
+    # Поиск по локальному справочнику постов (customs_directory.py crawl), без обращения к alta.ru
+    import customs_directory
+    try:
+        items = customs_directory.search(q, limit)
+    except Exception as e:
+        api_error(
+            503,
+            "CUSTOMS_DIRECTORY_UNAVAILABLE",
+            "Справочник таможенных постов недоступен.",
+            hint="Попробуйте позже.",
+            details={"reason": str(e)},
+        )
+    return {"q": q, "items": items}
+
+
+RATES_RANGE_MAX_DAYS = int(os.getenv("RATES_RANGE_MAX_DAYS", "3660"))
+RATES_BACKFILL_MAX_DAYS = int(os.getenv("RATES_BACKFILL_MAX_DAYS", "400"))
+
+class RatesBackfillIn(BaseModel):
+    date_from: date
+    date_to: date
+
+def _check_rates_range(date_from: date, date_to: date, max_days: int) -> None:
+    if date_to < date_from:
+        api_error(400, "BAD_DATE_RANGE", "Дата «по» раньше даты «с».",
+                  details={"from": date_from.isoformat(), "to": date_to.isoformat()})
+    days = (date_to - date_from).days + 1
+    if days > max_days:
+        api_error(400, "DATE_RANGE_TOO_LARGE", "Слишком большой период.",
+                  hint="Разбейте период на несколько запросов.",
+                  details={"days": days, "max": max_days})
+
+@misc_router.get("/rates")
+def api_rates(
+    currency: str = Query(..., min_length=1, description="USD, 840 или название валюты"),
+    date_from: date = Query(..., alias="from"),
+    date_to: date = Query(..., alias="to"),
+    current=Depends(require_roles("declarant", "tamarix", "admin")),
+):
+    # Курсы ЦБ за период только из таблицы cbr_rates, без обращения к cbr.ru
+    import parser_cbrf
+    from db import cbr_rates_range
+    _check_rates_range(date_from, date_to, RATES_RANGE_MAX_DAYS)
+    code = parser_cbrf.effective_code(currency)
+    rows = cbr_rates_range(code, date_from, date_to)
+    days = (date_to - date_from).days + 1
+    return {
+        "currency": code,
+        "from": date_from.isoformat(),
+        "to": date_to.isoformat(),
+        "rates": [{"date": r["rate_date"].isoformat(), "rate": str(r["rate"])} for r in rows],
+        "missing_days": days - len(rows),   # не загружены — POST /admin/rates/backfill
+    }
+
+@admin_router.post("/rates/backfill")
+def admin_rates_backfill(body: RatesBackfillIn, current=Depends(require_admin)):
+    import parser_cbrf
+    _check_rates_range(body.date_from, body.date_to, RATES_BACKFILL_MAX_DAYS)
+    try:
+        return parser_cbrf.backfill(body.date_from, body.date_to)
+    except RuntimeError as e:
+        api_error(409, "RATES_STORE_DISABLED", "Таблица курсов отключена.", details={"reason": str(e)})
+
+
 @admin_router.get("/payments", response_model=List[AdminPaymentRow])
 def admin_payments(
     user_id: int = 0,
@@ -4231,14 +4363,16 @@ async def yk_request(
         headers["Idempotence-Key"] = idempotence_key
 
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            r = await client.request(
-                method=method,
-                url=f"{YOOKASSA_BASE}{path}",
-                auth=(YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY), 
-                headers=headers,
-                json=json_body,
-            )
+        # POST повторяется только с Idempotence-Key: YooKassa не создаст второй платёж
+        r = await http_client.arequest(
+            method,
+            f"{YOOKASSA_BASE}{path}",
+            timeout=30.0,
+            idempotent=True if idempotence_key else None,
+            auth=(YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY),
+            headers=headers,
+            json=json_body,
+        )
     except Exception as e:
         api_error(
             502,
@@ -4560,6 +4694,29 @@ def _normalize_date_for_cbrf(value) -> str:
 
     return ""
 
+GRAPHS_IO_TIMEOUT = float(os.getenv("GRAPHS_IO_TIMEOUT", "15"))
+GRAPH_METRICS = GraphMetrics(window=int(os.getenv("GRAPHS_METRICS_WINDOW", "1000")))
+
+def _cbr_cache_stats() -> Dict[str, int]:
+    import parser_cbrf
+    return parser_cbrf.cache_stats()
+
+def _svh_cache_stats() -> Dict[str, int]:
+    import svh_cache
+    return svh_cache.cache_stats()
+
+def _cb_rate(date_ddmmyyyy, currency):
+    # Курс ЦБ в пределах одного расчёта графов запрашивается один раз на (дата, валюта)
+    import parser_cbrf
+    key = ("cb_rate", str(date_ddmmyyyy), str(currency))
+    return scoped_memo(key, external_call, "cb_rate", GRAPHS_IO_TIMEOUT, parser_cbrf.cb_rate, date_ddmmyyyy, currency, shared=True)
+
+def _svh_data(tp_code):
+    # СВХ поста из svh_cache; alta.ru — только для ещё не загружавшихся постов, устаревшие обновляются в фоне
+    import svh_cache
+    key = ("svh", str(tp_code))
+    return scoped_memo(key, external_call, "svh", GRAPHS_IO_TIMEOUT, svh_cache.get_svh, tp_code, shared=True)
+
 def _is_empty_override(v) -> bool:
     if v is None:
         return True
@@ -4629,50 +4786,15 @@ def build_all_data_for_decl(decl_id: int) -> Dict[str, Any]:
     return _inject_decl_date(all_data)
 
 def _select_primary_tnved(all_data: Dict[str, Any]) -> str:
-    from graph import get_tnved
+    from graph import goods_table
 
-    codes_raw = get_tnved(all_data)
-    if isinstance(codes_raw, set):
-        codes = sorted(c for c in codes_raw if c)
-        return codes[0] if codes else ""
-
-    if isinstance(codes_raw, (list, tuple)):
-        for c in codes_raw:
-            c = (c or "").strip()
-            if c:
-                return c
-        return ""
-
-    if isinstance(codes_raw, str):
-        return codes_raw.strip()
-
-    return ""
+    codes = goods_table(all_data).tnved_sorted
+    return codes[0] if codes else ""
 
 def _collect_tnved_list(all_data: Dict[str, Any]) -> List[str]:
-    from graph import get_tnved
+    from graph import goods_table
 
-    codes_raw = get_tnved(all_data)
-    result: List[str] = []
-
-    if isinstance(codes_raw, set):
-        result = sorted(c for c in codes_raw if c)
-    elif isinstance(codes_raw, (list, tuple)):
-        for c in codes_raw:
-            c = (c or "").strip()
-            if c:
-                result.append(c)
-    elif isinstance(codes_raw, str):
-        c = codes_raw.strip()
-        if c:
-            result = [c]
-    seen = set()
-    uniq: List[str] = []
-    for c in result:
-        if c not in seen:
-            seen.add(c)
-            uniq.append(c)
-
-    return uniq
+    return list(goods_table(all_data).tnved_sorted)
 
 def compute_date_declararion(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str, Any]:
     declaration_date = overrides.get("declaration_date") or all_data.get("declaration", {}).get("Дата декларации")
@@ -4984,8 +5106,8 @@ def compute_g11(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str
     sender_country = normalize_country(get_any(all_data, [
         "invoice.Отправитель.Страна",
         "contract.Общая информация.Стороны.Отправитель.Страна",
-    ]))
-    base_code = get_country_code(sender_country) if sender_country else ""
+    ]), fuzzy=True)
+    base_code = get_country_code(sender_country, fuzzy=True) if sender_country else ""
     g2_4_override = overrides.get("g2_4")
     if g2_4_override:
         base_code = g2_4_override
@@ -4999,8 +5121,7 @@ def compute_g11(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str
     }
 
 def compute_g12(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str, Any]:
-    from graph import get_currency, _to_decimal, get_any, normalize_country, get_country_code
-    from parser_cbrf import cb_rate
+    from graph import get_currency, _to_decimal, get_any, normalize_country, get_country_code, goods_table
     from decimal import Decimal
 
     def _d(val) -> Decimal:
@@ -5015,30 +5136,16 @@ def compute_g12(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str
         "dt.date",
     ])
 
-    goods_invoice = all_data.get("invoice", {}).get("Товары", [])
     payment = all_data.get("payment", {}) or {}
     shipping_list = payment.get("Перевозка", []) or []
     insurance_list = payment.get("Страхование", []) or []
     payment_info = payment.get("Общая информация", {}) or {}
     cur_payment = payment_info.get("Валюта документа") or ""
 
-    sum_inv = Decimal("0")
+    sum_inv = goods_table(all_data).invoice_sum()
     sum_shipping = Decimal("0")
     sum_insurance = Decimal("0")
 
-    if isinstance(goods_invoice, list):
-        for g in goods_invoice:
-            if not isinstance(g, dict):
-                continue
-            price = _d(g.get("Цена"))
-            qty = _d(g.get("Количество"))
-            total = _d(g.get("Стоимость"))
-            if total > 0:
-                item_total = total
-            else:
-                item_total = price * qty
-            sum_inv += item_total
-
     if sum_inv == 0:
         return {
             "g12_currency": overrides.get("g12_currency", "RUB"),
@@ -5103,15 +5210,16 @@ def compute_g12(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str
     is_buyer_ru = (buyer_country_code == "RU")
     if is_buyer_ru: 
         cur_payment = "RUB"
-    if date_declaration and inv_currency and inv_currency != "RUB":
-        rate_inv = _d(cb_rate(date_declaration, inv_currency))
-    else:
-        rate_inv = Decimal("1")
-    
-    if (not is_buyer_ru and date_declaration and cur_payment != "RUB"):
-        rate_payment = _d(cb_rate(date_declaration, cur_payment))
-    else:
-        rate_payment = Decimal("1")
+    # Курс недоступен (сеть, таймаут) — рублёвые суммы остаются пустыми
+    rate_inv = rate_payment = Decimal("1")
+    try:
+        if date_declaration and inv_currency and inv_currency != "RUB":
+            rate_inv = _d(_cb_rate(date_declaration, inv_currency))
+        if (not is_buyer_ru and date_declaration and cur_payment != "RUB"):
+            rate_payment = _d(_cb_rate(date_declaration, cur_payment))
+    except Exception as e:
+        print(f"[g12] Курс ЦБ недоступен ({date_declaration}): {e!r}")
+        rate_inv = rate_payment = Decimal("0")
 
     sum_inv_rub = (sum_inv * rate_inv).quantize(Decimal("0.01"))
     sum_shipping_rub = (sum_shipping * rate_payment).quantize(Decimal("0.01"))
@@ -5271,15 +5379,15 @@ def compute_g15(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str
         "transport_road.Перевозка.Место погрузки.Страна",
         "transport_air.Перевозка.Аэропорт отправления.Страна",
         "transport_sea.Перевозка.Отправитель.Страна"
-    ])) or "НЕИЗВЕСТНА"
+    ]), fuzzy=True) or "НЕИЗВЕСТНА"
 
-    default_g15_1 = get_country_code(default_g15_2) if default_g15_2 != "НЕИЗВЕСТНА" else ""
+    default_g15_1 = get_country_code(default_g15_2, fuzzy=True) if default_g15_2 != "НЕИЗВЕСТНА" else ""
     g15_2 = overrides.get("g15_2", default_g15_2)
 
     if "g15_1" in overrides:
         g15_1 = overrides["g15_1"]
     else:
-        g15_1 = get_country_code(g15_2) if g15_2 else default_g15_1
+        g15_1 = get_country_code(g15_2, fuzzy=True) if g15_2 else default_g15_1
 
     return {
         "g15_1": g15_1,
@@ -5289,7 +5397,8 @@ def compute_g15(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str
 def compute_g16(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str, Any]:
     from graph import (collect_origin_values,_is_unknown, _is_eu_label, get_country_code,normalize_country,)
     raw = collect_origin_values(all_data)
-    norms = [(orig, (orig or "").upper().strip()) for orig in raw]
+    # одна страна в разных написаниях ("GERMANY", "ГЕРМАНИЯ", распознанное "GERMNAY") — одна страна
+    norms = [(orig, (normalize_country(orig) or orig or "").upper().strip()) for orig in raw]
 
     countries = set()
     has_eu_label = False
@@ -5317,9 +5426,9 @@ def compute_g16(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str
             (orig for orig, up in norms if up == single_upper),
             single_upper.title()
         )
-        default_name = normalize_country(orig_display)
+        default_name = normalize_country(orig_display, fuzzy=True)
         try:
-            default_code = get_country_code(default_name) or ""
+            default_code = get_country_code(default_name, fuzzy=True) or ""
         except Exception:
             default_code = ""
     else:
@@ -5327,7 +5436,7 @@ def compute_g16(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str
         default_code = ""
 
     g16_2 = overrides.get("g16_2", default_name)
-    g16_1 = overrides.get("g16_1", (get_country_code(g16_2) or default_code) if g16_2 else default_code)
+    g16_1 = overrides.get("g16_1", (get_country_code(g16_2, fuzzy=True) or default_code) if g16_2 else default_code)
 
     return {
         "g16_1": g16_1,
@@ -5341,15 +5450,15 @@ def compute_g17(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str
         "transport_rail.Перевозка.Станция назначения.Страна",
         "transport_road.Перевозка.Место разгрузки.Страна",
         "transport_air.Перевозка.Аэропорт назначения.Страна",
-    ]))
+    ]), fuzzy=True)
 
-    default_g17_1 = get_country_code(default_g17_2) if default_g17_2 else ""
+    default_g17_1 = get_country_code(default_g17_2, fuzzy=True) if default_g17_2 else ""
     g17_2 = overrides.get("g17_2", default_g17_2)
 
     if "g17_1" in overrides:
         g17_1 = overrides["g17_1"]
     else:
-        g17_1 = get_country_code(g17_2) if g17_2 else default_g17_1
+        g17_1 = get_country_code(g17_2, fuzzy=True) if g17_2 else default_g17_1
 
     return {
         "g17_1": g17_1,
@@ -5447,7 +5556,6 @@ def compute_g22(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str
 
 def compute_g23(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str, Any]:
     from graph import get_any, get_currency
-    from parser_cbrf import cb_rate
 
     raw_date = overrides.get("declaration_date")  
     if _is_empty_override(raw_date):
@@ -5466,7 +5574,7 @@ def compute_g23(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str
     default_rate = ""
     if date_declaration and currency:
         try:
-            r = cb_rate(date_declaration, currency)
+            r = _cb_rate(date_declaration, currency)
             default_rate = "" if r in (None, "") else str(r)
         except Exception:
             default_rate = ""
@@ -5479,7 +5587,6 @@ def compute_g23(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str
 
 def compute_g24(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str, Any]:
     from graph import get_any, get_currency
-    from parser_cbrf import cb_rate
 
     default_g24_1 = "010"
     default_g24_2 = "00" 
@@ -5492,7 +5599,7 @@ def compute_g24(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str
             "dt.Дата декларации",
             "dt.date",
         ])
-        rate_raw = cb_rate(date_decl, get_currency(all_data))
+        rate_raw = _cb_rate(date_decl, get_currency(all_data))
         summa = Decimal(str(summa_raw or "0").replace(",", "."))
         rate = Decimal(str(rate_raw or "1"))
 
@@ -5572,7 +5679,6 @@ def compute_g29(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str
 
 def compute_g30(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str, Any]:
     from graph import get_any
-    from parcer_alta_tam import get_svh_data
 
     # Определяем тип транспортного документа
     transport_type = next(
@@ -5619,7 +5725,7 @@ def compute_g30(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str
 
     if g30_3:
         try:
-            svh = get_svh_data(g30_3) or {}
+            svh = _svh_data(g30_3) or {}
         except Exception:
             svh = {}
 
@@ -5848,8 +5954,8 @@ def compute_g34(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str
                     or ""
                 )
                 if country_name:
-                    country_name = normalize_country(country_name)
-                    country_code = get_country_code(country_name) or ""
+                    country_name = normalize_country(country_name, fuzzy=True)
+                    country_code = get_country_code(country_name, fuzzy=True) or ""
                 else:
                     country_code = ""
                 g34_1_list.append(country_code)
@@ -5858,8 +5964,8 @@ def compute_g34(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str
             if isinstance(raw, set):
                 raw = next(iter(sorted(raw))) if raw else ""
             if raw:
-                raw = normalize_country(raw)
-                base_code = get_country_code(raw) or ""
+                raw = normalize_country(raw, fuzzy=True)
+                base_code = get_country_code(raw, fuzzy=True) or ""
             else:
                 base_code = ""
 
@@ -5917,7 +6023,7 @@ def compute_g36(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str
 
 def compute_g37(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str, Any]:
     tnved_list = _collect_tnved_list(all_data)
-    g1_vals = compute_g1(all_data, overrides)
+    g1_vals = GRAPHS.result("g1", all_data, overrides)
     base_g1_2 = (g1_vals.get("g1_2") or "").strip()
     g1_2 = (overrides.get("g1_2") or base_g1_2 or "").strip()
 
@@ -6190,7 +6296,7 @@ def compute_g45(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str
         g42_list = _norm_list(overrides.get("g42_1_list"), target_len)
     else:
         try:
-            base42 = compute_g42(all_data, overrides)
+            base42 = GRAPHS.result("g42", all_data, overrides)
             g42_list = _norm_list(base42.get("g42_1_list"), target_len)
         except Exception:
             g42_list = [""] * target_len
@@ -6198,7 +6304,7 @@ def compute_g45(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str
     rate_str = overrides.get("g23_1")
     if not rate_str:
         try:
-            base23 = compute_g23(all_data, overrides)
+            base23 = GRAPHS.result("g23", all_data, overrides)
             rate_str = base23.get("g23_1") or ""
         except Exception:
             rate_str = ""
@@ -6210,14 +6316,14 @@ def compute_g45(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str
         add_total = _to_decimal(overrides.get("g12_logistics")) + _to_decimal(overrides.get("g12_insurance"))
     else:
         try:
-            base12 = compute_g12(all_data, overrides)
+            base12 = GRAPHS.result("g12", all_data, overrides)
             add_total = _to_decimal(base12.get("g12_logistics")) + _to_decimal(base12.get("g12_insurance"))
         except Exception:
             add_total = Decimal("0")
     add_total = add_total.quantize(Decimal("0.01")) if add_total != 0 else Decimal("0.00")
 
     try:
-        base35 = compute_g35(all_data, overrides)
+        base35 = GRAPHS.result("g35", all_data, overrides)
         g35_list = _norm_list(base35.get("g35_1_list"), target_len)
     except Exception:
         g35_list = [""] * target_len
@@ -6242,7 +6348,6 @@ def compute_g45(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str
 
 
 def compute_g46(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str, Any]:
-    from parser_cbrf import cb_rate
     from graph import get_any, _to_decimal
 
     tnved_list = _collect_tnved_list(all_data) or []
@@ -6264,7 +6369,7 @@ def compute_g46(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str
             g45_list_raw = []
     else:
         try:
-            g45 = compute_g45(all_data, overrides)
+            g45 = GRAPHS.result("g45", all_data, overrides)
             g45_list_raw = g45.get("g45_1_list") or []
         except Exception:
             g45_list_raw = []
@@ -6300,7 +6405,7 @@ def compute_g46(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str
         return {"g46_1_list": [""] * target_len}
 
     try:
-        usd_rate = cb_rate(date_str, "USD")
+        usd_rate = _cb_rate(date_str, "USD")
     except Exception:
         usd_rate = Decimal("0")
 
@@ -6324,8 +6429,7 @@ def compute_g46(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str
     }
 
 def compute_goods(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str, Any]:
-    from graph import get_currency, _to_decimal, get_any
-    from parser_cbrf import cb_rate
+    from graph import get_currency, _to_decimal, get_any, goods_table
     from decimal import Decimal
 
     def _d(val) -> Decimal:
@@ -6366,6 +6470,10 @@ def compute_goods(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[s
         sender = {}
     manufacturer_default = (sender.get("Название компании") or "").strip()
 
+    # строки основного инвойса уже разобраны в таблице товаров
+    table = goods_table(all_data)
+    amounts = dict(zip(table.inv_pos, table.inv_amount)) if goods_src is table.inv_source else {}
+
     goods_by_tnved: Dict[str, List[Dict[str, Any]]] = {}
 
     for idx, g in enumerate(goods_src):
@@ -6390,11 +6498,14 @@ def compute_goods(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[s
         if currency.lower() == "null":
             currency = ""
 
-        price = _d(g.get("Цена"))
-        qty_dec = _d(qty)
-        invoiced_cost = _d(g.get("Стоимость"))
-        if invoiced_cost <= 0:
-            invoiced_cost = price * qty_dec
+        if idx in amounts:
+            invoiced_cost = amounts[idx]
+        else:
+            price = _d(g.get("Цена"))
+            qty_dec = _d(qty)
+            invoiced_cost = _d(g.get("Стоимость"))
+            if invoiced_cost <= 0:
+                invoiced_cost = price * qty_dec
 
         item = {
             "index": idx,
@@ -6424,55 +6535,353 @@ def compute_goods(all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[s
     return {"goods_by_tnved": goods_by_tnved}
 
 
+# Граф зависимостей: deps — графы, чьи результаты используются узлом;
+# paths — разделы all_data ("*" — весь документ); reads — ключи overrides ("g12_" — префикс).
+# Порядок регистрации = порядок слияния результатов.
+GRAPHS = GraphRegistry()
+_TRANSPORT = ("transport_*",)
+
+GRAPHS.register("declaration_date", compute_date_declararion, paths=("declaration",), reads=("declaration_date",))
+GRAPHS.register("g1", compute_g1, paths=("invoice", "contract"), reads=("g1_",))
+GRAPHS.register("g2", compute_g2, paths=("invoice", "contract"), reads=("g2_",))
+GRAPHS.register("g3", compute_g3, paths=("invoice",), reads=("g3_",))
+GRAPHS.register("g4", compute_g4, reads=("g4_",))
+GRAPHS.register("g5", compute_g5, paths=("invoice",), reads=("g5_",))
+GRAPHS.register("g6", compute_g6, paths=("packing",), reads=("g6_",))
+GRAPHS.register("g7", compute_g7, reads=("g7_",))
+GRAPHS.register("g8", compute_g8, reads=("g8_",))
+GRAPHS.register("g9", compute_g9, reads=("g9_",))
+GRAPHS.register("g11", compute_g11, paths=("invoice", "contract"), reads=("g11_", "g2_4"))
+GRAPHS.register("g12", compute_g12, paths=("*",), reads=("g12_",), io=True)
+GRAPHS.register("g14", compute_g14, paths=("invoice", "contract"), reads=("g14_",))
+GRAPHS.register("g15", compute_g15, paths=_TRANSPORT, reads=("g15_",))
+GRAPHS.register("g16", compute_g16, paths=("invoice", "packing"), reads=("g16_",))
+GRAPHS.register("g17", compute_g17, paths=_TRANSPORT, reads=("g17_",))
+GRAPHS.register("g18", compute_g18, paths=_TRANSPORT, reads=("g18_",))
+GRAPHS.register("g19", compute_g19, paths=_TRANSPORT, reads=("g19_",))
+GRAPHS.register("g20", compute_g20, paths=("invoice", "contract"), reads=("g20_",))
+GRAPHS.register("g21", compute_g21, paths=_TRANSPORT, reads=("g21_",))
+GRAPHS.register("g22", compute_g22, paths=("*",), reads=("g22_",))
+GRAPHS.register("g23", compute_g23, paths=("*",), reads=("g23_", "g22_1", "declaration_date"), io=True)
+GRAPHS.register("g24", compute_g24, paths=("*",), reads=("g24_",), io=True)
+GRAPHS.register("g25", compute_g25, paths=_TRANSPORT, reads=("g25_",))
+GRAPHS.register("g26", compute_g26, paths=_TRANSPORT, reads=("g26_",))
+GRAPHS.register("g29", compute_g29, paths=_TRANSPORT, reads=("g29_",))
+GRAPHS.register("g30", compute_g30, paths=_TRANSPORT, reads=("g30_",), io=True)
+GRAPHS.register("g31", compute_g31, paths=("invoice", "packing", "contract"), reads=("g31_",))
+GRAPHS.register("g32", compute_g32, reads=("g32_",))
+GRAPHS.register("g33", compute_g33, paths=("invoice",), reads=("g33_",))
+GRAPHS.register("g34", compute_g34, paths=("invoice", "contract"), reads=("g34_",))
+GRAPHS.register("g35", compute_g35, paths=("invoice", "packing"), reads=("g35_",))
+GRAPHS.register("g36", compute_g36, reads=("g36_",))
+GRAPHS.register("g37", compute_g37, deps=("g1",), paths=("invoice",), reads=("g37_", "g1_2"))
+GRAPHS.register("g38", compute_g38, paths=("invoice", "packing"), reads=("g38_",))
+GRAPHS.register("g39", compute_g39, paths=("invoice",), reads=("g39_",))
+GRAPHS.register("g40", compute_g40, paths=("invoice",), reads=("g40_",))
+GRAPHS.register("g41", compute_g41, paths=("invoice",), reads=("g41_",))
+GRAPHS.register("g42", compute_g42, paths=("invoice", "packing"), reads=("g42_",))
+GRAPHS.register("g43", compute_g43, paths=("invoice",), reads=("g43_",))
+GRAPHS.register("g44", compute_g44, paths=("invoice", "contract", "payment", "transport", "transport_*"), reads=("g44_", "g25_1"))
+GRAPHS.register(
+    "g45", compute_g45,
+    deps=("g42", "g23", "g12", "g35"),
+    paths=("invoice",),
+    reads=("g45_", "g42_1_list", "g23_1", "g12_logistics", "g12_insurance"),
+)
+GRAPHS.register("g46", compute_g46, deps=("g45",), paths=("invoice", "declaration", "dt"), reads=("g46_", "g45_1_list"), io=True)
+GRAPHS.register("goods", compute_goods, paths=("invoice", "invoice_json", "invoice_parsed"), reads=("goods_",))
+
+# Группы для ?fields= в GET /declarations/{id}/graphs
+GRAPH_GROUPS: Dict[str, Tuple[str, ...]] = {
+    "header": ("declaration_date", "g1", "g3", "g4", "g5", "g6", "g7"),
+    "parties": ("g2", "g8", "g9", "g14"),
+    "transport": ("g15", "g16", "g17", "g18", "g19", "g21", "g25", "g26", "g29", "g30"),
+    "finance": ("g11", "g12", "g20", "g22", "g23", "g24"),
+    "svh": ("g30",),
+    "items": ("g31", "g32", "g33", "g34", "g35", "g36", "g37", "g38", "g39",
+              "g40", "g41", "g42", "g43", "g44", "g45", "g46"),
+    "customs_value": ("g42", "g45", "g46"),
+}
+
+
 def compute_graphs(all_data: Dict[str, Any],overrides: Optional[Dict[str, Any]]) -> Dict[str, Any]:
 
     overrides = overrides or {}
+    return GraphEvaluation(GRAPHS, all_data, overrides, workers=GRAPHS_IO_WORKERS, metrics=GRAPH_METRICS).run()
+
+
+# Последний расчёт по декларации (auto — без overrides, current — с сохранёнными overrides).
+# При следующем запросе пересчитываются только узлы, затронутые изменёнными ключами
+# overrides или разделами all_data, остальные результаты переиспользуются.
+GRAPHS_STATE_MAX = int(os.getenv("GRAPHS_STATE_MAX", "256"))
+_graphs_state: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+_graphs_state_lock = threading.Lock()
+
+# Увеличивать, если результат графов меняется не из-за кода (например, формат снимка) — сбрасывает кэш
+# графов в БД. Функции узлов, вызываемые ими функции backend_API (транзитивно) и модули проекта, на которые
+# они ссылаются, учитываются автоматически (graphs_code_hash); GRAPHS_CODE_MODULES — модули, которые
+# импортируются внутри функций и по ссылкам не видны.
+GRAPHS_CODE_VERSION = "2"
+GRAPHS_CODE_MODULES = ("graph.py", "country_resolver.py", "refdata.py", "parser_cbrf.py", "parcer_alta_tam.py",
+                       "svh_cache.py")
+
+
+def _graphs_code_sources() -> Tuple[List[Any], List[str]]:
+    # Функции backend_API, достижимые из функций узлов по глобальным именам, и файлы модулей проекта,
+    # на которые они ссылаются (import модуля или from ... import функции)
+    import inspect
+    import types
+    base = os.path.dirname(os.path.abspath(__file__))
+    here = os.path.abspath(__file__)
+
+    def local_file(obj) -> Optional[str]:
+        try:
+            path = os.path.abspath(inspect.getsourcefile(obj) or "")
+        except TypeError:
+            return None
+        return path if os.path.dirname(path) == base else None
+
+    def names(code) -> set:
+        out = set(code.co_names)
+        for c in code.co_consts:
+            if isinstance(c, types.CodeType):
+                out |= names(c)
+        return out
+
+    funcs: Dict[str, Any] = {}
+    files = {os.path.join(base, name) for name in GRAPHS_CODE_MODULES}
+    stack = [inspect.unwrap(node.func) for node in GRAPHS.nodes()]
+    while stack:
+        fn = stack.pop()
+        if fn.__qualname__ in funcs:
+            continue
+        funcs[fn.__qualname__] = fn
+        for name in names(fn.__code__):
+            obj = fn.__globals__.get(name)
+            if isinstance(obj, types.ModuleType):
+                path = local_file(obj)
+                if path and path != here:
+                    files.add(path)
+                continue
+            obj = inspect.unwrap(obj) if callable(obj) else obj
+            if not isinstance(obj, types.FunctionType):
+                continue
+            path = local_file(obj)
+            if path == here:
+                stack.append(obj)
+            elif path:
+                files.add(path)
+    return [funcs[k] for k in sorted(funcs)], sorted(files)
+
+
+@lru_cache(maxsize=1)
+def graphs_code_hash() -> str:
+    # Хэш исходников, от которых зависит результат compute_*: после деплоя с изменённой логикой
+    # строки кэша, посчитанные старым кодом, не совпадут по ref_version и будут пересчитаны
+    import inspect
+    h = hashlib.sha1()
+    funcs, files = _graphs_code_sources()
+    for fn in funcs:
+        try:
+            h.update(inspect.getsource(fn).encode("utf-8"))
+        except (OSError, TypeError):
+            h.update(fn.__qualname__.encode("utf-8"))
+    for path in files:
+        try:
+            with open(path, "rb") as f:
+                h.update(f.read())
+        except OSError:
+            h.update(os.path.basename(path).encode("utf-8"))
+    return h.hexdigest()[:12]
+
+def graphs_ref_version() -> str:
+    from graph import reference_data_version
+    return f"{GRAPHS_CODE_VERSION}.{graphs_code_hash()}:{reference_data_version()}"
+
+def graphs_content_hash(all_data: Dict[str, Any], overrides: Dict[str, Any], ref_version: str) -> str:
+    raw = json.dumps(
+        {"all_data": all_data, "overrides": overrides, "ref": ref_version},
+        ensure_ascii=False, sort_keys=True, default=str,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def _graphs_state_get(decl_id: int) -> Dict[str, Any]:
+    with _graphs_state_lock:
+        st = _graphs_state.get(int(decl_id))
+        if st is None:
+            return {}
+        _graphs_state.move_to_end(int(decl_id))
+        return dict(st)
+
+def _graphs_state_put(decl_id: int, **snapshots: Dict[str, Any]) -> None:
+    with _graphs_state_lock:
+        st = _graphs_state.setdefault(int(decl_id), {})
+        st.update(snapshots)
+        _graphs_state.move_to_end(int(decl_id))
+        while len(_graphs_state) > GRAPHS_STATE_MAX:
+            _graphs_state.popitem(last=False)
+
+# Разбивка по времени текущего запроса (для заголовка X-Graphs-Timing у админов)
+_graphs_trace: ContextVar[Optional[Dict[str, Any]]] = ContextVar("graphs_trace", default=None)
+
+def _trace_note(**kw) -> None:
+    t = _graphs_trace.get()
+    if t is not None:
+        t.update(kw)
+
+def _trace_evaluation(ev: GraphEvaluation) -> None:
+    t = _graphs_trace.get()
+    if t is None:
+        return
+    graphs = t.setdefault("graphs", {})
+    for n, sec in ev.timings.items():
+        graphs[n] = graphs.get(n, 0.0) + sec
+    for kind, secs in ev.lookups.items():
+        t.setdefault("lookups", {}).setdefault(kind, []).extend(secs)
+
+def _graphs_timing_header(t: Dict[str, Any], elapsed: float) -> str:
+    parts = [f"total={elapsed * 1000:.1f}", f"cache={t.get('cache', '-')}"]
+    for kind, secs in sorted((t.get("lookups") or {}).items()):
+        parts.append(f"{kind}={len(secs)}x{sum(secs) * 1000:.1f}")
+    for n, sec in sorted((t.get("graphs") or {}).items(), key=lambda kv: -kv[1]):
+        parts.append(f"{n}={sec * 1000:.1f}")
+    return "; ".join(parts)
+
+def _svh_outdated(snapshot: Optional[Dict[str, Any]]) -> bool:
+    # g30 снимка посчитан по записи svh_cache, которую с тех пор обновили (фоновое обновление с alta.ru)
+    import svh_cache
+    for tp, at in ((snapshot or {}).get("svh") or {}).items():
+        loaded = svh_cache.fetched_at(tp)
+        if loaded is not None and (at is None or loaded > at):
+            return True
+    return False
+
+def _evaluate_graphs(
+    prev: Optional[Dict[str, Any]],
+    all_data: Dict[str, Any],
+    overrides: Dict[str, Any],
+    sections: Dict[str, str],
+    ref_version: str,
+    names: Optional[List[str]] = None,
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    seed = None
+    if prev and prev.get("ref") == ref_version:
+        seed = GRAPHS.reusable(
+            prev["results"],
+            keys=changed_override_keys(prev["overrides"], overrides),
+            sections=changed_sections(prev["sections"], sections),
+        )
+        if _svh_outdated(prev):
+            refresh = GRAPHS.with_dependents({"g30"})
+            seed = {n: r for n, r in seed.items() if n not in refresh}
+    ev = GraphEvaluation(GRAPHS, all_data, overrides, seed=seed, workers=GRAPHS_IO_WORKERS, metrics=GRAPH_METRICS)
+    try:
+        graphs = ev.run(names)
+    finally:
+        _trace_evaluation(ev)
+    if names is not None:
+        graphs = ev.merged(names, with_deps=False)
+    # узлы с упавшим курсом ЦБ / СВХ в снимок не попадают — в следующий раз пересчитаются
+    unreliable = ev.unreliable()
+    svh: Dict[str, Optional[float]] = {}
+    tp = str((ev.results.get("g30") or {}).get("g30_3") or "").strip()
+    if tp and "g30" not in unreliable:
+        if seed and "g30" in seed and tp in (prev.get("svh") or {}):
+            svh[tp] = prev["svh"][tp]
+        else:
+            import svh_cache
+            svh[tp] = svh_cache.fetched_at(tp)
+    snapshot = {
+        "ref": ref_version,
+        "sections": sections,
+        "overrides": copy.deepcopy(overrides),
+        "results": {n: r for n, r in ev.results.items() if n not in unreliable},
+        "lookup_failed": sorted(unreliable),
+        "svh": svh,   # пост g30 -> время загрузки записи svh_cache, по которой он посчитан
+    }
+    return graphs, snapshot
+
+def _graphs_cache_store(decl_id: int, row: Optional[Dict[str, Any]], content_hash: str, ref_version: str,
+                        graphs: Dict[str, Any], snapshot: Optional[Dict[str, Any]]) -> None:
+    try:
+        graphs_cache_put(decl_id, (row or {}).get("generation"), content_hash, ref_version, graphs, snapshot)
+    except Exception as e:
+        print(f"[graphs-cache] Не удалось сохранить графы декларации {decl_id}: {e!r}")
+
+def _compute_and_cache_graphs(
+    decl_id: int,
+    row: Optional[Dict[str, Any]],
+    all_data: Dict[str, Any],
+    overrides: Dict[str, Any],
+    ref_version: str,
+    sections: Optional[Dict[str, str]] = None,
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    if sections is None:
+        sections = section_fingerprints(all_data)
+    prev = _graphs_state_get(decl_id).get("current") or (row or {}).get("nodes_json")
+    graphs, snapshot = _evaluate_graphs(prev, all_data, overrides, sections, ref_version)
+    _graphs_state_put(decl_id, current=snapshot)
+    if snapshot["lookup_failed"]:
+        # запасные значения вместо курса ЦБ / СВХ не кэшируем: следующий запрос посчитает заново
+        print(f"[graphs-cache] Декларация {decl_id}: внешние запросы не удались "
+              f"({', '.join(snapshot['lookup_failed'])}), графы в кэш не записаны")
+    else:
+        _graphs_cache_store(decl_id, row, graphs_content_hash(all_data, overrides, ref_version), ref_version,
+                            graphs, snapshot)
+    return graphs, snapshot
+
+def _pick_nodes(snapshot: Optional[Dict[str, Any]], names: List[str]) -> Optional[Dict[str, Any]]:
+    results = (snapshot or {}).get("results") or {}
+    if any(n not in results for n in names):
+        return None
     graphs: Dict[str, Any] = {}
-    graphs.update(compute_date_declararion(all_data, overrides))
-    graphs.update(compute_g1(all_data, overrides))
-    graphs.update(compute_g2(all_data, overrides))
-    graphs.update(compute_g3(all_data, overrides))
-    graphs.update(compute_g4(all_data, overrides))
-    graphs.update(compute_g5(all_data, overrides))
-    graphs.update(compute_g6(all_data, overrides))
-    graphs.update(compute_g7(all_data, overrides))
-    graphs.update(compute_g8(all_data, overrides))
-    graphs.update(compute_g9(all_data, overrides))
-    graphs.update(compute_g11(all_data, overrides))
-    graphs.update(compute_g12(all_data, overrides))
-    graphs.update(compute_g14(all_data, overrides))
-    graphs.update(compute_g15(all_data, overrides))
-    graphs.update(compute_g16(all_data, overrides))
-    graphs.update(compute_g17(all_data, overrides))
-    graphs.update(compute_g18(all_data, overrides)) 
-    graphs.update(compute_g19(all_data, overrides)) 
-    graphs.update(compute_g20(all_data, overrides)) 
-    graphs.update(compute_g21(all_data, overrides)) 
-    graphs.update(compute_g22(all_data, overrides)) 
-    graphs.update(compute_g23(all_data, overrides)) 
-    graphs.update(compute_g24(all_data, overrides)) 
-    graphs.update(compute_g25(all_data, overrides)) 
-    graphs.update(compute_g26(all_data, overrides)) 
-    graphs.update(compute_g29(all_data, overrides)) 
-    graphs.update(compute_g30(all_data, overrides)) 
-    graphs.update(compute_g31(all_data, overrides)) 
-    graphs.update(compute_g32(all_data, overrides)) 
-    graphs.update(compute_g33(all_data, overrides)) 
-    graphs.update(compute_g34(all_data, overrides)) 
-    graphs.update(compute_g35(all_data, overrides)) 
-    graphs.update(compute_g36(all_data, overrides)) 
-    graphs.update(compute_g37(all_data, overrides)) 
-    graphs.update(compute_g38(all_data, overrides)) 
-    graphs.update(compute_g39(all_data, overrides)) 
-    graphs.update(compute_g40(all_data, overrides)) 
-    graphs.update(compute_g41(all_data, overrides)) 
-    graphs.update(compute_g42(all_data, overrides)) 
-    graphs.update(compute_g43(all_data, overrides)) 
-    graphs.update(compute_g44(all_data, overrides)) 
-    graphs.update(compute_g45(all_data, overrides)) 
-    graphs.update(compute_g46(all_data, overrides)) 
-    graphs.update(compute_goods(all_data, overrides))
+    for n in names:
+        graphs.update(results[n])
+    return graphs
 
+def get_graphs_for_decl(decl_id: int, names: Optional[List[str]] = None) -> Dict[str, Any]:
+    # Свежая запись кэша — одно чтение из БД; устаревшая, но с тем же хэшем содержимого —
+    # переиспользуется без пересчёта; иначе пересчитываются только затронутые узлы.
+    # names — только эти графы (и их зависимости); частичный результат в кэш БД не пишется.
+    ref = graphs_ref_version()
+    try:
+        row = graphs_cache_get(decl_id)
+    except Exception as e:
+        print(f"[graphs-cache] Не удалось прочитать кэш графов декларации {decl_id}: {e!r}")
+        row = None
+
+    svh_outdated = bool(row) and _svh_outdated(row.get("nodes_json"))
+    if (row and not row.get("is_stale") and row.get("ref_version") == ref and row.get("graphs_json") is not None
+            and not svh_outdated):
+        _trace_note(cache="fresh")
+        if names is None:
+            return dict(row["graphs_json"])
+        picked = _pick_nodes(row.get("nodes_json"), names)
+        if picked is not None:
+            return picked
+
+    all_data = build_all_data_for_decl(decl_id)
+    overrides = get_overrides(decl_id) or {}
+    content_hash = graphs_content_hash(all_data, overrides, ref)
+    if (row and row.get("content_hash") == content_hash and row.get("graphs_json") is not None
+            and not svh_outdated):
+        _trace_note(cache="same-content")
+        if names is None:
+            graphs = dict(row["graphs_json"])
+            _graphs_cache_store(decl_id, row, content_hash, ref, graphs, row.get("nodes_json"))
+            return graphs
+        picked = _pick_nodes(row.get("nodes_json"), names)
+        if picked is not None:
+            return picked
+
+    _trace_note(cache="computed" if names is None else "partial")
+    if names is None:
+        graphs, _ = _compute_and_cache_graphs(decl_id, row, all_data, overrides, ref)
+        return graphs
+
+    prev = _graphs_state_get(decl_id).get("current") or (row or {}).get("nodes_json")
+    graphs, snapshot = _evaluate_graphs(prev, all_data, overrides, section_fingerprints(all_data), ref, names)
+    _graphs_state_put(decl_id, current=snapshot)
     return graphs
 
 ######################## Вывод на React ########################
@@ -6482,8 +6891,26 @@ class GraphsOut(BaseModel):
 class GraphsUpdateIn(BaseModel):
     changes: Dict[str, Any]
 
+class PackingMatchOut(BaseModel):
+    source: str
+    row: int
+    name: str
+    invoice_row: Optional[int] = None
+    invoice_name: str = ""
+    tnved: str = ""
+    match: str
+
+class PackingMatchesOut(BaseModel):
+    decl_id: int
+    matches: List[PackingMatchOut]
+
 @decl_router.get("/{decl_id}/graphs", response_model=GraphsOut)
-def api_get_graphs(decl_id: int, current=Depends(get_current_user)):
+def api_get_graphs(
+    decl_id: int,
+    response: Response,
+    fields: Optional[str] = Query(None, description="Графы через запятую: g30, g45_1_list, группы svh, customs_value, ..."),
+    current=Depends(get_current_user),
+):
     owner_id = int(get_declaration_user_id(int(decl_id)) or 0)
     if owner_id != int(current["id"]) and ((current.get("role") or "user") != "admin"):
         api_error(
@@ -6495,29 +6922,61 @@ def api_get_graphs(decl_id: int, current=Depends(get_current_user)):
         )
 
     require_declarant_access(current)
-    all_data = build_all_data_for_decl(decl_id)
-    overrides = get_overrides(decl_id)
-    graphs = compute_graphs(all_data, overrides)
+    names = None
+    if fields is not None:
+        names, unknown = GRAPHS.resolve_fields(fields.split(","), GRAPH_GROUPS)
+        if unknown or not names:
+            api_error(
+                400,
+                "UNKNOWN_GRAPH_FIELDS",
+                "Неизвестные графы в параметре fields.",
+                hint="Укажите имена графов (g30), ключи (g45_1_list) или группы: " + ", ".join(GRAPH_GROUPS),
+                details={"unknown": unknown},
+            )
+
+    trace: Optional[Dict[str, Any]] = {} if _norm_role(current) == "admin" else None
+    token = _graphs_trace.set(trace)
+    t0 = time.perf_counter()
+    try:
+        graphs = get_graphs_for_decl(decl_id, names)
+    finally:
+        _graphs_trace.reset(token)
+    if trace is not None:
+        response.headers["X-Graphs-Timing"] = _graphs_timing_header(trace, time.perf_counter() - t0)
     graphs["document_id"] = f"declaration_{str(decl_id)}"
     return GraphsOut(graphs=graphs)
 
 @decl_router.post("/{decl_id}/graphs", response_model=GraphsOut)
-def api_update_graphs(decl_id: int, body: GraphsUpdateIn, current=Depends(get_current_user)):
+def api_update_graphs(decl_id: int, body: GraphsUpdateIn, response: Response, current=Depends(get_current_user)):
     owner_id = int(get_declaration_user_id(int(decl_id)) or 0)
     if owner_id != int(current["id"]) and ((current.get("role") or "user") != "admin"):
         raise HTTPException(403, "Forbidden (not your declaration)")
 
     require_declarant_access(current)
+    trace: Optional[Dict[str, Any]] = {"cache": "computed"} if _norm_role(current) == "admin" else None
+    token = _graphs_trace.set(trace)
+    t0 = time.perf_counter()
+    try:
+        graphs = _update_graphs(decl_id, body.changes or {})
+    finally:
+        _graphs_trace.reset(token)
+    if trace is not None:
+        response.headers["X-Graphs-Timing"] = _graphs_timing_header(trace, time.perf_counter() - t0)
+    return GraphsOut(graphs=graphs)
+
+def _update_graphs(decl_id: int, changes: Dict[str, Any]) -> Dict[str, Any]:
     all_data = build_all_data_for_decl(decl_id)
     overrides = get_overrides(decl_id) or {}
-    changes = body.changes or {}
     for key, val in changes.items():
         if val in (None, "", [], {}):
             overrides.pop(key, None)
         else:
             overrides[key] = val
 
-    auto_graphs = compute_graphs(all_data, overrides={})
+    ref = graphs_ref_version()
+    sections = section_fingerprints(all_data)
+    auto_graphs, auto_snapshot = _evaluate_graphs(_graphs_state_get(decl_id).get("auto"), all_data, {}, sections, ref)
+    _graphs_state_put(decl_id, auto=auto_snapshot)
     for key in list(overrides.keys()):
         try:
             if overrides.get(key) == auto_graphs.get(key):
@@ -6526,9 +6985,30 @@ def api_update_graphs(decl_id: int, body: GraphsUpdateIn, current=Depends(get_cu
             pass
 
     save_overrides(decl_id, overrides)
-    graphs = compute_graphs(all_data, overrides)
+    try:
+        row = graphs_cache_get(decl_id)
+    except Exception:
+        row = None
+    graphs, _ = _compute_and_cache_graphs(decl_id, row, all_data, overrides, ref, sections)
     graphs["document_id"] = f"declaration_{decl_id}"
-    return GraphsOut(graphs=graphs)
+    return graphs
+
+@decl_router.get("/{decl_id}/packing-matches", response_model=PackingMatchesOut)
+def api_get_packing_matches(decl_id: int, current=Depends(get_current_user)):
+    from graph import packing_matches
+
+    owner_id = int(get_declaration_user_id(int(decl_id)) or 0)
+    if owner_id != int(current["id"]) and _norm_role(current) != "admin":
+        api_error(
+            403,
+            "FORBIDDEN_NOT_OWNER",
+            "Доступ запрещён",
+            details={"decl_id": int(decl_id), "owner_id": owner_id, "current_user_id": int(current["id"])},
+        )
+
+    require_declarant_access(current)
+    all_data = build_all_data_for_decl(decl_id)
+    return PackingMatchesOut(decl_id=int(decl_id), matches=[PackingMatchOut(**m) for m in packing_matches(all_data)])
 
 @graphs_router.get("/g30/by-tp")
 def api_compute_g30_by_tp(tp_code: str):
@@ -6568,7 +7048,47 @@ def _norm_list(payload: Dict[str, Any], list_key: str, scalar_key: str, n: int)
     return lst
 
 
-def fill_ESADout_CU_with_gt(payload: Dict[str, Any]) -> ESADout_CU:
+def fill_ESADout_CU_with_gt(payload: Dict[str, Any]) -> "ESADout_CU":
+    from xmlmap.ESADout_CU import (
+        DocumentID as ESADout_CU_DocumentID,
+        CustomsProcedure,
+        CustomsModeCode,
+        ElectronicDocumentSign,
+        RecipientCountryCode,
+        EECEDocHeaderAddInfo,
+        ESADout_CU,
+    )
+
+    from xmlmap.ESADout_CUGoodsShipment import (
+        ESADout_CUGoodsShipment,
+        ESADout_CUConsignor,
+        SubjectAddressDetails,
+        ESADout_CUConsignee,
+        ESADout_CUFinancialAdjustingResponsiblePerson,
+        RFOrganizationFeatures,
+        ESADout_CUDeclarant,
+        ESADout_CUConsigment,
+        BorderCustomsOffice,
+        RUTransportMeans,
+        ESADout_CUDepartureArrivalTransport,
+        ESADout_CUBorderTransport,
+        CUESADDeliveryTerms,
+        ESADout_CUMainContractTerms,
+        ESADout_CUGoodsLocation,
+        RegisterDocumentIdDetails,
+        GoodsGroupQuantity,
+        GoodsGroupInformation,
+        GoodsGroupDescription,
+        Preferencii,
+        DocumentPresentingDetails,
+        ESADout_CUPresentedDocument,
+        PackagePalleteInformation,
+        ESADGoodsPackaging,
+        ESADCustomsProcedure,
+        SupplementaryGoodsQuantity,
+        ESADout_CUGoods,
+    )
+
     g1_1 = payload.get("g1_1", "ИМ")
     g1_2 = payload.get("g1_2", "40")
     g1_3 = payload.get("g1_3", "ЭД")
@@ -6926,6 +7446,21 @@ def _payload_from_graphs(graphs: Dict[str, Any]) -> Dict[str, Any]:
     return payload
 
 
+def build_declaration_xml(decl_id: int) -> bytes:
+    graphs = get_graphs_for_decl(decl_id)
+    graphs["document_id"] = f"declaration_{str(decl_id)}"
+    payload = _payload_from_graphs(graphs)
+    esad = fill_ESADout_CU_with_gt(payload)
+    xml_elem = esad.to_xml()
+    from lxml import etree
+    return etree.tostring(
+        xml_elem,
+        encoding="utf-8",
+        xml_declaration=True,
+        pretty_print=True,
+    )
+
+
 @decl_router.get("/{decl_id}/xml")
 def api_get_declaration_xml(decl_id: int, current=Depends(get_current_user)):
     owner_id = int(get_declaration_user_id(int(decl_id)) or 0)
@@ -6941,19 +7476,7 @@ def api_get_declaration_xml(decl_id: int, current=Depends(get_current_user)):
 
     require_declarant_access(current)
     try:
-        all_data = build_all_data_for_decl(decl_id)
-        overrides = get_overrides(decl_id) or {}
-        graphs = compute_graphs(all_data, overrides)
-        graphs["document_id"] = f"declaration_{str(decl_id)}"
-        payload = _payload_from_graphs(graphs)
-        esad = fill_ESADout_CU_with_gt(payload)
-        xml_elem = esad.to_xml()
-        xml_bytes = etree.tostring(
-            xml_elem,
-            encoding="utf-8",
-            xml_declaration=True,
-            pretty_print=True,
-        )
+        xml_bytes = build_declaration_xml(decl_id)
 
         filename = f"declaration_{decl_id}.xml"
         try:
@@ -6989,6 +7512,125 @@ def api_get_declaration_xml(decl_id: int, current=Depends(get_current_user)):
         )
     
 
+######################## Пакетный пересчёт (админ) ########################
+
+GRAPHS_BATCH_WORKERS = int(os.getenv("GRAPHS_BATCH_WORKERS", "4"))
+GRAPHS_BATCH_MAX = int(os.getenv("GRAPHS_BATCH_MAX", "5000"))
+
+
+def _batch_error(e: Exception) -> Dict[str, Any]:
+    if isinstance(e, HTTPException) and isinstance(e.detail, dict):
+        return e.detail
+    return {"code": "INTERNAL_ERROR", "message": str(e) or e.__class__.__name__}
+
+
+def iter_declarations_batch(decl_ids: List[int], fn, workers: int = GRAPHS_BATCH_WORKERS):
+    """
+    fn(decl_id) для каждой декларации в пуле из workers потоков; отдаёт (decl_id, result, error, ms)
+    по мере готовности. Курсы ЦБ и СВХ кэшируются на весь пакет.
+    """
+    memo = Memo(keep_errors=False)
+
+    def one(decl_id: int):
+        t0 = time.perf_counter()
+        try:
+            with shared_memo(memo):
+                res = fn(decl_id)
+            return decl_id, res, None, int((time.perf_counter() - t0) * 1000)
+        except Exception as e:
+            return decl_id, None, e, int((time.perf_counter() - t0) * 1000)
+
+    pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="graphs-batch")
+    try:
+        futs = [pool.submit(one, d) for d in decl_ids]
+        for f in as_completed(futs):
+            yield f.result()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+@admin_router.post("/graphs/batch")
+def admin_graphs_batch(body: AdminGraphsBatchIn, current=Depends(require_admin)):
+    kind = (body.kind or "graphs").strip().lower()
+    if kind not in ("graphs", "xml"):
+        api_error(400, "BAD_BATCH_KIND", "kind должен быть graphs или xml.", details={"kind": body.kind})
+    if body.zip and kind != "xml":
+        api_error(400, "BAD_BATCH_FORMAT", "ZIP доступен только для kind=xml.")
+
+    names = None
+    if body.fields:
+        if kind != "graphs":
+            api_error(400, "BAD_BATCH_FORMAT", "fields применимо только для kind=graphs.")
+        names, unknown = GRAPHS.resolve_fields(body.fields, GRAPH_GROUPS)
+        if unknown or not names:
+            api_error(400, "UNKNOWN_GRAPH_FIELDS", "Неизвестные графы в fields.", details={"unknown": unknown})
+
+    if body.decl_ids is not None:
+        decl_ids = list(dict.fromkeys(int(x) for x in body.decl_ids))
+    else:
+        decl_ids = list_declaration_ids(
+            user_id=body.user_id,
+            created_from=body.created_from,
+            created_to=body.created_to,
+            stale_only=body.stale_only,
+            limit=max(1, min(int(body.limit), GRAPHS_BATCH_MAX)),
+        )
+    if len(decl_ids) > GRAPHS_BATCH_MAX:
+        api_error(
+            400,
+            "BATCH_TOO_LARGE",
+            "Слишком много деклараций в одном запросе.",
+            details={"count": len(decl_ids), "max": GRAPHS_BATCH_MAX},
+        )
+
+    workers = max(1, min(int(body.workers or GRAPHS_BATCH_WORKERS), GRAPHS_BATCH_WORKERS))
+    print(f"[graphs-batch] admin={current['id']} kind={kind} zip={body.zip} n={len(decl_ids)} workers={workers}")
+
+    if kind == "graphs":
+        def fn(decl_id: int):
+            graphs = get_graphs_for_decl(decl_id, names)
+            graphs["document_id"] = f"declaration_{str(decl_id)}"
+            return graphs
+    else:
+        fn = build_declaration_xml
+
+    if body.zip:
+        # ZIP собирается целиком: формат требует центральный каталог в конце архива
+        buf = io.BytesIO()
+        errors: Dict[str, Any] = {}
+        with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            for decl_id, xml_bytes, err, _ in iter_declarations_batch(decl_ids, fn, workers):
+                if err is not None:
+                    errors[str(decl_id)] = _batch_error(err)
+                else:
+                    zf.writestr(f"declaration_{decl_id}.xml", xml_bytes)
+            if errors:
+                zf.writestr("errors.json", json.dumps(errors, ensure_ascii=False, indent=2, default=str))
+        return Response(
+            content=buf.getvalue(),
+            media_type="application/zip",
+            headers={"Content-Disposition": 'attachment; filename="declarations_xml.zip"'},
+        )
+
+    def stream():
+        ok = failed = 0
+        for decl_id, res, err, ms in iter_declarations_batch(decl_ids, fn, workers):
+            line: Dict[str, Any] = {"decl_id": decl_id, "ok": err is None, "ms": ms}
+            if err is not None:
+                failed += 1
+                line["error"] = _batch_error(err)
+            elif kind == "xml":
+                ok += 1
+                line["xml"] = res.decode("utf-8")
+            else:
+                ok += 1
+                line["graphs"] = res
+            yield json.dumps(line, ensure_ascii=False, default=str) + "\n"
+        yield json.dumps({"done": True, "total": len(decl_ids), "ok": ok, "failed": failed}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
 app.include_router(auth_router)
 app.include_router(users_router)
 app.include_router(decl_router)
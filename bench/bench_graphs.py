@@ -0,0 +1,130 @@
+# bench/bench_graphs.py
+# Замер compute_graphs на синтетических декларациях.
+#   python -m bench.bench_graphs --sizes 1,100,1000,10000 --repeat 3 --json bench_graphs.json
+# Внешние запросы (курс ЦБ, СВХ alta.ru) подменяются локальными заглушками; --latency-ms имитирует сеть.
+# СВХ кэшируются в памяти (svh_cache), так что задержка alta.ru видна только в первом прогоне поста.
+import argparse
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+from decimal import Decimal
+from typing import Any, Dict, List
+
+from bench.synthetic import TRANSPORTS, make_all_data
+
+RATES = {"USD": Decimal("92.5"), "EUR": Decimal("100.25"), "CNY": Decimal("12.7")}
+LOOKUPS: List[tuple] = []
+
+
+def install_stubs(latency_ms: float = 0.0) -> None:
+    import parser_cbrf
+    import parcer_alta_tam
+    import svh_cache
+
+    def cb_rate(date_ddmmyyyy, currency_code):
+        LOOKUPS.append(("cb_rate", date_ddmmyyyy, currency_code))
+        if latency_ms:
+            time.sleep(latency_ms / 1000)
+        return RATES.get(str(currency_code).upper(), Decimal("1"))
+
+    def get_svh_data(kod_tp):
+        LOOKUPS.append(("svh", kod_tp))
+        if latency_ms:
+            time.sleep(latency_ms / 1000)
+        return {
+            "СВХ 1": {
+                "Наименование СВХ": "СВХ ТЕСТ",
+                "Номер лицензии": "10702/1",
+                "Дата лицензии": "2020-01-01",
+                "Адрес": "RU-690000, ПРИМОРСКИЙ КРАЙ, Г. ВЛАДИВОСТОК, УЛ. ЛЕНИНА, Д. 1",
+                "CountryCode": "RU",
+                "CountryName": "РОССИЯ",
+                "Region": "ПРИМОРСКИЙ КРАЙ",
+                "City": "Г. ВЛАДИВОСТОК",
+                "StreetHouse": "УЛ. ЛЕНИНА, Д. 1",
+            }
+        }
+
+    parser_cbrf.cb_rate = cb_rate
+    parcer_alta_tam.get_svh_data = get_svh_data
+    svh_cache.SVH_CACHE_DB = False
+
+
+def run_case(B, all_data: Dict[str, Any], repeat: int) -> Dict[str, Any]:
+    totals: List[float] = []
+    per_graph: Dict[str, List[float]] = {}
+    lookups = 0
+    for _ in range(repeat):
+        LOOKUPS.clear()
+        ev = B.GraphEvaluation(B.GRAPHS, all_data, {}, workers=B.GRAPHS_IO_WORKERS)
+        t0 = time.perf_counter()
+        ev.run()
+        totals.append(time.perf_counter() - t0)
+        lookups = len(LOOKUPS)
+        for name, sec in ev.timings.items():
+            per_graph.setdefault(name, []).append(sec)
+
+    # память — отдельным прогоном, tracemalloc заметно замедляет расчёт
+    tracemalloc.start()
+    B.GraphEvaluation(B.GRAPHS, all_data, {}, workers=B.GRAPHS_IO_WORKERS).run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "total_ms": round(statistics.median(totals) * 1000, 2),
+        "total_ms_min": round(min(totals) * 1000, 2),
+        "peak_mb": round(peak / 2**20, 2),
+        "lookups": lookups,
+        "graphs_ms": {n: round(statistics.median(v) * 1000, 3) for n, v in per_graph.items()},
+    }
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Бенчмарк compute_graphs")
+    ap.add_argument("--sizes", default="1,10,100,1000", help="число строк товаров, через запятую (до 10000)")
+    ap.add_argument("--transports", default=",".join(TRANSPORTS))
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="задержка заглушек курса ЦБ и СВХ")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="GRAPHS_IO_WORKERS на время замера; 1 — последовательно, чистое время по графам")
+    ap.add_argument("--top", type=int, default=5, help="сколько самых медленных графов показать")
+    ap.add_argument("--json", dest="json_out", default="", help="сохранить полный отчёт в файл")
+    args = ap.parse_args(argv)
+
+    sizes = [int(x) for x in args.sizes.split(",") if x.strip()]
+    transports = [t.strip() for t in args.transports.split(",") if t.strip()]
+
+    install_stubs(args.latency_ms)
+    t0 = time.perf_counter()
+    import backend_API as B
+    print(f"[bench] import backend_API: {(time.perf_counter() - t0) * 1000:.0f} ms")
+    B.GRAPHS_IO_WORKERS = max(1, args.workers)
+
+    # прогрев справочников (classifier/*.csv, lru-кэши graph.py)
+    B.compute_graphs(make_all_data(3, transports[0], seed=args.seed), {})
+
+    report = []
+    print(f"{'goods':>6} {'transport':<15} {'total ms':>10} {'peak MB':>8} {'lookups':>7}  slowest graphs")
+    for n in sizes:
+        for tr in transports:
+            all_data = make_all_data(n, tr, seed=args.seed)
+            res = run_case(B, all_data, max(1, args.repeat))
+            res.update({"goods": n, "transport": tr})
+            report.append(res)
+            slow = sorted(res["graphs_ms"].items(), key=lambda kv: -kv[1])[: args.top]
+            slow_s = ", ".join(f"{k} {v:.1f}" for k, v in slow)
+            print(f"{n:>6} {tr:<15} {res['total_ms']:>10.1f} {res['peak_mb']:>8.1f} {res['lookups']:>7}  {slow_s}")
+            sys.stdout.flush()
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"[bench] отчёт: {args.json_out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
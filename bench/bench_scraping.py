@@ -0,0 +1,139 @@
+# bench/bench_scraping.py
+# Разбор сохранённых страниц cbr.ru и alta.ru: прежний BeautifulSoup (html.parser) против scraping (lxml + XPath).
+#   python -m bench.bench_scraping --repeat 50 --json bench_scraping.json
+# Заодно сверяет результаты: расхождение с прежним разбором — код возврата 1.
+import argparse
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import scraping
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+
+
+# ---------- прежний разбор (BeautifulSoup), только для сравнения ----------
+
+def bs4_cbr_rows(html_data: str):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html_data, "html.parser")
+    for t in soup.find_all("table"):
+        headers = " ".join([th.get_text(strip=True).upper() for th in t.find_all("th")])
+        if "ВАЛЮТА" in headers and "КУРС" in headers:
+            return [[td.get_text(" ", strip=True) for td in tr.find_all(["td", "th"])] for tr in t.find_all("tr")]
+    return None
+
+
+def bs4_svh_boxes(html_data: str):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html_data, "html.parser")
+    out = []
+    for svh in soup.find_all("div", attrs={"boxSubstrate boxSubstrate-offset-0 p-10 mb10"}):
+        a = svh.find("a")
+        if not a:
+            continue
+        name_el = svh.find("div", attrs={"h3"})
+        addr_el = svh.find("div", attrs={"pTam_fieldColumn pTam_fieldColumn-list pTam_fieldColumn-left lightgray"})
+        lic_el = svh.find("div", attrs={"pTam_fieldColumn pTam_fieldColumn-list pTam_fieldColumn-right"})
+        out.append({
+            "href": a.get("href"),
+            "name": name_el.text if name_el else "",
+            "address": addr_el.text if addr_el else "",
+            "license": lic_el.text if lic_el else "",
+        })
+    return out
+
+
+def bs4_tp_title(html_data: str) -> str:
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html_data, "html.parser")
+    box = soup.find("div", attrs={"pTam_right boxSubstrate boxSubstrate-offset-0 mb10"})
+    h1 = (box.find("h1") if box else None) or soup.find("h1")
+    return h1.get_text(strip=True) if h1 else ""
+
+
+def bs4_links(html_data: str):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html_data, "html.parser")
+    return [(a["href"], a.get_text(" ", strip=True)) for a in soup.find_all("a", href=True)]
+
+
+# ---------- замер ----------
+
+def _normalize(value):
+    # пробелы внутри текста html.parser и lxml отдают одинаково, но сверяем без учёта их количества
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def _time(fn: Callable[[str], Any], html_data: str, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(html_data)
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples)
+
+
+def cases() -> List[Dict[str, Any]]:
+    out = []
+    for path in sorted((FIXTURES / "cbr").glob("*.html")):
+        out.append({"page": f"cbr/{path.name}", "old": bs4_cbr_rows, "new": scraping.cbr_rate_rows,
+                    "html": path.read_text(encoding="utf-8")})
+    for path in sorted((FIXTURES / "alta").glob("*.html")):
+        html_data = path.read_text(encoding="utf-8")
+        if path.stem == "index" or len(path.stem) < 8:
+            out.append({"page": f"alta/{path.name} links", "old": bs4_links, "new": scraping.alta_links,
+                        "html": html_data})
+        else:
+            out.append({"page": f"alta/{path.name} svh", "old": bs4_svh_boxes, "new": scraping.alta_svh_boxes,
+                        "html": html_data})
+            out.append({"page": f"alta/{path.name} title", "old": bs4_tp_title, "new": scraping.alta_tp_title,
+                        "html": html_data})
+    return out
+
+
+def run(repeat: int) -> List[Dict[str, Any]]:
+    report = []
+    for c in cases():
+        same = _normalize(c["old"](c["html"])) == _normalize(c["new"](c["html"]))
+        old_ms = _time(c["old"], c["html"], repeat)
+        new_ms = _time(c["new"], c["html"], repeat)
+        report.append({
+            "page": c["page"],
+            "kb": round(len(c["html"].encode("utf-8")) / 1024, 1),
+            "bs4_ms": round(old_ms, 3),
+            "lxml_ms": round(new_ms, 3),
+            "speedup": round(old_ms / new_ms, 1) if new_ms else None,
+            "same": same,
+        })
+    return report
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Замер разбора HTML: BeautifulSoup против lxml")
+    ap.add_argument("--repeat", type=int, default=30)
+    ap.add_argument("--json", dest="json_out", default="", help="сохранить отчёт в файл")
+    args = ap.parse_args(argv)
+
+    report = run(args.repeat)
+    print(f"{'страница':<32}{'KB':>7}{'bs4, ms':>10}{'lxml, ms':>10}{'x':>6}  совпадает")
+    for r in report:
+        print(f"{r['page']:<32}{r['kb']:>7}{r['bs4_ms']:>10}{r['lxml_ms']:>10}{r['speedup']:>6}  {r['same']}")
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0 if all(r["same"] for r in report) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+# bench/import_report.py
+# Время импорта модуля по зависимостям (python -X importtime в отдельном процессе) и RSS после импорта.
+#   python -m bench.import_report --module backend_API --top 25 --budget-ms 800
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+_PROBE = (
+    "import resource, sys, time\n"
+    "t0 = time.perf_counter()\n"
+    "import {module}\n"
+    "ms = (time.perf_counter() - t0) * 1000\n"
+    "rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024\n"
+    "print('@@report', round(ms, 1), round(rss, 1), file=sys.stderr)\n"
+)
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, float, float, int]]:
+    # строки "import time: self [us] | cumulative | imported package" -> (модуль, self_ms, cumulative_ms, глубина)
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cum_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        rows.append((name.strip(), int(self_us) / 1000, int(cum_us) / 1000, depth))
+    return rows
+
+
+def by_top_package(rows: List[Tuple[str, float, float, int]]) -> Dict[str, float]:
+    # собственное время всех подмодулей, сложенное по пакету верхнего уровня (pandas.core.* -> pandas)
+    out: Dict[str, float] = {}
+    for name, self_ms, _, _ in rows:
+        top = name.split(".", 1)[0]
+        out[top] = out.get(top, 0.0) + self_ms
+    return out
+
+
+def run(module: str) -> Dict[str, object]:
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROBE.format(module=module)],
+        capture_output=True, text=True, env=env,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} завершился с ошибкой:\n{proc.stderr[-2000:]}")
+
+    total_ms, rss_mb = 0.0, 0.0
+    for line in proc.stderr.splitlines():
+        if line.startswith("@@report"):
+            _, total_ms, rss_mb = line.split()
+    rows = parse_importtime(proc.stderr)
+    return {
+        "module": module,
+        "total_ms": float(total_ms),
+        "rss_mb": float(rss_mb),
+        "modules": len(rows),
+        "packages_ms": dict(sorted(((k, round(v, 1)) for k, v in by_top_package(rows).items()),
+                                   key=lambda kv: -kv[1])),
+    }
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Отчёт о времени импорта")
+    ap.add_argument("--module", default="backend_API")
+    ap.add_argument("--top", type=int, default=20, help="сколько самых тяжёлых пакетов показать")
+    ap.add_argument("--budget-ms", type=float, default=0.0, help="код возврата 1, если импорт дольше")
+    ap.add_argument("--json", dest="json_out", default="", help="сохранить отчёт в файл")
+    args = ap.parse_args(argv)
+
+    report = run(args.module)
+    print(f"[import] {report['module']}: {report['total_ms']:.0f} ms, "
+          f"RSS {report['rss_mb']:.0f} MB, модулей {report['modules']}")
+    for name, ms in list(report["packages_ms"].items())[: args.top]:
+        print(f"{ms:>9.1f} ms  {name}")
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.budget_ms and report["total_ms"] > args.budget_ms:
+        print(f"[import] бюджет {args.budget_ms:.0f} ms превышен")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
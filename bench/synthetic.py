@@ -0,0 +1,169 @@
+# bench/synthetic.py
+# Генератор синтетических all_data для замеров compute_graphs
+import random
+from typing import Any, Dict
+
+TRANSPORTS = ("transport_road", "transport_air", "transport_rail", "transport_sea")
+
+NAMES = [
+    "BRAKE PAD", "OIL FILTER", "AIR FILTER", "SPARK PLUG", "WIPER BLADE", "HEADLIGHT", "RADIATOR",
+    "CLUTCH DISC", "SHOCK ABSORBER", "TIMING BELT", "WATER PUMP", "FUEL PUMP", "ALTERNATOR",
+    "КОЛОДКИ ТОРМОЗНЫЕ", "ФИЛЬТР МАСЛЯНЫЙ", "РЕМЕНЬ ГРМ",
+]
+CODES = [
+    "8708301009", "8421230000", "8421310000", "8511100000", "8512400000", "8512209000",
+    "8708913509", "4016930005", "8483102100", "7318158900",
+]
+UNITS = ["PCS", "ШТ", "KG", "SET", "М2", "PAIRS", "", "pcs.", "КГ", "компл"]
+COUNTRIES = ["CHINA", "КИТАЙ", "CN", "GERMANY", "ГЕРМАНИЯ", "P.R.CHINA", "", "JAPAN", "ЯПОНИЯ"]
+
+
+def _num(rnd: random.Random, lo: float, hi: float, comma: bool) -> str:
+    s = f"{rnd.uniform(lo, hi):.3f}"
+    return s.replace(".", ",") if comma else s
+
+
+def make_all_data(
+    n_goods: int,
+    transport: str = "transport_road",
+    seed: int = 1,
+    currency: str = "USD",
+    tp_code: str = "10702070",
+) -> Dict[str, Any]:
+    """
+    Документы декларации так, как их отдаёт build_all_data_for_decl: invoice, packing (с перевозочным
+    листом), contract, payment и один transport_*. Наименования в packing частично расходятся с инвойсом
+    (регистр, хвосты, обрезанные модели), веса и количества — в разных форматах.
+    """
+    if transport not in TRANSPORTS:
+        raise ValueError(f"transport должен быть одним из {TRANSPORTS}")
+    rnd = random.Random(seed)
+    n_codes = max(1, min(len(CODES), n_goods // 3 + 1))
+
+    inv_goods, pack_goods, pack_tr = [], [], []
+    for i in range(n_goods):
+        name = f"{rnd.choice(NAMES)} MODEL {i % 37}-{i // 37}"
+        code = rnd.choice(CODES[:n_codes])
+        qty = rnd.randint(1, 500)
+        price = round(rnd.uniform(0.5, 300), 2)
+        g = {
+            "Наименование": name,
+            "Код ТНВЭД": code,
+            "Количество": str(qty),
+            "Цена": f"{price}".replace(".", ","),
+            "Стоимость": "" if i % 5 == 0 else f"{qty * price:.2f}",
+            "Единица измерения": rnd.choice(UNITS),
+            "Страна-производитель": rnd.choice(COUNTRIES),
+            "Валюта": currency,
+        }
+        if i % 7 == 0:
+            g["Техническое описание"] = f"ТЕХ ОПИСАНИЕ {i}"
+        inv_goods.append(g)
+
+        if i % 11 == 0:
+            pname = name.split(" MODEL")[0]
+        elif i % 3 == 0:
+            pname = name + " EXTRA"
+        else:
+            pname = name.lower()
+        pack_goods.append({
+            "Наименование": pname,
+            "Масса брутто": _num(rnd, 1, 100, True) + (" kg" if i % 4 == 0 else ""),
+            "Масса нетто": _num(rnd, 1, 90, i % 2 == 0),
+            "Количество мест": str(rnd.randint(1, 9)) if i % 6 else "2 pkgs",
+        })
+        pack_tr.append({
+            "Наименование": name,
+            "Количество": str(qty),
+            "Цена": str(price),
+            "Стоимость": f"{qty * price:.2f}",
+            "Страна происхождения": rnd.choice(COUNTRIES),
+        })
+
+    d: Dict[str, Any] = {
+        "declaration": {"Дата декларации": "15.03.2025", "date": "15.03.2025"},
+        "invoice": {
+            "Общая информация": {
+                "Номер инвойса": "INV-001/25",
+                "Дата инвойса": "01.03.2025",
+                "Условия поставки (Incoterms)": "FCA Shanghai, China",
+            },
+            "Отправитель": {
+                "Название компании": "HUBEI BAYER AUTO TECH CO., LTD",
+                "Страна": "CHINA",
+                "Юридический адрес": {
+                    "Полностью": "NO.117-28, WANTONG INDUSTRY AREA, SHIYAN CITY, HUBEI PROVINCE, 442000 CHINA",
+                    "Город": "SHIYAN",
+                },
+            },
+            "Получатель": {
+                "Название компании": "ООО РОМАШКА",
+                "Страна": "РОССИЯ",
+                "ИНН": "7701234567",
+                "Юридический адрес": {"Полностью": "123456, Москва, ул. Ленина, д. 1"},
+            },
+            "Товары": inv_goods,
+        },
+        "packing": {"Товары": pack_goods, "Перевозка": {"Товары": pack_tr}},
+        "contract": {
+            "Общая информация": {
+                "Номер контракта": "CN-77/2024",
+                "Дата заключения": "2024-05-10",
+                "Стороны": {
+                    "Отправитель": {"Страна": "КИТАЙ"},
+                    "Получатель": {"Название компании": "ООО РОМАШКА"},
+                },
+                "Декларант": {"Название компании": "ООО БРОКЕР"},
+            },
+            "Оплата контракта": {"Общая сумма": "150000,50"},
+            "Поставка": {"Условия поставки (Incoterms)": "FCA"},
+        },
+        "payment": {
+            "Общая информация": {"Номер счета": "77", "Дата счета": "05.03.2025", "Валюта документа": currency},
+            "Покупатель (Заказчик)": {"Страна": "КИТАЙ"},
+            "Перевозка": [
+                {"Услуга": {"Описание": "Перевозка до границы", "Сумма": "1200"}, "Маршрут": {"Откуда": "Shanghai"}},
+                {"Услуга": {"Описание": "Страхование груза", "Сумма": "150,5"}, "Маршрут": {"Откуда": "Shanghai"}},
+                {"Услуга": {"Описание": "Продолжение перевозки", "Сумма": "800"}, "Маршрут": {"Откуда": "Забайкальск"}},
+            ],
+        },
+    }
+
+    tp = {"Таможенный пост": {"Код ТП": tp_code}}
+    if transport == "transport_road":
+        d[transport] = {
+            "Перевозка": {
+                "Регистрационный номер": {"Тягач": ["A123BC77"], "Прицеп": ["AB1234567"]},
+                "Место погрузки": {"Страна": "КИТАЙ"},
+                "Место разгрузки": {"Страна": "РОССИЯ"},
+            },
+            "Общая информация": {"Номер CMR": "CMR 5531", "Дата CMR": "02.03.2025"},
+            **tp,
+        }
+    elif transport == "transport_air":
+        d[transport] = {
+            "Перевозка": {
+                "Перевозчик": {"Номер рейса": "SU 204"},
+                "Аэропорт отправления": {"Страна": "CN"},
+                "Аэропорт назначения": {"Страна": "RU"},
+            },
+            "Общая информация": {"Номер авианакладной": "555-12345675"},
+            **tp,
+        }
+    elif transport == "transport_rail":
+        d[transport] = {
+            "Перевозка": {
+                "Вагон": "Вагон 5123456789",
+                "Станция отправления": {"Страна": "CN"},
+                "Станция назначения": {"Страна": "RU"},
+            },
+            "Общая информация": {"Номер накладной": "ЖД 11"},
+            **tp,
+        }
+    else:
+        d[transport] = {
+            "Перевозка": {"Отправитель": {"Страна": "CHINA"}},
+            "Общая информация": {"B/L No": "BL-7781"},
+            **tp,
+        }
+    return d
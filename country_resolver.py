@@ -0,0 +1,186 @@
+# country_resolver.py
+# Нечёткое распознавание стран в строках после OCR/LLM: "P.R.CHINA", "Китайская Нар. Респ.", "GERMNAY".
+# Индекс строится один раз на снимок справочников (refdata) по всем написаниям из countries_classificator.csv.
+import re
+import threading
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from refdata import ReferenceData, get_refdata
+
+MIN_SCORE = 0.8          # ниже — считаем, что страна не распознана
+_MIN_TOKEN_KEY = 4       # короткие токены ("CO", "RU") внутри строки не считаем страной: слишком много ложных
+
+_SPLIT_RE = re.compile(r"[^0-9A-ZА-Я]+")
+
+
+class CountryMatch(NamedTuple):
+    name: str       # краткое название (ShortName)
+    alpha2: str
+    score: float    # 1.0 — точное совпадение написания
+    matched: str    # написание из справочника, с которым совпало
+
+
+def _tokens(s: str) -> List[str]:
+    s = str(s or "").upper().replace("Ё", "Е")
+    return [t for t in _SPLIT_RE.split(s) if t]
+
+
+def _trigrams(s: str) -> Set[str]:
+    s = f"  {s} "
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+def _edit_distance(a: str, b: str) -> int:
+    # Левенштейн с перестановкой соседних букв (GERMNAY -> GERMANY — одна правка)
+    prev2: List[int] = []
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        prev2, prev = prev, cur
+    return prev[-1]
+
+
+def _max_edits(n: int) -> int:
+    # опечатка OCR — одна-две правки; больше — уже другое название ("РЕСПУБЛИКА КОРЕЯ" != "РЕСПУБЛИКА КОНГО")
+    return 1 if n <= 8 else 2 if n <= 16 else 3
+
+
+def _prefix_score(q: List[str], s: List[str]) -> float:
+    # Сокращения по словам: "КИТАЙСКАЯ НАР РЕСП" ~ "КИТАЙСКАЯ НАРОДНАЯ РЕСПУБЛИКА";
+    # каждое слово запроса — начало слова написания на той же позиции.
+    if len(q) < 2 or len(q) != len(s):
+        return 0.0
+    if not all(b.startswith(a) for a, b in zip(q, s)):
+        return 0.0
+    # полные слова весят больше сокращений: "К Н Р" порог не проходит
+    return 0.75 + 0.25 * sum(len(a) for a in q) / sum(len(b) for b in s)
+
+
+class CountryResolver:
+    def __init__(self, ref: ReferenceData):
+        self.version = ref.version
+        self._entries: List[Tuple[str, List[str], str, str]] = []   # (compact, tokens, short, spelling)
+        self._by_compact: Dict[str, int] = {}
+        self._by_words: Dict[Tuple[str, ...], int] = {}        # слова в любом порядке: "РЕСПУБЛИКА КОРЕЯ"
+        self._by_trigram: Dict[str, List[int]] = {}
+        self._by_shape: Dict[Tuple[str, int], List[int]] = {}  # (первая буква, число слов) -> написания
+        self._runs: Set[Tuple[str, ...]] = set()                # подряд идущие слова написаний (от двух)
+
+        for spelling, short in ref.country_short_by_any.items():
+            toks = _tokens(spelling)
+            compact = "".join(toks)
+            if not compact or compact in self._by_compact:
+                continue
+            alpha2 = ref.country_alpha2_by_any.get(str(short).strip().upper()) or ref.country_alpha2_by_any.get(spelling, "")
+            i = len(self._entries)
+            self._entries.append((compact, toks, short, alpha2))
+            self._by_compact[compact] = i
+            self._by_words.setdefault(tuple(sorted(toks)), i)
+            for g in _trigrams(compact):
+                self._by_trigram.setdefault(g, []).append(i)
+            self._by_shape.setdefault((toks[0][:1], len(toks)), []).append(i)
+            for a in range(len(toks)):
+                for b in range(a + 2, len(toks) + 1):
+                    self._runs.add(tuple(toks[a:b]))
+
+    def _match(self, i: int, score: float) -> CountryMatch:
+        compact, _, short, alpha2 = self._entries[i]
+        return CountryMatch(short, alpha2, round(score, 3), compact)
+
+    def resolve(self, text: str, min_score: float = MIN_SCORE) -> Optional[CountryMatch]:
+        toks = _tokens(text)
+        if not toks:
+            return None
+        compact = "".join(toks)
+
+        # 1) то же написание без учёта знаков препинания и пробелов
+        i = self._by_compact.get(compact)
+        if i is not None:
+            return self._match(i, 1.0)
+
+        i = self._by_words.get(tuple(sorted(toks)))
+        if i is not None:
+            return self._match(i, 0.95)
+
+        # 2) страна — отдельный фрагмент строки: "P.R.CHINA", "MADE IN GERMANY".
+        # Фрагмент не засчитывается, если вместе с соседним словом он — часть более длинного написания:
+        # "NEW GUINEA" — это кусок "PAPUA NEW GUINEA", а не Гвинея
+        n = len(toks)
+        for size in range(n - 1, 0, -1):
+            for start in range(0, n - size + 1):
+                key = "".join(toks[start:start + size])
+                if len(key) < _MIN_TOKEN_KEY or key not in self._by_compact:
+                    continue
+                left = start > 0 and tuple(toks[start - 1:start + size]) in self._runs
+                right = start + size < n and tuple(toks[start:start + size + 1]) in self._runs
+                if not (left or right):
+                    return self._match(self._by_compact[key], 0.9)
+
+        best, best_score = None, 0.0
+
+        # 3) сокращения по словам
+        if n > 1:
+            for j in self._by_shape.get((toks[0][:1], n), ()):
+                score = _prefix_score(toks, self._entries[j][1])
+                if score > best_score:
+                    best, best_score = j, score
+
+        # 4) опечатки: кандидаты по общим триграммам, для лучших — расстояние Левенштейна
+        grams = _trigrams(compact)
+        hits: Dict[int, int] = {}
+        for g in grams:
+            for j in self._by_trigram.get(g, ()):
+                hits[j] = hits.get(j, 0) + 1
+        for j, common in sorted(hits.items(), key=lambda kv: -kv[1])[:15]:
+            e_compact = self._entries[j][0]
+            if 2.0 * common / (len(grams) + len(e_compact) + 2) < 0.4:
+                continue
+            longest = max(len(compact), len(e_compact))
+            dist = _edit_distance(compact, e_compact)
+            if dist > _max_edits(longest):
+                continue
+            score = 1.0 - dist / longest
+            if score > best_score:
+                best, best_score = j, score
+
+        if best is None or best_score < min_score:
+            return None
+        return self._match(best, best_score)
+
+
+_resolver: Optional[CountryResolver] = None
+_lock = threading.Lock()
+
+
+def get_resolver() -> CountryResolver:
+    # Пересобирается, если справочники перезагрузили с другой версией
+    global _resolver
+    ref = get_refdata()
+    r = _resolver
+    if r is None or r.version != ref.version:
+        with _lock:
+            if _resolver is None or _resolver.version != ref.version:
+                _resolver = CountryResolver(ref)
+                _resolve_cached.cache_clear()
+            r = _resolver
+    return r
+
+
+@lru_cache(maxsize=8192)
+def _resolve_cached(version: str, text: str, min_score: float) -> Optional[CountryMatch]:
+    return get_resolver().resolve(text, min_score)
+
+
+def resolve_country(text, min_score: float = MIN_SCORE) -> Optional[CountryMatch]:
+    if text is None:
+        return None
+    text = str(text).strip()
+    if not text:
+        return None
+    return _resolve_cached(get_resolver().version, text, min_score)
@@ -0,0 +1,272 @@
+# customs_directory.py
+# Локальный справочник таможенных постов и их СВХ (alta.ru/tam/): обход сайта, поиск по коду и названию.
+#   python customs_directory.py crawl                     — загрузить новые посты, продолжить прерванный обход
+#   python customs_directory.py crawl --refresh-days 30   — заодно перезагрузить посты старше 30 дней
+#   python customs_directory.py crawl --fixtures bench/fixtures/alta --dry-run   — по сохранённым страницам, без БД
+# СВХ пишутся в svh_cache — compute_g30 и /graphs/g30/by-tp берут их оттуда без похода на alta.ru.
+import argparse
+import bisect
+import json
+import re
+import sys
+import threading
+import time
+import urllib.parse
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import parcer_alta_tam
+
+DIRECTORY_TTL = 600.0          # как часто поиск перечитывает customs_posts
+_SPLIT_RE = re.compile(r"[^0-9A-ZА-Я]+")
+
+
+def _tokens(s: str) -> List[str]:
+    return [t for t in _SPLIT_RE.split(str(s or "").upper().replace("Ё", "Е")) if t]
+
+
+def _trigrams(s: str) -> set:
+    s = f"  {s} "
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+# ---------- Обход alta.ru ----------
+
+def _no_svh(svh: Dict[str, Any]) -> bool:
+    # parse_svh_page для поста без СВХ отдаёт заглушку {"Наименование СВХ": "Не найдено СВХ..."}
+    return not svh or "Наименование СВХ" in svh
+
+
+def fixture_fetcher(fixtures_dir) -> Callable[[str], str]:
+    # URL -> файл: .../tam/ -> index.html, .../tam/10702030/ -> 10702030.html
+    root = Path(fixtures_dir)
+
+    def fetch(url: str) -> str:
+        code = urllib.parse.urlparse(url).path.rstrip("/").rsplit("/", 1)[-1]
+        path = root / ("index.html" if code == "tam" else f"{code}.html")
+        return path.read_text(encoding="utf-8")
+
+    return fetch
+
+
+def discover(fetch_html: Callable[[str], str], delay: float = 0.0) -> List[Dict[str, Any]]:
+    # Обход в ширину от alta.ru/tam/: управления и таможни (код короче 8 цифр) раскрываются,
+    # посты (8 цифр) собираются вместе с текстом ссылки и кодом родителя.
+    found: Dict[str, Dict[str, Any]] = {}
+    seen = {""}
+    queue = deque([("", parcer_alta_tam.base_url)])
+    while queue:
+        parent, url = queue.popleft()
+        try:
+            html = fetch_html(url)
+        except Exception as e:
+            print(f"[customs] {url}: {e!r}")
+            continue
+        for code, text in parcer_alta_tam.parse_tp_links(html):
+            if code in seen:
+                continue
+            seen.add(code)
+            found[code] = {"code": code, "name": text, "parent_code": parent or None}
+            if len(code) < 8:
+                queue.append((code, parcer_alta_tam.tp_url(code)))
+        if delay:
+            time.sleep(delay)
+    return list(found.values())
+
+
+def crawl_post(code: str, fetch_html: Callable[[str], str]) -> Tuple[str, Dict[str, Any]]:
+    html = fetch_html(parcer_alta_tam.tp_url(code))
+    return parcer_alta_tam.parse_tp_name(html), parcer_alta_tam.parse_svh_page(html, code)
+
+
+def crawl(
+    fetch_html: Callable[[str], str] = parcer_alta_tam.get_html_data,
+    save: bool = True,
+    refresh_days: Optional[float] = None,
+    limit: Optional[int] = None,
+    delay: float = 0.5,
+) -> Dict[str, Any]:
+    """
+    Загрузить все посты и их СВХ. С save=True прогресс хранится в customs_posts (crawled_at):
+    повторный запуск продолжает с незагруженных постов. save=False — всё в памяти (проверка по фикстурам).
+    """
+    t0 = time.perf_counter()
+    entries = discover(fetch_html, delay=delay)
+    posts = {e["code"]: e for e in entries if len(e["code"]) == 8}
+    print(f"[customs] Найдено таможен и постов: {len(entries)}, из них постов: {len(posts)}")
+
+    if save:
+        from db import customs_post_mark_crawled, customs_posts_pending, customs_posts_upsert_many, svh_cache_put
+        customs_posts_upsert_many(entries)
+        before = None
+        if refresh_days is not None:
+            before = datetime.now(timezone.utc) - timedelta(days=refresh_days)
+        pending = customs_posts_pending(crawled_before=before, limit=limit)
+    else:
+        pending = sorted(posts)[:limit] if limit else sorted(posts)
+
+    result: Dict[str, Any] = {}
+    errors: Dict[str, str] = {}
+    for i, code in enumerate(pending, 1):
+        try:
+            name, svh = crawl_post(code, fetch_html)
+        except Exception as e:
+            errors[code] = repr(e)
+            if save:
+                customs_post_mark_crawled(code, "", None, error_text=repr(e))
+            continue
+        svh_count = 0 if _no_svh(svh) else len(svh)
+        if save:
+            svh_cache_put(code, svh)
+            customs_post_mark_crawled(code, name, svh_count)
+        else:
+            result[code] = {**posts.get(code, {"code": code}), "name": name or posts.get(code, {}).get("name", ""),
+                            "svh": svh}
+        if i % 50 == 0:
+            print(f"[customs] {i}/{len(pending)} постов, ошибок {len(errors)}")
+        if delay:
+            time.sleep(delay)
+
+    _directory.reset()
+    return {
+        "discovered": len(entries),
+        "crawled": len(pending) - len(errors),
+        "errors": errors,
+        "seconds": round(time.perf_counter() - t0, 1),
+        "posts": result,
+    }
+
+
+# ---------- Поиск ----------
+
+class PostIndex:
+    def __init__(self, rows: List[Dict[str, Any]]):
+        self.rows = sorted(rows, key=lambda r: r["code"])
+        self.codes = [r["code"] for r in self.rows]
+        self.by_code = {r["code"]: r for r in self.rows}
+        self.tokens = [_tokens(r.get("name")) for r in self.rows]
+        self.grams = [[_trigrams(t) for t in toks] for toks in self.tokens]
+
+    def search(self, q: str, limit: int = 20) -> List[Dict[str, Any]]:
+        q = str(q or "").strip()
+        if not q:
+            return []
+        scored: Dict[int, float] = {}
+
+        # 1) префикс кода: "10702" -> все посты Владивостокской таможни
+        digits = re.sub(r"\D", "", q)
+        if digits and digits == q.replace(" ", ""):
+            i = bisect.bisect_left(self.codes, digits)
+            while i < len(self.codes) and self.codes[i].startswith(digits):
+                scored[i] = 1.0 if self.codes[i] == digits else 0.9
+                i += 1
+            return self._top(scored, limit)
+
+        # 2) каждое слово запроса — начало какого-нибудь слова названия ("влад морс")
+        q_tokens = _tokens(q)
+        for i, toks in enumerate(self.tokens):
+            if q_tokens and all(any(t.startswith(p) for t in toks) for p in q_tokens):
+                # выше — если запрос совпадает с началом названия
+                head = len(toks) >= len(q_tokens) and all(t.startswith(p) for t, p in zip(toks, q_tokens))
+                scored[i] = 0.9 if head else 0.8
+
+        # 3) опечатки: для каждого слова запроса — самое похожее по триграммам слово названия
+        if len(scored) < limit and q_tokens:
+            q_grams = [_trigrams(t) for t in q_tokens]
+            for i, grams in enumerate(self.grams):
+                if i in scored or not grams:
+                    continue
+                total = 0.0
+                for g in q_grams:
+                    total += max(2.0 * len(g & n) / (len(g) + len(n)) for n in grams)
+                dice = total / len(q_grams)
+                if dice >= 0.5:
+                    scored[i] = dice * 0.7
+        return self._top(scored, limit)
+
+    def _top(self, scored: Dict[int, float], limit: int) -> List[Dict[str, Any]]:
+        best = sorted(scored.items(), key=lambda kv: (-kv[1], self.codes[kv[0]]))[:limit]
+        return [{**_public(self.rows[i]), "score": round(s, 3)} for i, s in best]
+
+
+def _public(row: Dict[str, Any]) -> Dict[str, Any]:
+    crawled = row.get("crawled_at")
+    return {
+        "code": row["code"],
+        "name": row.get("name") or "",
+        "parent_code": row.get("parent_code"),
+        "svh_count": row.get("svh_count"),
+        "crawled_at": crawled.isoformat() if crawled else None,
+    }
+
+
+class _Directory:
+    # Индекс перечитывается из customs_posts не чаще раза в DIRECTORY_TTL
+    def __init__(self):
+        self._index: Optional[PostIndex] = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._index = None
+
+    def get(self) -> PostIndex:
+        idx = self._index
+        if idx is not None and time.monotonic() - self._loaded_at < DIRECTORY_TTL:
+            return idx
+        with self._lock:
+            if self._index is None or time.monotonic() - self._loaded_at >= DIRECTORY_TTL:
+                from db import customs_posts_all
+                self._index = PostIndex(customs_posts_all())
+                self._loaded_at = time.monotonic()
+            return self._index
+
+
+_directory = _Directory()
+
+
+def search(q: str, limit: int = 20) -> List[Dict[str, Any]]:
+    return _directory.get().search(q, limit)
+
+
+def post_name(code: str) -> str:
+    code = str(code or "").strip()
+    try:
+        row = _directory.get().by_code.get(code)
+    except Exception as e:
+        print(f"[customs] customs_posts недоступна: {e!r}")
+        row = None
+    if row and row.get("name"):
+        return row["name"]
+    name = parcer_alta_tam.parse_tp_name(parcer_alta_tam.get_html_data(parcer_alta_tam.tp_url(code)))
+    if not name and len(code) == 8:
+        return f"Проверьте информацию на сайте: {parcer_alta_tam.tp_url(code)}"
+    return name
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Справочник таможенных постов alta.ru")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("crawl", help="загрузить посты и СВХ")
+    c.add_argument("--refresh-days", type=float, default=None, help="перезагрузить посты старше N дней")
+    c.add_argument("--limit", type=int, default=None, help="не больше N постов за запуск")
+    c.add_argument("--delay", type=float, default=0.5, help="пауза между запросами к alta.ru, сек")
+    c.add_argument("--fixtures", default="", help="каталог с сохранёнными страницами вместо alta.ru")
+    c.add_argument("--dry-run", action="store_true", help="не писать в БД, вывести результат JSON")
+    args = ap.parse_args(argv)
+
+    fetch = fixture_fetcher(args.fixtures) if args.fixtures else parcer_alta_tam.get_html_data
+    res = crawl(fetch, save=not args.dry_run, refresh_days=args.refresh_days, limit=args.limit,
+                delay=0.0 if args.fixtures else args.delay)
+    if args.dry_run:
+        print(json.dumps(res, ensure_ascii=False, indent=2))
+    else:
+        print(f"[customs] Загружено постов: {res['crawled']}, ошибок: {len(res['errors'])}, {res['seconds']} с")
+    return 1 if res["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -99,6 +99,36 @@ def init_db():
                 doc_key         TEXT NOT NULL,  -- 'invoice', 'packing', 'contract', ...
                 created_at      TIMESTAMPTZ NOT NULL DEFAULT now()
             );
+            CREATE TABLE IF NOT EXISTS declaration_graphs_cache (
+                decl_id       BIGINT PRIMARY KEY REFERENCES declarations(id) ON DELETE CASCADE,
+                content_hash  TEXT,                   -- sha256(all_data + overrides + версия справочников)
+                ref_version   TEXT,
+                is_stale      BOOLEAN NOT NULL DEFAULT TRUE,
+                generation    BIGINT NOT NULL DEFAULT 0,  -- растёт при каждой инвалидации
+                graphs_json   JSONB,
+                nodes_json    JSONB,                  -- результаты по узлам графа для частичного пересчёта
+                updated_at    TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+            CREATE TABLE IF NOT EXISTS cbr_rates (
+                rate_date   DATE NOT NULL,
+                currency    TEXT NOT NULL,            -- буквенный код: USD, EUR, ...
+                rate        NUMERIC NOT NULL,         -- рублей за 1 единицу валюты
+                fetched_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
+                PRIMARY KEY (rate_date, currency)
+            );
+            CREATE TABLE IF NOT EXISTS svh_cache (
+                tp_code     TEXT PRIMARY KEY,         -- код таможенного поста
+                data_json   JSONB NOT NULL,           -- разобранные СВХ (parcer_alta_tam.get_svh_data)
+                fetched_at  TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+            CREATE TABLE IF NOT EXISTS customs_posts (
+                code        TEXT PRIMARY KEY,         -- 8 цифр — пост, короче — таможня/управление
+                name        TEXT NOT NULL DEFAULT '',
+                parent_code TEXT,
+                svh_count   INT,
+                crawled_at  TIMESTAMPTZ,              -- NULL — страница поста ещё не загружена
+                error_text  TEXT
+            );
             CREATE TABLE IF NOT EXISTS jobs (
                 id          BIGSERIAL PRIMARY KEY,
                 status      TEXT NOT NULL DEFAULT 'queued',  -- queued | processing | done | error
@@ -421,7 +451,12 @@ def search_files(user_id: int, query: str, limit: int = 500) -> List[Dict[str, A
 
 def delete_file(file_id: int) -> int:
     q = "DELETE FROM files WHERE id=%s"
+    q_stale = """
+        UPDATE declaration_graphs_cache SET is_stale = TRUE, generation = generation + 1
+         WHERE decl_id IN (SELECT declaration_id FROM declaration_files WHERE file_id = %s)
+    """
     with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(q_stale, (file_id,))
         cur.execute(q, (file_id,))
         affected = cur.rowcount
         conn.commit()
@@ -464,6 +499,7 @@ def replace_file(declaration_id: int, user_id: int, doc_key: str,
         )
         new_fid = int(cur.fetchone()["id"])
         cur.execute(q_link, (declaration_id, new_fid, doc_key))
+        _graphs_cache_mark_stale(cur, declaration_id)
         conn.commit()
         return new_fid
     
@@ -541,6 +577,36 @@ def list_declarations(user_id: int, limit: int = 200):
         cur.execute(q, (user_id, limit))
         return [dict(r) for r in cur.fetchall()]
 
+def list_declaration_ids(
+    user_id: Optional[int] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    stale_only: bool = False,
+    limit: int = 1000,
+) -> List[int]:
+    # stale_only — только декларации без актуального кэша графов
+    q = """
+    SELECT d.id
+      FROM declarations d
+      LEFT JOIN declaration_graphs_cache c ON c.decl_id = d.id
+     WHERE (%(user_id)s::bigint IS NULL OR d.user_id = %(user_id)s)
+       AND (%(created_from)s::timestamptz IS NULL OR d.created_at >= %(created_from)s)
+       AND (%(created_to)s::timestamptz IS NULL OR d.created_at < %(created_to)s)
+       AND (NOT %(stale_only)s OR c.decl_id IS NULL OR c.is_stale)
+     ORDER BY d.id
+     LIMIT %(limit)s
+    """
+    params = {
+        "user_id": user_id,
+        "created_from": created_from,
+        "created_to": created_to,
+        "stale_only": bool(stale_only),
+        "limit": int(limit),
+    }
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(q, params)
+        return [int(r["id"]) for r in cur.fetchall()]
+
 
 
 def update_declaration(decl_id: int, **fields) -> None:
@@ -563,6 +629,8 @@ def update_declaration(decl_id: int, **fields) -> None:
 
     with get_conn() as conn, conn.cursor() as cur:
         cur.execute(q, tuple(vals))
+        if "meta_json" in fields:
+            _graphs_cache_mark_stale(cur, decl_id)
         conn.commit()
 
 def get_declaration_date(declaration_id: int) -> Optional[str]:
@@ -625,6 +693,7 @@ def link_file_to_declaration(declaration_id: int, file_id: int, doc_key: str, re
 
         cur.execute(q_insert, (declaration_id, file_id, doc_key))
         link_id = cur.fetchone()["id"]
+        _graphs_cache_mark_stale(cur, declaration_id)
         conn.commit()
         return int(link_id)
 
@@ -692,6 +761,7 @@ def save_declaration_invoice_json(declaration_id: int, invoice: Dict[str, Any])
             "UPDATE files SET file_data = %s, size_bytes = %s WHERE id = %s",
             (payload, len(payload), file_id),
         )
+        _graphs_cache_mark_stale(cur, declaration_id)
         conn.commit()
 
 
@@ -700,6 +770,7 @@ def unlink_file_from_declaration(declaration_id: int, file_id: int) -> int:
     with get_conn() as conn, conn.cursor() as cur:
         cur.execute(q, (declaration_id, file_id))
         deleted = cur.rowcount
+        _graphs_cache_mark_stale(cur, declaration_id)
         conn.commit()
         return deleted
     
@@ -758,9 +829,12 @@ def jobs_claim_next() -> Optional[Dict[str, Any]]:
             return dict(row)
 
 def jobs_finish_ok(job_id: int, result: Dict[str, Any]) -> None:
-    q = """UPDATE jobs SET status='done', result_json=%s, finished_at=now() WHERE id=%s"""
+    q = """UPDATE jobs SET status='done', result_json=%s, finished_at=now() WHERE id=%s RETURNING decl_id"""
     with get_conn() as conn, conn.cursor() as cur:
         cur.execute(q, (json.dumps(result, ensure_ascii=False), job_id))
+        row = cur.fetchone()
+        if row:
+            _graphs_cache_mark_stale(cur, row["decl_id"])
         conn.commit()
 
 def jobs_finish_err(job_id: int, err: str) -> None:
@@ -793,9 +867,185 @@ def save_overrides(decl_id: int, overrides: Dict[str, Any]) -> None:
     """
     with get_conn() as conn, conn.cursor() as cur:
         cur.execute(q, (json.dumps(overrides, ensure_ascii=False), decl_id))
+        _graphs_cache_mark_stale(cur, decl_id)
+        conn.commit()
+
+
+################## Кэш графов ##################
+def _graphs_cache_mark_stale(cur, decl_id: int) -> None:
+    # вызывается внутри транзакции, изменившей документы или overrides декларации;
+    # generation не даёт параллельному расчёту по старым данным записать себя как свежий
+    cur.execute("""
+        INSERT INTO declaration_graphs_cache (decl_id, is_stale, generation)
+        SELECT id, TRUE, 1 FROM declarations WHERE id = %s
+        ON CONFLICT (decl_id) DO UPDATE
+           SET is_stale = TRUE,
+               generation = declaration_graphs_cache.generation + 1
+    """, (decl_id,))
+
+def graphs_cache_invalidate(decl_id: int) -> None:
+    with get_conn() as conn, conn.cursor() as cur:
+        _graphs_cache_mark_stale(cur, decl_id)
+        conn.commit()
+
+def graphs_cache_get(decl_id: int) -> Optional[Dict[str, Any]]:
+    q = """
+    SELECT decl_id, content_hash, ref_version, is_stale, generation, graphs_json, nodes_json, updated_at
+      FROM declaration_graphs_cache
+     WHERE decl_id = %s
+    """
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(q, (decl_id,))
+        row = cur.fetchone()
+        return dict(row) if row else None
+
+def graphs_cache_put(
+    decl_id: int,
+    generation: Optional[int],
+    content_hash: str,
+    ref_version: str,
+    graphs: Dict[str, Any],
+    nodes: Optional[Dict[str, Any]] = None,
+) -> bool:
+    """
+    Записать расчёт, если с момента чтения (generation) декларацию никто не инвалидировал.
+    generation=None — строки кэша при чтении не было.
+    """
+    q_update = """
+    UPDATE declaration_graphs_cache
+       SET content_hash = %s, ref_version = %s, is_stale = FALSE,
+           graphs_json = %s::jsonb, nodes_json = %s::jsonb, updated_at = now()
+     WHERE decl_id = %s AND generation = %s
+    """
+    q_insert = """
+    INSERT INTO declaration_graphs_cache (decl_id, content_hash, ref_version, is_stale, graphs_json, nodes_json)
+    VALUES (%s, %s, %s, FALSE, %s::jsonb, %s::jsonb)
+    ON CONFLICT (decl_id) DO NOTHING
+    """
+    graphs_s = json.dumps(graphs, ensure_ascii=False, default=str)
+    nodes_s = json.dumps(nodes, ensure_ascii=False, default=str) if nodes is not None else None
+    with get_conn() as conn, conn.cursor() as cur:
+        if generation is None:
+            cur.execute(q_insert, (decl_id, content_hash, ref_version, graphs_s, nodes_s))
+        else:
+            cur.execute(q_update, (content_hash, ref_version, graphs_s, nodes_s, decl_id, generation))
+        written = cur.rowcount > 0
+        conn.commit()
+        return written
+
+
+################## Курсы ЦБ ##################
+def cbr_rate_get(rate_date, currency: str):
+    q = "SELECT rate FROM cbr_rates WHERE rate_date = %s AND currency = %s"
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(q, (rate_date, currency))
+        row = cur.fetchone()
+        return row["rate"] if row else None
+
+def cbr_rates_put(rate_date, rates: Dict[str, Any]) -> None:
+    # rates: буквенный код -> курс за 1 единицу; уже сохранённые курсы не перезаписываются
+    if not rates:
+        return
+    q = """
+    INSERT INTO cbr_rates (rate_date, currency, rate)
+    VALUES (%s, %s, %s)
+    ON CONFLICT (rate_date, currency) DO NOTHING
+    """
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.executemany(q, [(rate_date, code, rate) for code, rate in rates.items()])
+        conn.commit()
+
+def cbr_rates_range(currency: str, date_from, date_to) -> List[Dict[str, Any]]:
+    q = """
+    SELECT rate_date, rate
+      FROM cbr_rates
+     WHERE currency = %s AND rate_date BETWEEN %s AND %s
+     ORDER BY rate_date
+    """
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(q, (currency, date_from, date_to))
+        return [dict(r) for r in cur.fetchall()]
+
+def cbr_rates_dates(date_from, date_to) -> List[Any]:
+    # даты, за которые таблица курсов уже загружена
+    q = "SELECT DISTINCT rate_date FROM cbr_rates WHERE rate_date BETWEEN %s AND %s ORDER BY rate_date"
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(q, (date_from, date_to))
+        return [r["rate_date"] for r in cur.fetchall()]
+
+
+################## Кэш СВХ ##################
+def svh_cache_get(tp_code: str) -> Optional[Dict[str, Any]]:
+    q = "SELECT tp_code, data_json, fetched_at FROM svh_cache WHERE tp_code = %s"
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(q, (tp_code,))
+        row = cur.fetchone()
+        return dict(row) if row else None
+
+def svh_cache_put(tp_code: str, data: Dict[str, Any]) -> None:
+    q = """
+    INSERT INTO svh_cache (tp_code, data_json, fetched_at)
+    VALUES (%s, %s::jsonb, now())
+    ON CONFLICT (tp_code) DO UPDATE
+       SET data_json = EXCLUDED.data_json, fetched_at = EXCLUDED.fetched_at
+    """
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(q, (tp_code, json.dumps(data, ensure_ascii=False, default=str)))
         conn.commit()
 
 
+################## Справочник таможенных постов ##################
+def customs_posts_upsert_many(rows: List[Dict[str, Any]]) -> None:
+    # rows: {"code", "name", "parent_code"}; прогресс обхода (crawled_at) не трогается
+    if not rows:
+        return
+    q = """
+    INSERT INTO customs_posts (code, name, parent_code)
+    VALUES (%s, %s, %s)
+    ON CONFLICT (code) DO UPDATE
+       SET name = CASE WHEN customs_posts.name = '' THEN EXCLUDED.name ELSE customs_posts.name END,
+           parent_code = COALESCE(EXCLUDED.parent_code, customs_posts.parent_code)
+    """
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.executemany(q, [(r["code"], r.get("name") or "", r.get("parent_code")) for r in rows])
+        conn.commit()
+
+def customs_posts_pending(crawled_before: Optional[datetime] = None, limit: Optional[int] = None) -> List[str]:
+    # посты (8 цифр), страницы которых ещё не загружены или загружены раньше crawled_before
+    q = """
+    SELECT code FROM customs_posts
+     WHERE length(code) = 8
+       AND (crawled_at IS NULL OR (%s::timestamptz IS NOT NULL AND crawled_at < %s::timestamptz))
+     ORDER BY code
+    """
+    params: List[Any] = [crawled_before, crawled_before]
+    if limit:
+        q += " LIMIT %s"
+        params.append(int(limit))
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(q, params)
+        return [r["code"] for r in cur.fetchall()]
+
+def customs_post_mark_crawled(code: str, name: str, svh_count: Optional[int], error_text: Optional[str] = None) -> None:
+    q = """
+    UPDATE customs_posts
+       SET name = CASE WHEN %s <> '' THEN %s ELSE name END,
+           svh_count = COALESCE(%s, svh_count),
+           crawled_at = CASE WHEN %s::text IS NULL THEN now() ELSE crawled_at END,  -- с ошибкой — повторить при следующем обходе
+           error_text = %s
+     WHERE code = %s
+    """
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(q, (name or "", name or "", svh_count, error_text, error_text, code))
+        conn.commit()
+
+def customs_posts_all() -> List[Dict[str, Any]]:
+    q = "SELECT code, name, parent_code, svh_count, crawled_at FROM customs_posts ORDER BY code"
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(q)
+        return [dict(r) for r in cur.fetchall()]
+
+
 ################## Тарифы / Платежи / Кредиты ##################
 def list_active_tariff_plans() -> List[Dict[str, Any]]:
     q = """
@@ -1,16 +1,77 @@
-import pandas as pd
 import re
 from decimal import Decimal, InvalidOperation
-from typing import Any, List, Tuple, Dict
+from typing import Any, List, Mapping, Tuple, Dict
 from datetime import datetime, date
 from pathlib import Path
 from functools import lru_cache
+from bisect import bisect_right
+from collections import deque
+from graph_engine import current_evaluation
+from country_resolver import resolve_country
+from refdata import UNITS_CSV, get_refdata, load_units
 from typing import Dict
-import pandas as pd
+
+_EMPTY_VALUES = (None, "", "null", "None", "-", "—")
+_CLEAN_RE = re.compile(r"[^A-Za-zА-Яа-яЁё0-9]")
+
+
+class PathIndex:
+    """
+    Плоский индекс all_data: "invoice.Общая информация.Номер инвойса" -> значение.
+    Строится один раз на расчёт графов; обходятся только вложенные dict (списки — листья),
+    ключи с точкой не индексируются — get_path до них тоже не доходит.
+    """
+    __slots__ = ("values", "_cand")
+
+    def __init__(self, data: dict):
+        self.values: Dict[str, Any] = {}
+        self._cand: Dict[str, Any] = {}
+        stack = [("", data)]
+        while stack:
+            prefix, node = stack.pop()
+            for k, v in node.items():
+                if v is None or not isinstance(k, str) or "." in k:
+                    continue
+                key = prefix + k
+                self.values[key] = v
+                if isinstance(v, dict):
+                    stack.append((key + ".", v))
+
+    def candidate(self, path: str):
+        # (значение для get_any, длина без знаков) или None — как в исходном relevance_score
+        try:
+            return self._cand[path]
+        except KeyError:
+            pass
+        c = None
+        v = self.values.get(path)
+        if v not in _EMPTY_VALUES:
+            val = str(v).strip().upper()
+            if val:
+                c = (val, len(_CLEAN_RE.sub("", val)))
+        self._cand[path] = c
+        return c
+
+
+@lru_cache(maxsize=4096)
+def _split_path(dotted: str) -> Tuple[str, ...]:
+    return tuple(dotted.split("."))
+
+
+def path_index(d: dict):
+    # Индекс только для all_data текущего расчёта графов; для прочих словарей — обычный обход
+    ev = current_evaluation()
+    if ev is None or ev.all_data is not d:
+        return None
+    return ev.memoize(("path_index", id(d)), PathIndex, d)
+
 
 def get_path(d: dict, dotted: str, default=None):
+    idx = path_index(d) if isinstance(d, dict) else None
+    if idx is not None:
+        return idx.values.get(dotted, default)
     cur = d
-    for p in dotted.split("."):
+    for p in _split_path(dotted):
         if not isinstance(cur, dict):
             return default
         cur = cur.get(p)
@@ -19,59 +80,50 @@ def get_path(d: dict, dotted: str, default=None):
     return cur
 
 def get_any(d: dict, paths, default=""):
-    candidates = []
-
+    # Побеждает самый «содержательный» кандидат (больше букв/цифр), при равенстве — первый по порядку paths
+    idx = path_index(d) if isinstance(d, dict) else None
+    best = None
+    best_len = -1
     for p in paths:
-        v = get_path(d, p, None)
-        if v not in (None, "", "null", "None", "-", "—"):
-            val = str(v).strip().upper()
-            if val:
-                candidates.append(val)
-
-    if not candidates:
+        if idx is not None:
+            c = idx.candidate(p)
+        else:
+            c = None
+            v = get_path(d, p, None)
+            if v not in _EMPTY_VALUES:
+                val = str(v).strip().upper()
+                if val:
+                    c = (val, len(_CLEAN_RE.sub("", val)))
+        if c is not None and c[1] > best_len:
+            best, best_len = c
+
+    if best is None:
         return default.upper()
+    return best.strip().upper()
 
-    def clean_length(s: str) -> int:
-        cleaned = re.sub(r"[^A-Za-zА-Яа-яЁё0-9]", "", s)
-        return len(cleaned)
 
-    def relevance_score(x: str):
-        return (
-            clean_length(x),             
-            -candidates.index(x)        
-        )
+BASE_DIR = Path(__file__).resolve().parent
 
-    best = max(candidates, key=relevance_score)
-    return best.strip().upper()
 
+def reference_data_version() -> str:
+    # Хэш содержимого справочников загруженного снимка: меняется при перезагрузке изменённых CSV
+    return get_refdata().version
 
-BASE_DIR = Path(__file__).resolve().parent
-CLASSIF_DIR = BASE_DIR / "classifier"
 
-COUNTRIES_CSV   = CLASSIF_DIR / "countries_classificator.csv"
-UNITS_CSV       = CLASSIF_DIR / "15 — КЛАССИФИКАТОР ЕДИНИЦ ИЗМЕРЕНИЯ.csv"
-INCOTERMS_CSV   = CLASSIF_DIR / "13 — КЛАССИФИКАТОР УСЛОВИЙ ПОСТАВКИ.csv"
+def _isna(x) -> bool:
+    # как pd.isna для скаляров: None и NaN
+    try:
+        return bool(x != x)
+    except Exception:
+        return False
 
 
-@lru_cache()
-def get_country_mapping() -> Dict[str, str]:
-    csv_path = CLASSIF_DIR / "countries_classificator.csv"
-    countries = pd.read_csv(csv_path)
-
-    mapping: Dict[str, str] = {}
-    for _, row in countries.iterrows():
-        short = str(row["ShortName"]).strip()
-        for col in ["Numeric", "ShortName", "FullName",
-                    "Alpha2", "Alpha3", "ISO_Name", "ISO_ShortName"]:
-            val = row.get(col)
-            if pd.notna(val):
-                key = str(val).strip().upper()
-                if key:
-                    mapping[key] = short
-    return mapping
-
-def normalize_country(country_str):
-    if country_str is None or pd.isna(country_str):
+def get_country_mapping() -> Mapping[str, str]:
+    return get_refdata().country_short_by_any
+
+def normalize_country(country_str, fuzzy: bool = False):
+    # fuzzy=True — если точного написания нет, искать через country_resolver (опечатки, сокращения)
+    if country_str is None or _isna(country_str):
         return ""
 
     country_str = str(country_str)
@@ -90,46 +142,38 @@ def normalize_country(country_str):
         if p in mapping:
             return mapping[p]
 
+    if fuzzy:
+        m = resolve_country(country_str)
+        if m is not None:
+            return m.name
+
     return country_str.strip()
 
 
-def get_country_code(name: str) -> str:
-    countries = pd.read_csv(COUNTRIES_CSV)
-    if not name or pd.isna(name):
+def get_country_code(name: str, fuzzy: bool = False) -> str:
+    if not name or _isna(name):
         return ""
     
     name = str(name)
     parts = [p.strip().upper() for part in name.split(",") for p in part.split("/")]
     
-    columns_to_check = ["ShortName", "Alpha2", "Alpha3", "ISO_Name", "ISO_ShortName"]
-    mapping = {}
-    for _, row in countries.iterrows():
-        alpha2 = str(row["Alpha2"]).strip()
-        for col in columns_to_check:
-            val = row[col]
-            if pd.notna(val):
-                mapping[str(val).strip().upper()] = alpha2
-
+    mapping = get_refdata().country_alpha2_by_any
     for p in parts:
         if p in mapping:
             return mapping[p]
+
+    if fuzzy:
+        m = resolve_country(name)
+        if m is not None:
+            return m.alpha2
     return ""
 
 def get_country_name(code: str) -> str:
-    if not code or pd.isna(code):
+    if not code or _isna(code):
         return ""
 
-    countries = pd.read_csv(COUNTRIES_CSV)
-
     code = str(code).strip().upper()
-    for _, row in countries.iterrows():
-        alpha2 = str(row.get("Alpha2", "")).strip().upper()
-        alpha3 = str(row.get("Alpha3", "")).strip().upper()
-
-        if code in (alpha2, alpha3):
-            return str(row.get("ShortName", "")).strip()
-
-    return ""
+    return get_refdata().country_name_by_code.get(code, "")
 
 def extract_index(address: str) -> str:
     if not address:
@@ -147,15 +191,325 @@ def extract_index(address: str) -> str:
             return match.group(0)
     return ""
 
+################## Таблица товаров ##################
+# Товары инвойса и упаковочного листа разбираются один раз на all_data (в пределах
+# расчёта графов — через scoped_memo); агрегаторы ниже работают по готовым колонкам.
+
+def _norm_name(x) -> str:
+    return " ".join(str(x or "").lower().replace("\u00A0", " ").split())
+
+def _parse_weight(v):
+    # "12,5 kg" -> 12.5; None — пусто или не число
+    if v in (None, ""):
+        return None
+    s = str(v).replace("\u00A0", "").replace(" ", "").replace(",", ".")
+    if not re.fullmatch(r"[0-9.]+", s):
+        s = re.sub(r"[^0-9.,]", "", s).replace(",", ".")
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+def _parse_weight_plain(v):
+    if v in (None, ""):
+        return None
+    s = str(v).replace("\u00A0", "").replace(" ", "").replace(",", ".")
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+def _parse_seats(v):
+    if v in (None, ""):
+        return None
+    s = str(v).replace("\u00A0", "").replace(" ", "").replace(",", ".")
+    if not re.fullmatch(r"[0-9.]+", s):
+        s = re.sub(r"[^0-9.,]", "", s).replace(",", ".")
+    try:
+        return int(s)
+    except ValueError:
+        return None
+
+def _line_amount(price: Decimal, qty: Decimal, total: Decimal) -> Decimal:
+    try:
+        return total if total > 0 else price * qty
+    except InvalidOperation:
+        return Decimal("0")
+
+@lru_cache()
+def _units_maps_file(units_csv_path: str) -> Tuple[Mapping[str, str], Mapping[str, str]]:
+    return load_units(units_csv_path)
+
+def _units_maps(units_csv_path: str = str(UNITS_CSV)) -> Tuple[Mapping[str, str], Mapping[str, str]]:
+    if str(units_csv_path) == str(UNITS_CSV):
+        ref = get_refdata()
+        return ref.unit_short_by_code, ref.unit_code_by_variant
+    return _units_maps_file(str(units_csv_path))
+
+def _units_version(units_csv_path: str) -> str:
+    if units_csv_path == str(UNITS_CSV):
+        return get_refdata().version
+    return units_csv_path
+
+@lru_cache(maxsize=8)
+def _unit_index(version: str, units_csv_path: str) -> Dict[str, Tuple[str, str]]:
+    # вариант написания -> (код, условное обозначение); строится один раз на версию справочника
+    code_to_short, variant_to_code = _units_maps(units_csv_path)
+    index: Dict[str, Tuple[str, str]] = {}
+    for variant, code in variant_to_code.items():
+        if code:
+            index[variant] = (code, code_to_short.get(code, ""))
+    return index
+
+@lru_cache(maxsize=4096)
+def _resolve_unit_cached(version: str, units_csv_path: str, unit_raw: str) -> Tuple[str, str]:
+    index = _unit_index(version, units_csv_path)
+    u_norm = unit_raw.strip().upper().replace("\u00A0", " ")
+    hit = index.get(u_norm) or index.get(u_norm.replace(".", ""))
+    if not hit or not hit[1]:
+        return "796", "ШТ"
+    return hit
+
+def _resolve_unit(unit_raw, units_csv_path: str = str(UNITS_CSV)) -> Tuple[str, str]:
+    if unit_raw in (None, ""):
+        return "796", "ШТ"
+    units_csv_path = str(units_csv_path)
+    return _resolve_unit_cached(_units_version(units_csv_path), units_csv_path, str(unit_raw))
+
+
+class GoodsTable:
+    def __init__(self, data: dict):
+        data = data if isinstance(data, dict) else {}
+        self.source = data
+
+        inv = data.get("invoice")
+        inv = inv if isinstance(inv, dict) else {}
+        raw = inv.get("Товары", [])
+        self.inv_source = raw
+        self.inv_is_list = isinstance(raw, list)
+        if self.inv_is_list:
+            items = list(enumerate(raw))
+        elif isinstance(raw, dict):
+            items = [(0, raw)]
+        else:
+            items = []
+        items = [(pos, g) for pos, g in items if isinstance(g, dict)]
+
+        # колонки инвойса
+        self.inv_rows: List[dict] = [g for _, g in items]
+        self.inv_pos: List[int] = [pos for pos, _ in items]
+        self.inv_code_raw = [g.get("Код ТНВЭД") for g in self.inv_rows]
+        self.inv_code_str = [str(c).strip() for c in self.inv_code_raw]          # None -> "None"
+        self.inv_code = [str(c or "").strip() for c in self.inv_code_raw]
+        self.inv_code_any = [
+            str(g.get("Код ТНВЭД") or g.get("Код ТН ВЭД") or "").strip() for g in self.inv_rows
+        ]
+        self.inv_name = [_norm_name(g.get("Наименование") or g.get("Описание")) for g in self.inv_rows]
+        self.inv_price = [_to_decimal(g.get("Цена")) for g in self.inv_rows]
+        self.inv_qty = [_to_decimal(g.get("Количество")) for g in self.inv_rows]
+        self.inv_total = [_to_decimal(g.get("Стоимость")) for g in self.inv_rows]
+        self.inv_amount = [
+            _line_amount(p, q, t) for p, q, t in zip(self.inv_price, self.inv_qty, self.inv_total)
+        ]
+        self.inv_qty_raw = [g.get("Количество") for g in self.inv_rows]
+        self.inv_country = [g.get("Страна-производитель") for g in self.inv_rows]
+        units = [_resolve_unit(g.get("Единица измерения")) for g in self.inv_rows]
+        self.inv_unit_code = [u[0] for u in units]
+        self.inv_unit_name = [u[1] for u in units]
+
+        codes = set()
+        if self.inv_is_list:
+            codes = {s for s, r in zip(self.inv_code_str, self.inv_code_raw) if r}
+        self.tnved_codes = codes
+        self.tnved_sorted: List[str] = sorted(c for c in codes if c)
+
+        # упаковочный лист: packing.Товары (веса, места) и packing.Перевозка.Товары (суммы)
+        packing = data.get("packing")
+        packing = packing if isinstance(packing, dict) else {}
+        pk_raw = packing.get("Товары", []) or []
+        pk_items = [(pos, g) for pos, g in enumerate(pk_raw) if isinstance(g, dict)] if isinstance(pk_raw, list) else []
+        pk_rows = [g for _, g in pk_items]
+        self.pk_pos: List[int] = [pos for pos, _ in pk_items]
+        self.pk_name = [_norm_name(g.get("Наименование") or g.get("Описание")) for g in pk_rows]
+        self.pk_brutto = [_parse_weight(g.get("Масса брутто")) for g in pk_rows]
+        self.pk_brutto_plain = [_parse_weight_plain(g.get("Масса брутто")) for g in pk_rows]
+        self.pk_netto = [_parse_weight(g.get("Масса нетто")) for g in pk_rows]
+        self.pk_seats = [_parse_seats(g.get("Количество мест")) for g in pk_rows]
+
+        transport = packing.get("Перевозка", {})
+        tr_raw = transport.get("Товары", []) if isinstance(transport, dict) else []
+        tr_items = [(pos, g) for pos, g in enumerate(tr_raw) if isinstance(g, dict)] if isinstance(tr_raw, list) else []
+        tr_rows = [g for _, g in tr_items]
+        self.tr_pos: List[int] = [pos for pos, _ in tr_items]
+        self.tr_name = [_norm_name(g.get("Наименование") or g.get("Описание")) for g in tr_rows]
+        self.tr_amount = [
+            _line_amount(_to_decimal(g.get("Цена")), _to_decimal(g.get("Количество")), _to_decimal(g.get("Стоимость")))
+            for g in tr_rows
+        ]
+
+        self._weight_matcher = None
+        self._sum_matcher = None
+
+    # Сопоставление строк упаковочного листа со строками инвойса (строятся по требованию).
+    # Веса/места: строки инвойса с наименованием и кодом, пустое наименование упаковки
+    # совпадает с первой строкой. Суммы: строки с кодом, пустые наименования не совпадают.
+    @property
+    def weight_matcher(self) -> "NameMatcher":
+        if self._weight_matcher is None:
+            self._weight_matcher = NameMatcher(
+                [(n, c, i) for i, (n, c) in enumerate(zip(self.inv_name, self.inv_code_str)) if n and c]
+            )
+        return self._weight_matcher
+
+    @property
+    def sum_matcher(self) -> "NameMatcher":
+        if self._sum_matcher is None:
+            rows = []
+            if self.inv_is_list:
+                rows = [(n, c, i) for i, (n, c) in enumerate(zip(self.inv_name, self.inv_code_any)) if c]
+            self._sum_matcher = NameMatcher(rows, allow_empty=False)
+        return self._sum_matcher
+
+    def invoice_sum(self) -> Decimal:
+        total = Decimal("0")
+        if self.inv_is_list:
+            for a in self.inv_amount:
+                total += a
+        return total
+
+    def transport_sum(self) -> Decimal:
+        total = Decimal("0")
+        for a in self.tr_amount:
+            total += a
+        return total
+
+
+class NameMatcher:
+    """
+    Первая (по порядку) строка инвойса, для которой n_i in p или p in n_i.
+    n_i in p — автомат Ахо–Корасик по наименованиям инвойса (минимальный номер строки
+    протянут по суффиксным ссылкам); p in n_i — поиск в склейке наименований через "\n"
+    (в нормализованных наименованиях переводов строк нет, первое вхождение = первая строка).
+    """
+
+    def __init__(self, rows: List[Tuple[str, str, int]], allow_empty: bool = True):
+        self.rows = rows                 # (наименование, код ТНВЭД, номер строки в таблице)
+        self.allow_empty = allow_empty
+        self._cache: Dict[str, Tuple[int, str]] = {}
+
+        first: Dict[str, int] = {}
+        self.empty_pos = None
+        for k, (name, _, _) in enumerate(rows):
+            if not name:
+                if self.empty_pos is None:
+                    self.empty_pos = k
+                continue
+            if name not in first:
+                first[name] = k
+
+        names = list(first.keys())
+        self._positions = [first[n] for n in names]
+        self._starts: List[int] = []
+        off = 0
+        for n in names:
+            self._starts.append(off)
+            off += len(n) + 1
+        self._haystack = "\n".join(names)
+
+        # автомат Ахо–Корасик
+        goto: List[Dict[str, int]] = [{}]
+        best: List[int] = [len(rows)]
+        for n in names:
+            node = 0
+            for ch in n:
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[node][ch] = nxt
+                    goto.append({})
+                    best.append(len(rows))
+                node = nxt
+            best[node] = min(best[node], first[n])
+
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            u = queue.popleft()
+            for ch, v in goto[u].items():
+                f = fail[u]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[v] = goto[f].get(ch, 0)
+                best[v] = min(best[v], best[fail[v]])
+                queue.append(v)
+        self._goto, self._fail, self._best = goto, fail, best
+
+    def _contained_in_p(self, p: str) -> int:
+        goto, fail, best = self._goto, self._fail, self._best
+        node, res = 0, best[0]
+        for ch in p:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if best[node] < res:
+                res = best[node]
+        return res
+
+    def _containing_p(self, p: str) -> int:
+        at = self._haystack.find(p)
+        if at < 0:
+            return len(self.rows)
+        return self._positions[bisect_right(self._starts, at) - 1]
+
+    def match(self, p: str) -> Tuple[int, str]:
+        """(индекс в rows или -1, вид совпадения)"""
+        hit = self._cache.get(p)
+        if hit is not None:
+            return hit
+
+        none = len(self.rows)
+        if not p and not self.allow_empty:
+            hit = (-1, "unmatched")
+        else:
+            a = self._contained_in_p(p)
+            b = self._containing_p(p) if self._positions else none
+            if self.allow_empty and self.empty_pos is not None:
+                a = min(a, self.empty_pos)      # пустое n_i входит в любую строку
+                if not p:
+                    b = min(b, self.empty_pos)
+            k = min(a, b)
+            if k >= none:
+                hit = (-1, "unmatched")
+            elif a == b:
+                hit = (k, "exact" if self.rows[k][0] == p else "invoice_in_packing")
+            elif k == a:
+                hit = (k, "invoice_in_packing")
+            else:
+                hit = (k, "packing_in_invoice")
+        self._cache[p] = hit
+        return hit
+
+    def code(self, p: str):
+        k, _ = self.match(p)
+        return self.rows[k][1] if k >= 0 else None
+
+def goods_table(data: dict) -> GoodsTable:
+    from graph_engine import scoped_memo
+
+    table = scoped_memo(("goods_table", id(data)), GoodsTable, data)
+    if table.source is not data and isinstance(data, dict):
+        table = GoodsTable(data)
+    return table
+
 def get_tnved(data: dict) -> int:
-    goods = data.get("invoice", {}).get("Товары", [])
-    if not isinstance(goods, list):
+    t = goods_table(data)
+    if not t.inv_is_list:
         return 0
-    codes = {str(g.get("Код ТНВЭД")).strip() for g in goods if g.get("Код ТНВЭД")}
-    if len(codes) == 0:
+    if len(t.tnved_codes) == 0:
         return ""
     else:
-        return codes
+        return set(t.tnved_codes)
+
 
 def get_total_places(data: dict) -> int:
     goods = data.get("packing", {}).get("Товары", [])
@@ -173,75 +527,34 @@ def get_total_places(data: dict) -> int:
     return total
 
 def get_product_country(data: dict) -> str:
-    goods = data.get("invoice", {}).get("Товары", [])
+    t = goods_table(data)
     otpravitel_country = normalize_country(get_any(data, [
     "invoice.Отправитель.Страна",
     "contract.Общая информация.Стороны.Отправитель.Страна"]))
 
-    if not isinstance(goods, list):
+    if not t.inv_is_list:
         return 0
-    product_country = {str(g.get("Страна-производитель")).strip() for g in goods if g.get("Страна-производитель")}
+    product_country = {str(c).strip() for c in t.inv_country if c}
     if len(product_country) == 0:
         return otpravitel_country
     else:
         return product_country
 
 def get_unit_tnved(data: dict) -> tuple[dict, dict, dict]:
-    units_df = pd.read_csv(UNITS_CSV, dtype=str).fillna("")
-    code_to_short = {}
-    variant_to_code = {}
-    code_to_name = {str(row["Код"]).strip(): str(row["Наименование"]).strip()
-                    for _, row in units_df.iterrows()
-                    if "Код" in row and "Наименование" in row}
-
-    for _, row in units_df.iterrows():
-        code = str(row.get("Код", "")).strip()
-        name = str(row.get("Наименование", "")).strip()
-        short = str(row.get("Условное обозначение", "")).strip()
-
-        if code:
-            code_to_name[code] = name
-            code_to_short[code] = short or name 
-        for col in ["Наименование", "Условное обозначение", "Наименование_EN", "Сокращение_EN", "Дополнительно"]:
-            val = row.get(col, "")
-            if not val:
-                continue
-            for v in str(val).split(","):
-                v_norm = str(v).strip().upper()
-                if v_norm:
-                    variant_to_code[v_norm] = code
-    goods = (data or {}).get("invoice", {}).get("Товары", [])
-    if isinstance(goods, dict):
-        goods = [goods]
-    if not isinstance(goods, list):
+    t = goods_table(data)
+    if not t.inv_rows and not t.inv_is_list:
         return {}, {}, {}
 
     qty_map: dict[str, list[str]] = {}
     name_map: dict[str, set[str]] = {}
     code_map: dict[str, set[str]] = {}
 
-    for g in goods:
-        tnved = str(g.get("Код ТНВЭД")).strip()
+    for i, tnved in enumerate(t.inv_code_str):
         if not tnved:
             continue
 
-        unit_raw = g.get("Единица измерения")
-        qty_raw  = g.get("Количество")
-
-        if unit_raw not in (None, ""):
-            u_norm = str(unit_raw).strip().upper().replace("\u00A0", " ")
-            u_norm_alt = u_norm.replace(".", "")
-            u_code = (
-                variant_to_code.get(u_norm)
-                or variant_to_code.get(u_norm_alt)
-                or ""
-            )
-            u_name = code_to_short.get(u_code, "")
-        else:
-            u_code, u_name = "", ""
-
-        if not u_code or not u_name:
-            u_code, u_name = "796", "ШТ"
+        u_code, u_name = t.inv_unit_code[i], t.inv_unit_name[i]
+        qty_raw = t.inv_qty_raw[i]
 
         if qty_raw not in (None, ""):
             qty_map.setdefault(tnved, []).append(str(qty_raw).strip())
@@ -265,61 +578,27 @@ def get_unit_tnved(data: dict) -> tuple[dict, dict, dict]:
     return qty_by_tnved, unit_name_by_tnved, unit_code_by_tnved
 
 def get_units_product(data: dict,units_csv_path: str = UNITS_CSV,joiner: str = "\n",) -> dict[str, str]:
-    units_df = pd.read_csv(units_csv_path, dtype=str).fillna("")
-    code_to_name = {}
-    code_to_short = {}
-    variant_to_code = {}
-
-    for _, row in units_df.iterrows():
-        code = str(row.get("Код", "")).strip()
-        name = str(row.get("Наименование", "")).strip()
-        short = str(row.get("Условное обозначение", "")).strip()
-
-        if code:
-            code_to_name[code] = name
-            code_to_short[code] = short or name 
-
-        for col in ("Наименование", "Условное обозначение", "Наименование_EN", "Сокращение_EN", "Дополнительно"):
-            val = row.get(col, "")
-            if not val:
-                continue
-            for v in str(val).split(","):
-                v_norm = str(v).strip().upper().replace("\u00A0", " ")
-                if v_norm:
-                    variant_to_code[v_norm] = code
-
+    t = goods_table(data)
     inv = (data or {}).get("invoice", {}) or {}
     manufacturer = str(((inv.get("Отправитель") or {}).get("Название компании")) or "").strip()
 
-    goods = inv.get("Товары", [])
-    if isinstance(goods, dict):
-        goods = [goods]
-    if not isinstance(goods, list):
+    if not t.inv_rows and not t.inv_is_list:
         return {}
+    default_units = str(units_csv_path) == str(UNITS_CSV)
 
     out: dict[str, list[str]] = {}
 
-    for g in goods:
-        code = str(g.get("Код ТНВЭД") or "").strip()
+    for i, g in enumerate(t.inv_rows):
+        code = t.inv_code[i]
         if not code:
             continue
 
         article = str(g.get("Наименование") or g.get("Описание") or "").strip()
         qty = "" if g.get("Количество") in (None, "") else str(g.get("Количество")).strip()
-        unit_raw = g.get("Единица измерения")
-        if unit_raw not in (None, ""):
-            u_norm = str(unit_raw).strip().upper().replace("\u00A0", " ")
-            u_norm_alt = u_norm.replace(".", "")
-            u_code = (
-                variant_to_code.get(u_norm)
-                or variant_to_code.get(u_norm_alt)
-                or ""
-            )
-            u_name = code_to_short.get(u_code, "")
+        if default_units:
+            u_code, u_name = t.inv_unit_code[i], t.inv_unit_name[i]
         else:
-            u_code, u_name = "", ""
-        if not u_code or not u_name:
-            u_code, u_name = "796", "ШТ"
+            u_code, u_name = _resolve_unit(g.get("Единица измерения"), str(units_csv_path))
 
         line = (
             f"Производитель: {manufacturer} "
@@ -353,66 +632,56 @@ def get_brutto_sum (data: dict) -> int:
 
     return round(total, 2)
 
-def get_brutto (data: dict) -> int:
-    codes_raw = get_tnved(data)
-    if isinstance(codes_raw, set):
-        tnved_set = {c for c in codes_raw if c}
-    elif isinstance(codes_raw, str) and codes_raw:
-        tnved_set = {codes_raw}
-    else:
-        tnved_set = set()
+def packing_matches(data: dict) -> List[Dict[str, Any]]:
+    # Как строки упаковочного листа были отнесены к кодам ТНВЭД (для проверки пользователем):
+    # packing.Товары — веса и места (g35, g38, g31), packing.Перевозка.Товары — суммы (g42).
+    t = goods_table(data)
+    tnved_set = {c for c in t.tnved_codes if c}
+    only_code = next(iter(tnved_set)) if len(tnved_set) == 1 else None
+    out: List[Dict[str, Any]] = []
+
+    def _row(source, pos, name, matcher):
+        item = {"source": source, "row": pos, "name": name,
+                "invoice_row": None, "invoice_name": "", "tnved": "", "match": "unmatched"}
+        k, kind = matcher.match(name)
+        if k >= 0:
+            n_i, code_i, i = matcher.rows[k]
+            item.update(invoice_row=t.inv_pos[i], invoice_name=n_i, tnved=code_i, match=kind)
+        return item
+
+    for pos, name in zip(t.pk_pos, t.pk_name):
+        if only_code is not None:
+            out.append({"source": "packing.Товары", "row": pos, "name": name,
+                        "invoice_row": None, "invoice_name": "", "tnved": only_code, "match": "single_code"})
+        elif not tnved_set:
+            out.append({"source": "packing.Товары", "row": pos, "name": name,
+                        "invoice_row": None, "invoice_name": "", "tnved": "", "match": "no_codes"})
+        else:
+            out.append(_row("packing.Товары", pos, name, t.weight_matcher))
 
+    for pos, name in zip(t.tr_pos, t.tr_name):
+        out.append(_row("packing.Перевозка.Товары", pos, name, t.sum_matcher))
+    return out
+
+def get_brutto (data: dict) -> int:
+    t = goods_table(data)
+    tnved_set = {c for c in t.tnved_codes if c}
     if not tnved_set:
         return {}
 
-    invoice_goods = (data.get("invoice", {}) or {}).get("Товары", []) or []
-    packing_goods = (data.get("packing", {}) or {}).get("Товары", []) or []
-
     if len(tnved_set) == 1:
         only_code = next(iter(tnved_set))
         total = 0.0
-        for g in packing_goods:
-            v = g.get("Масса брутто")
-            if v in (None, ""):
-                continue
-            s = str(v).replace("\u00A0", "").replace(" ", "").replace(",", ".")
-            try:
-                if not re.fullmatch(r"[0-9.]+", s):
-                    s = re.sub(r"[^0-9.,]", "", s).replace(",", ".")
-                total += float(s)
-            except ValueError:
-                pass
+        for brutto in t.pk_brutto:
+            if brutto is not None:
+                total += brutto
         return {only_code: total} if total else {only_code: 0.0}
-    inv_rows = []
-    for gi in invoice_goods:
-        name_i = str(gi.get("Наименование") or gi.get("Описание") or "")
-        nname_i = " ".join(name_i.lower().replace("\u00A0", " ").split())
-        code_i = str(gi.get("Код ТНВЭД")).strip()
-        if nname_i and code_i:
-            inv_rows.append((nname_i, code_i))
 
     agg = {}
-    for gp in packing_goods:
-        name_p = str(gp.get("Наименование") or gp.get("Описание") or "")
-        nname_p = " ".join(name_p.lower().replace("\u00A0", " ").split())
-
-        v = gp.get("Масса брутто")
-        s = "0" if v in (None, "") else str(v).replace("\u00A0", "").replace(" ", "").replace(",", ".")
-        try:
-            if not re.fullmatch(r"[0-9.]+", s):
-                s = re.sub(r"[^0-9.,]", "", s).replace(",", ".")
-            brutto = float(s)
-        except ValueError:
-            brutto = 0.0
-        if brutto == 0.0:
+    for nname_p, brutto in zip(t.pk_name, t.pk_brutto):
+        if not brutto:
             continue
-
-        matched_code = None
-        for n_i, code_i in inv_rows:
-            if n_i in nname_p or nname_p in n_i:
-                matched_code = code_i
-                break
-
+        matched_code = t.weight_matcher.code(nname_p)
         if matched_code:
             agg[matched_code] = agg.get(matched_code, 0.0) + brutto
     rounded_agg = {}
@@ -422,65 +691,26 @@ def get_brutto (data: dict) -> int:
     return rounded_agg
 
 def get_netto(data: dict) -> dict:
-    codes_raw = get_tnved(data)
-    if isinstance(codes_raw, set):
-        tnved_set = {c for c in codes_raw if c}
-    elif isinstance(codes_raw, str) and codes_raw:
-        tnved_set = {codes_raw}
-    else:
-        tnved_set = set()
-
+    t = goods_table(data)
+    tnved_set = {c for c in t.tnved_codes if c}
     if not tnved_set:
         return {}
 
-    invoice_goods = (data.get("invoice", {}) or {}).get("Товары", []) or []
-    packing_goods = (data.get("packing", {}) or {}).get("Товары", []) or []
-
     if len(tnved_set) == 1:
         only_code = next(iter(tnved_set))
         total = 0.0
-        for g in packing_goods:
-            v = g.get("Масса нетто")
-            if v in (None, ""):
-                continue
-            s = str(v).replace("\u00A0", "").replace(" ", "").replace(",", ".")
-            try:
-                if not re.fullmatch(r"[0-9.]+", s):
-                    s = re.sub(r"[^0-9.,]", "", s).replace(",", ".")
-                total += float(s)
-            except ValueError:
-                pass
+        for netto in t.pk_netto:
+            if netto is not None:
+                total += netto
         total_rounded = round(total, 3) if total else 0.0
         return {only_code: total_rounded}
 
-    inv_rows = []
-    for gi in invoice_goods:
-        name_i = str(gi.get("Наименование") or gi.get("Описание") or "")
-        nname_i = " ".join(name_i.lower().replace("\u00A0", " ").split())
-        code_i = str(gi.get("Код ТНВЭД")).strip()
-        if nname_i and code_i:
-            inv_rows.append((nname_i, code_i))
-
+    # по кодам распределяется масса брутто без очистки единиц (как и раньше)
     agg = {}
-    for gp in packing_goods:
-        name_p = str(gp.get("Наименование") or gp.get("Описание") or "")
-        nname_p = " ".join(name_p.lower().replace("\u00A0", " ").split())
-
-        v = gp.get("Масса брутто")
-        s = "0" if v in (None, "") else str(v).replace("\u00A0", "").replace(" ", "").replace(",", ".")
-        try:
-            brutto = float(s)
-        except ValueError:
-            brutto = 0.0
-        if brutto == 0.0:
+    for nname_p, brutto in zip(t.pk_name, t.pk_brutto_plain):
+        if not brutto:
             continue
-
-        matched_code = None
-        for n_i, code_i in inv_rows:
-            if n_i in nname_p or nname_p in n_i:
-                matched_code = code_i
-                break
-
+        matched_code = t.weight_matcher.code(nname_p)
         if matched_code:
             agg[matched_code] = agg.get(matched_code, 0.0) + brutto
 
@@ -492,66 +722,24 @@ def get_netto(data: dict) -> dict:
 
 
 def get_seats (data: dict) -> int:
-    codes_raw = get_tnved(data)
-    if isinstance(codes_raw, set):
-        tnved_set = {c for c in codes_raw if c}
-    elif isinstance(codes_raw, str) and codes_raw:
-        tnved_set = {codes_raw}
-    else:
-        tnved_set = set()
-
+    t = goods_table(data)
+    tnved_set = {c for c in t.tnved_codes if c}
     if not tnved_set:
         return {}
 
-    invoice_goods = (data.get("invoice", {}) or {}).get("Товары", []) or []
-    packing_goods = (data.get("packing", {}) or {}).get("Товары", []) or []
-
     if len(tnved_set) == 1:
         only_code = next(iter(tnved_set))
         total = 0
-        for g in packing_goods:
-            v = g.get("Количество мест")
-            if v in (None, ""):
-                continue
-            s = str(v).replace("\u00A0", "").replace(" ", "").replace(",", ".")
-            try:
-                if not re.fullmatch(r"[0-9.]+", s):
-                    s = re.sub(r"[^0-9.,]", "", s).replace(",", ".")
-                total += int(s)
-            except ValueError:
-                pass
+        for seats in t.pk_seats:
+            if seats is not None:
+                total += seats
         return {only_code: total} if total else {only_code: 0}
 
-    inv_rows = []
-    for gi in invoice_goods:
-        name_i = str(gi.get("Наименование") or gi.get("Описание") or "")
-        nname_i = " ".join(name_i.lower().replace("\u00A0", " ").split())
-        code_i = str(gi.get("Код ТНВЭД")).strip()
-        if nname_i and code_i:
-            inv_rows.append((nname_i, code_i))
-
     agg = {}
-    for gp in packing_goods:
-        name_p = str(gp.get("Наименование") or gp.get("Описание") or "")
-        nname_p = " ".join(name_p.lower().replace("\u00A0", " ").split())
-
-        v = gp.get("Количество мест")
-        s = "0" if v in (None, "") else str(v).replace("\u00A0", "").replace(" ", "").replace(",", ".")
-        try:
-            if not re.fullmatch(r"[0-9.]+", s):
-                s = re.sub(r"[^0-9.,]", "", s).replace(",", ".")
-            seats = int(s)
-        except ValueError:
-            seats = 0
-        if seats == 0:
+    for nname_p, seats in zip(t.pk_name, t.pk_seats):
+        if not seats:
             continue
-
-        matched_code = None
-        for n_i, code_i in inv_rows:
-            if n_i in nname_p or nname_p in n_i:
-                matched_code = code_i
-                break
-
+        matched_code = t.weight_matcher.code(nname_p)
         if matched_code:
             agg[matched_code] = agg.get(matched_code, 0) + seats
     return agg
@@ -588,34 +776,9 @@ def _to_decimal(x) -> Decimal:
         return Decimal("0")
 
 def get_total_sum_invoice(data: Dict) -> Decimal: 
-    goods_packing = data.get("packing", {}).get("Перевозка", {}).get("Товары", []) 
-    goods_invoice = data.get("invoice", {}).get("Товары", []) 
-    sum_pack = Decimal("0") 
-    sum_inv = Decimal("0") 
-    if isinstance(goods_packing, list): 
-        for g in goods_packing: 
-            if not isinstance(g, dict): 
-                continue 
-            price = _to_decimal(g.get("Цена")) 
-            qty = _to_decimal(g.get("Количество")) 
-            total = _to_decimal(g.get("Стоимость")) 
-            if total > 0: 
-                item_total = total 
-            else: 
-                item_total = price * qty 
-            sum_pack += item_total 
-    if isinstance(goods_invoice, list): 
-        for g in goods_invoice: 
-            if not isinstance(g, dict): 
-                continue 
-            price = _to_decimal(g.get("Цена")) 
-            qty = _to_decimal(g.get("Количество")) 
-            total = _to_decimal(g.get("Стоимость")) 
-            if total > 0: 
-                item_total = total 
-            else: 
-                item_total = price * qty 
-            sum_inv += item_total 
+    t = goods_table(data)
+    sum_pack = t.transport_sum()
+    sum_inv = t.invoice_sum()
     tol = Decimal("0.01") 
     if sum_inv == 0 and sum_pack == 0: 
         return Decimal("0") 
@@ -625,49 +788,22 @@ def get_total_sum_invoice(data: Dict) -> Decimal:
 
 
 def get_total_sum_tnved(data: Dict) -> Decimal:
-    goods_packing = (data.get("packing", {}) or {}).get("Перевозка", {}).get("Товары", []) or []
-    goods_invoice = (data.get("invoice", {}) or {}).get("Товары", []) or []
+    t = goods_table(data)
     tol = Decimal("0.01")
 
-    def _n(x) -> str:
-        return " ".join(str(x or "").lower().replace("\u00A0", " ").split())
-
     inv_sum: Dict[str, Decimal] = {}
-    inv_index = [] 
-    for g in goods_invoice:
-        if not isinstance(g, dict):
-            continue
-        code = str(g.get("Код ТНВЭД") or g.get("Код ТН ВЭД") or "").strip()
-        if not code:
-            continue
-        name_i = _n(g.get("Наименование") or g.get("Описание"))
-        inv_index.append((name_i, code))
-
-        price = _to_decimal(g.get("Цена"))
-        qty   = _to_decimal(g.get("Количество"))
-        total = _to_decimal(g.get("Стоимость"))
-        item_total = total if total > 0 else (price * qty)
-        inv_sum[code] = inv_sum.get(code, Decimal("0")) + item_total
+    if t.inv_is_list:
+        for code, item_total in zip(t.inv_code_any, t.inv_amount):
+            if not code:
+                continue
+            inv_sum[code] = inv_sum.get(code, Decimal("0")) + item_total
 
     pack_sum: Dict[str, Decimal] = {}
-    for g in goods_packing:
-        if not isinstance(g, dict):
-            continue
-        name_p = _n(g.get("Наименование") or g.get("Описание"))
-
-        price = _to_decimal(g.get("Цена"))
-        qty   = _to_decimal(g.get("Количество"))
-        total = _to_decimal(g.get("Стоимость"))
-        item_total = total if total > 0 else (price * qty)
+    for name_p, item_total in zip(t.tr_name, t.tr_amount):
         if item_total <= 0:
             continue
 
-        matched_code = None
-        for n_i, code in inv_index:
-            if n_i and name_p and (n_i in name_p or name_p in n_i):
-                matched_code = code
-                break
-
+        matched_code = t.sum_matcher.code(name_p)
         if matched_code:
             pack_sum[matched_code] = pack_sum.get(matched_code, Decimal("0")) + item_total
 
@@ -711,12 +847,20 @@ def _is_unknown(s: str) -> bool:
     up = s.upper().strip()
     return up in ("", "-", "N/A", "UNKNOWN", "НЕИЗВЕСТНО", "НЕИЗВЕСТНА", "NO DATA")
 
+def _origin_value(v, valid_countries) -> str:
+    # точное написание из справочника — как есть; иначе нечёткий поиск ("P.R.CHINA", "GERMNAY"),
+    # не распознано — пустая строка (для g16 это "неизвестна")
+    norm_v = _norm_str(v)
+    if norm_v.upper() in valid_countries:
+        return norm_v
+    if _is_unknown(norm_v) or _is_eu_label(norm_v):
+        return ""
+    m = resolve_country(norm_v)
+    return m.name if m is not None else ""
+
+
 def collect_origin_values(data: dict) -> list:
-    countries = pd.read_csv(COUNTRIES_CSV)
-    valid_countries = set()
-    for col in countries.columns:
-        valid_countries.update(countries[col].astype(str).str.upper().str.strip().tolist())
-    valid_countries = {c for c in valid_countries if c and c not in {"NONE", "NULL", "-", "—"}}
+    valid_countries = get_refdata().country_values
 
     vals = []
     inv_goods = data.get("invoice", {}).get("Товары", [])
@@ -729,11 +873,7 @@ def collect_origin_values(data: dict) -> list:
                     or g.get("Страна-изготовитель")
                 )
                 if v is not None:
-                    norm_v = _norm_str(v)
-                    if norm_v.upper() in valid_countries:
-                        vals.append(norm_v)
-                    else:
-                        vals.append("")
+                    vals.append(_origin_value(v, valid_countries))
 
     pack_goods = data.get("packing", {}).get("Перевозка", {}).get("Товары", [])
     if isinstance(pack_goods, list):
@@ -745,11 +885,7 @@ def collect_origin_values(data: dict) -> list:
                     or g.get("Страна-изготовитель")
                 )
                 if v is not None:
-                    norm_v = _norm_str(v)
-                    if norm_v.upper() in valid_countries:
-                        vals.append(norm_v)
-                    else:
-                        vals.append("")
+                    vals.append(_origin_value(v, valid_countries))
 
     return vals
 
@@ -874,29 +1010,40 @@ def get_transport(data: dict) -> Tuple[int, str, str]:
     return 0, "", ""
 
 
+_PLACE_LEAD_RE = re.compile(r"^[\s,.;:–—\-]+")
+_PLACE_TAIL_RE = re.compile(r"[\s,.;:–—\-]+$")
+
+@lru_cache(maxsize=4)
+def _incoterms_matcher(codes: Tuple[str, ...]):
+    # Одна регулярка на все коды справочника; из нескольких найденных побеждает код,
+    # стоящий в справочнике раньше (как при переборе по порядку).
+    rank: Dict[str, int] = {}
+    for i, code in enumerate(codes):
+        if code:
+            rank.setdefault(code, i)
+    if not rank:
+        return None, rank
+    alt = "|".join(re.escape(c) for c in sorted(rank, key=len, reverse=True))
+    return re.compile(rf"\b(?:{alt})\b"), rank
+
+@lru_cache(maxsize=64)
+def _incoterm_code_re(code: str):
+    return re.compile(rf"\b{re.escape(code)}\b", re.IGNORECASE)
+
 def get_incoterms(incoterms_str):
-    found_code = ""
-    place = ""
     s = "" if incoterms_str is None else str(incoterms_str).strip()
     if s == "":
         return "", ""
 
-    inc = pd.read_csv(INCOTERMS_CSV, dtype=str)
-    codes = [str(x).strip().upper() for x in inc["Код условия поставки"].dropna().tolist()]
-
-    up = s.upper()
-    for code in codes:
-        if not code:
-            continue
-        if re.search(rf"\b{re.escape(code)}\b", up):
-            found_code = code
-            place = re.sub(rf"\b{re.escape(code)}\b", "", s, flags=re.IGNORECASE)
-            place = re.sub(r"^[\s,.;:–—\-]+", "", place).strip() 
-            place = re.sub(r"[\s,.;:–—\-]+$", "", place).strip()   
-            break
-    if not found_code:
-        place = s
+    pattern, rank = _incoterms_matcher(get_refdata().incoterms_codes)
+    found = [m.group(0) for m in pattern.finditer(s.upper())] if pattern is not None else []
+    if not found:
+        return "", s
 
+    found_code = min(found, key=rank.__getitem__)
+    place = _incoterm_code_re(found_code).sub("", s)
+    place = _PLACE_LEAD_RE.sub("", place).strip()
+    place = _PLACE_TAIL_RE.sub("", place).strip()
     return found_code, place
 
 def get_transport_type(data: dict, reys: str) -> str:
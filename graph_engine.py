@@ -0,0 +1,482 @@
+# graph_engine.py
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+GraphFunc = Callable[[Dict[str, Any], Dict[str, Any]], Dict[str, Any]]
+
+# потоков на внешние запросы (курс ЦБ, СВХ) и на параллельный расчёт сетевых узлов — общие на процесс
+GRAPHS_IO_WORKERS = int(os.getenv("GRAPHS_IO_WORKERS", "4"))
+
+
+class GraphCycleError(RuntimeError):
+    pass
+
+
+class GraphNode:
+    __slots__ = ("name", "func", "deps", "paths", "reads", "io")
+
+    def __init__(
+        self,
+        name: str,
+        func: GraphFunc,
+        deps: Sequence[str] = (),
+        paths: Sequence[str] = (),
+        reads: Sequence[str] = (),
+        io: bool = False,
+    ):
+        self.name = name
+        self.func = func
+        self.io = io                                 # узел ждёт сеть (курс ЦБ, СВХ) — считается параллельно
+        self.deps: Tuple[str, ...] = tuple(deps)     # другие графы, результаты которых использует узел
+        self.paths: Tuple[str, ...] = tuple(paths)   # пути all_data ("invoice.Товары", "transport_*", "*")
+        self.reads: Tuple[str, ...] = tuple(reads)   # ключи overrides; "g12_" — префикс
+
+    @property
+    def internal(self) -> bool:
+        return self.name.startswith("_")
+
+
+def _read_matches(spec: str, key: str) -> bool:
+    return key.startswith(spec) if spec.endswith("_") else key == spec
+
+
+def _path_matches(spec: str, section: str) -> bool:
+    if spec == "*":
+        return True
+    head = spec.split(".", 1)[0]
+    if head.endswith("*"):
+        return section.startswith(head[:-1])
+    return section == head
+
+
+def section_fingerprints(all_data: Dict[str, Any]) -> Dict[str, str]:
+    out: Dict[str, str] = {}
+    for key, val in (all_data or {}).items():
+        raw = json.dumps(val, ensure_ascii=False, sort_keys=True, default=str)
+        out[str(key)] = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+    return out
+
+
+def changed_sections(old: Dict[str, str], new: Dict[str, str]) -> set:
+    return {k for k in set(old) | set(new) if old.get(k) != new.get(k)}
+
+
+def changed_override_keys(old: Dict[str, Any], new: Dict[str, Any]) -> set:
+    return {k for k in set(old) | set(new) if k not in old or k not in new or old[k] != new[k]}
+
+
+class GraphMetrics:
+    """Скользящее окно последних N замеров на ключ: узлы графов ("graph") и внешние запросы ("lookup")."""
+
+    def __init__(self, window: int = 1000):
+        self.window = max(1, int(window))
+        self._lock = threading.Lock()
+        self._samples: Dict[Tuple[str, str], deque] = {}
+        self._counts: Dict[Tuple[str, str], List[int]] = {}  # [вызовов, ошибок] с момента старта
+
+    def observe(self, kind: str, name: str, seconds: float, ok: bool = True) -> None:
+        key = (kind, name)
+        with self._lock:
+            dq = self._samples.get(key)
+            if dq is None:
+                dq = self._samples[key] = deque(maxlen=self.window)
+                self._counts[key] = [0, 0]
+            dq.append(seconds)
+            c = self._counts[key]
+            c[0] += 1
+            if not ok:
+                c[1] += 1
+
+    @staticmethod
+    def _pct(sorted_vals: List[float], q: float) -> float:
+        i = min(len(sorted_vals) - 1, max(0, int(round(q * (len(sorted_vals) - 1)))))
+        return sorted_vals[i]
+
+    def snapshot(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        with self._lock:
+            items = [(k, sorted(v), list(self._counts[k])) for k, v in self._samples.items()]
+        out: Dict[str, Dict[str, Dict[str, float]]] = {}
+        for (kind, name), vals, (count, errors) in items:
+            out.setdefault(kind, {})[name] = {
+                "count": count,
+                "errors": errors,
+                "p50_ms": round(self._pct(vals, 0.50) * 1000, 2),
+                "p95_ms": round(self._pct(vals, 0.95) * 1000, 2),
+                "p99_ms": round(self._pct(vals, 0.99) * 1000, 2),
+                "max_ms": round(vals[-1] * 1000, 2),
+            }
+        return out
+
+    def reset(self) -> None:
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+
+
+class GraphRegistry:
+    def __init__(self):
+        self._nodes: Dict[str, GraphNode] = {}
+
+    def register(
+        self,
+        name: str,
+        func: GraphFunc,
+        *,
+        deps: Sequence[str] = (),
+        paths: Sequence[str] = (),
+        reads: Sequence[str] = (),
+        io: bool = False,
+    ) -> GraphNode:
+        if name in self._nodes:
+            raise ValueError(f"Граф {name} уже зарегистрирован")
+        node = GraphNode(name, func, deps=deps, paths=paths, reads=reads, io=io)
+        self._nodes[name] = node
+        return node
+
+    def node(self, name: str) -> GraphNode:
+        try:
+            return self._nodes[name]
+        except KeyError:
+            raise KeyError(f"Неизвестный граф: {name}") from None
+
+    def names(self) -> List[str]:
+        return list(self._nodes.keys())
+
+    def nodes(self) -> List[GraphNode]:
+        return list(self._nodes.values())
+
+    def closure(self, names: Optional[Iterable[str]] = None) -> List[str]:
+        if names is None:
+            return self.names()
+        need: set = set()
+        stack = list(names)
+        while stack:
+            n = stack.pop()
+            if n in need:
+                continue
+            need.add(n)
+            stack.extend(self.node(n).deps)
+        return [n for n in self._nodes if n in need]
+
+    def node_for_key(self, key: str) -> Optional[str]:
+        # "g30" -> g30, "g30_3" -> g30, "goods_by_tnved" -> goods
+        if key in self._nodes:
+            return key
+        for name in self._nodes:
+            if key.startswith(name + "_"):
+                return name
+        return None
+
+    def resolve_fields(
+        self,
+        fields: Iterable[str],
+        groups: Optional[Dict[str, Sequence[str]]] = None,
+    ) -> Tuple[List[str], List[str]]:
+        """Имена графов, ключи результатов или группы -> (узлы в порядке регистрации, нераспознанные)."""
+        groups = groups or {}
+        picked: set = set()
+        unknown: List[str] = []
+        for f in fields:
+            f = str(f).strip()
+            if not f:
+                continue
+            if f in groups:
+                picked.update(groups[f])
+                continue
+            name = self.node_for_key(f)
+            if name is None:
+                unknown.append(f)
+            else:
+                picked.add(name)
+        return [n for n in self._nodes if n in picked], unknown
+
+    def affected(self, keys: Iterable[str] = (), sections: Iterable[str] = ()) -> set:
+        # Узлы, читающие изменённые ключи overrides или разделы all_data, и все зависящие от них
+        keys = set(keys)
+        sections = set(sections)
+        hit = set()
+        for node in self._nodes.values():
+            if any(_read_matches(r, k) for r in node.reads for k in keys) or any(
+                _path_matches(p, sec) for p in node.paths for sec in sections
+            ):
+                hit.add(node.name)
+        return self.with_dependents(hit)
+
+    def with_dependents(self, names: Iterable[str]) -> set:
+        hit = set(names)
+        grown = True
+        while grown:
+            grown = False
+            for node in self._nodes.values():
+                if node.name not in hit and any(d in hit for d in node.deps):
+                    hit.add(node.name)
+                    grown = True
+        return hit
+
+    def reusable(
+        self,
+        results: Dict[str, Dict[str, Any]],
+        keys: Iterable[str] = (),
+        sections: Iterable[str] = (),
+    ) -> Dict[str, Dict[str, Any]]:
+        stale = self.affected(keys, sections)
+        return {n: r for n, r in (results or {}).items() if n in self._nodes and n not in stale}
+
+    def result(self, name: str, all_data: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str, Any]:
+        ev = current_evaluation()
+        if ev is not None and ev.registry is self and ev.all_data is all_data and ev.overrides is overrides:
+            return ev.get(name)
+        return self.node(name).func(all_data, overrides)
+
+
+class Memo:
+    """Потокобезопасная мемоизация: параллельные вызовы с одним ключом ждут первый."""
+
+    def __init__(self, keep_errors: bool = True):
+        self.keep_errors = keep_errors
+        self._lock = threading.Lock()
+        self._items: Dict[Any, Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._items
+
+    def get_or_call(self, key: Any, fn: Callable[..., Any], *args: Any) -> Any:
+        with self._lock:
+            fut = self._items.get(key)
+            owner = fut is None
+            if owner:
+                fut = self._items[key] = Future()
+        if owner:
+            try:
+                fut.set_result(fn(*args))
+            except BaseException as e:
+                if not self.keep_errors:
+                    with self._lock:
+                        self._items.pop(key, None)
+                fut.set_exception(e)
+        return fut.result()
+
+
+_current: ContextVar[Optional["GraphEvaluation"]] = ContextVar("graph_evaluation", default=None)
+_shared: ContextVar[Optional[Memo]] = ContextVar("graph_shared_memo", default=None)
+
+
+def current_evaluation() -> Optional["GraphEvaluation"]:
+    return _current.get()
+
+
+@contextmanager
+def shared_memo(memo: Memo):
+    # Общий для пакета деклараций кэш внешних справочников (курсы ЦБ, СВХ)
+    token = _shared.set(memo)
+    try:
+        yield memo
+    finally:
+        _shared.reset(token)
+
+
+def scoped_memo(key: Any, fn: Callable[..., Any], *args: Any, shared: bool = False) -> Any:
+    # Мемоизация в пределах текущего вычисления графов; вне его — прямой вызов.
+    # shared=True — сначала общий кэш пакета (shared_memo), если он задан.
+    if shared:
+        memo = _shared.get()
+        if memo is not None:
+            try:
+                return memo.get_or_call(key, scoped_memo, key, fn, *args)
+            except Exception:
+                # ошибку чужого запроса из общего кэша пакета тоже засчитать текущему узлу
+                if fn is external_call:
+                    _mark_lookup_failed()
+                raise
+    ev = _current.get()
+    if ev is None:
+        return fn(*args)
+    return ev.memoize(key, fn, *args)
+
+
+def _mark_lookup_failed() -> None:
+    ev = _current.get()
+    if ev is not None:
+        ev.mark_lookup_failed()
+
+
+_io_pool = ThreadPoolExecutor(max_workers=max(1, GRAPHS_IO_WORKERS), thread_name_prefix="graph-io")
+_node_pool = ThreadPoolExecutor(max_workers=max(1, GRAPHS_IO_WORKERS), thread_name_prefix="graph-node")
+
+
+def timed_call(timeout: Optional[float], fn: Callable[..., Any], *args: Any) -> Any:
+    """
+    Вызов fn(*args) с ограничением по времени; по истечении — TimeoutError (сам вызов доработает в фоне).
+    Отсчёт — с постановки в _io_pool: если за timeout свободный поток так и не нашёлся, вызов снимается
+    с очереди и не выполняется вовсе.
+    """
+    if not timeout or timeout <= 0:
+        return fn(*args)
+    fut = _io_pool.submit(fn, *args)
+    try:
+        return fut.result(timeout=timeout)
+    except FutureTimeout:
+        fut.cancel()
+        raise TimeoutError(f"{getattr(fn, '__name__', fn)}{args!r}: нет ответа за {timeout}s") from None
+
+
+def external_call(kind: str, timeout: Optional[float], fn: Callable[..., Any], *args: Any) -> Any:
+    """timed_call с учётом времени в текущем расчёте (ev.lookups) и в его метриках."""
+    ev = _current.get()
+    t0 = time.perf_counter()
+    ok = False
+    try:
+        res = timed_call(timeout, fn, *args)
+        ok = True
+        return res
+    finally:
+        if ev is not None:
+            ev.record_lookup(kind, time.perf_counter() - t0, ok)
+            if not ok:
+                ev.mark_lookup_failed()
+
+
+class GraphEvaluation:
+    def __init__(
+        self,
+        registry: GraphRegistry,
+        all_data: Dict[str, Any],
+        overrides: Dict[str, Any],
+        seed: Optional[Dict[str, Dict[str, Any]]] = None,
+        workers: int = 1,
+        metrics: Optional[GraphMetrics] = None,
+    ):
+        self.registry = registry
+        self.all_data = all_data
+        self.overrides = overrides
+        self.results: Dict[str, Dict[str, Any]] = dict(seed or {})  # ранее посчитанные, всё ещё валидные узлы
+        self.memo = Memo()
+        self.timings: Dict[str, float] = {}  # секунды на узел (включая зависимости, посчитанные изнутри)
+        self.lookups: Dict[str, List[float]] = {}  # внешние запросы: вид -> длительности
+        self.lookup_failed: set = set()  # узлы, у которых внешний запрос упал или не ответил вовремя
+        self.metrics = metrics
+        self.workers = max(1, int(workers or 1))
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Future] = {}
+        self._local = threading.local()
+
+    @property
+    def _active(self) -> List[str]:
+        # стек вычисляемых узлов — свой у каждого потока
+        active = getattr(self._local, "active", None)
+        if active is None:
+            active = self._local.active = []
+        return active
+
+    def memoize(self, key: Any, fn: Callable[..., Any], *args: Any) -> Any:
+        # Один вызов на ключ даже из параллельных узлов; ошибка тоже запоминается до конца расчёта
+        try:
+            return self.memo.get_or_call(key, fn, *args)
+        except Exception:
+            # запомненная ошибка внешнего запроса — и для узлов, получивших её из memo
+            if fn is external_call:
+                self.mark_lookup_failed()
+            raise
+
+    def mark_lookup_failed(self) -> None:
+        active = self._active
+        if active:
+            with self._lock:
+                self.lookup_failed.add(active[-1])
+
+    def unreliable(self) -> set:
+        # Узлы с упавшими внешними запросами и все зависящие от них: их результат — запасное значение,
+        # переиспользовать и кэшировать его нельзя
+        return self.registry.with_dependents(self.lookup_failed)
+
+    def record_lookup(self, kind: str, seconds: float, ok: bool = True) -> None:
+        with self._lock:
+            self.lookups.setdefault(kind, []).append(seconds)
+        if self.metrics is not None:
+            self.metrics.observe("lookup", kind, seconds, ok)
+
+    def get(self, name: str) -> Dict[str, Any]:
+        res = self.results.get(name)
+        if res is not None:
+            return res
+        if name in self._active:
+            raise GraphCycleError(" -> ".join(self._active + [name]))
+
+        with self._lock:
+            res = self.results.get(name)
+            if res is not None:
+                return res
+            fut = self._pending.get(name)
+            owner = fut is None
+            if owner:
+                fut = self._pending[name] = Future()
+        if not owner:
+            return fut.result()
+
+        node = self.registry.node(name)
+        self._active.append(name)
+        token = _current.set(self)
+        t0 = time.perf_counter()
+        try:
+            res = node.func(self.all_data, self.overrides) or {}
+        except BaseException as e:
+            if self.metrics is not None:
+                self.metrics.observe("graph", name, time.perf_counter() - t0, ok=False)
+            with self._lock:
+                self._pending.pop(name, None)
+            fut.set_exception(e)
+            raise
+        finally:
+            _current.reset(token)
+            self._active.pop()
+        elapsed = time.perf_counter() - t0
+        with self._lock:
+            self.results[name] = res
+            self.timings[name] = elapsed
+            self._pending.pop(name, None)
+        if self.metrics is not None:
+            self.metrics.observe("graph", name, elapsed)
+        fut.set_result(res)
+        return res
+
+    def _start_io(self, order: List[str]) -> List[Future]:
+        io = [n for n in order if self.registry.node(n).io and n not in self.results]
+        if self.workers < 2 or len(io) < 2:
+            return []
+        # общий пул процесса; узлы, до которых он не дошёл, основной поток посчитает сам в run()
+        return [_node_pool.submit(contextvars.copy_context().run, self.get, n) for n in io]
+
+    def run(self, names: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        order = self.registry.closure(names)
+        started = self._start_io(order)
+        try:
+            for n in order:
+                self.get(n)
+        finally:
+            for f in started:
+                # ещё не начатые задачи не нужны — узел уже посчитан; начатые дождаться,
+                # их ошибки уже подняты через get()
+                if not f.cancel():
+                    f.exception()
+        return self.merged(order)
+
+    def merged(self, names: Optional[Iterable[str]] = None, with_deps: bool = True) -> Dict[str, Any]:
+        graphs: Dict[str, Any] = {}
+        order = self.registry.closure(names) if with_deps else [n for n in self.registry.names() if n in set(names or ())]
+        for n in order:
+            if self.registry.node(n).internal or n not in self.results:
+                continue
+            graphs.update(self.results[n])
+        return graphs
@@ -0,0 +1,250 @@
+# http_client.py
+# Общий HTTP-клиент для внешних сервисов (cbr.ru, alta.ru, OfData, Yandex Vision, YooKassa):
+# keep-alive пулы соединений на хост, таймауты подключения/чтения, повторы с джиттером,
+# ограничение одновременных запросов к одному хосту.
+#   sync:  http_client.get(url, ...) / http_client.post(url, ...)   -> requests.Response
+#   async: await http_client.arequest("POST", url, ...)             -> httpx.Response
+# Идемпотентные запросы повторяются на ошибках соединения, таймаутах чтения и ответах 429/502/503/504.
+# POST по умолчанию неидемпотентен: повтор — только если соединение не установлено (запрос точно не ушёл).
+import asyncio
+import os
+import random
+import threading
+import time
+import urllib.parse
+import weakref
+from typing import Any, Dict, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "20"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "10"))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))            # keep-alive соединений на хост
+HTTP_MAX_PER_HOST = int(os.getenv("HTTP_MAX_PER_HOST", "8"))       # одновременных запросов на хост
+HTTP_QUEUE_TIMEOUT = float(os.getenv("HTTP_QUEUE_TIMEOUT", "30"))  # ожидание свободного слота
+# отдельные лимиты: "www.alta.ru=2,api.ofdata.ru=4"
+HTTP_HOST_LIMITS: Dict[str, int] = {
+    h.strip().lower(): int(n)
+    for h, _, n in (item.partition("=") for item in os.getenv("HTTP_HOST_LIMITS", "www.alta.ru=4").split(","))
+    if h.strip() and n.strip()
+}
+
+RETRY_STATUSES = (429, 502, 503, 504)
+_IDEMPOTENT = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+Timeout = Union[None, float, Tuple[float, float]]
+
+_lock = threading.Lock()
+_sessions: Dict[str, requests.Session] = {}
+_slots: Dict[str, threading.BoundedSemaphore] = {}
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Any]" = weakref.WeakKeyDictionary()
+_async_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = (
+    weakref.WeakKeyDictionary()
+)
+_stats: Dict[str, Dict[str, int]] = {}
+
+
+def _host(url: str) -> str:
+    return (urllib.parse.urlsplit(url).hostname or "").lower()
+
+
+def _limit(host: str) -> int:
+    return HTTP_HOST_LIMITS.get(host, HTTP_MAX_PER_HOST)
+
+
+def _timeouts(timeout: Timeout) -> Tuple[float, float]:
+    if timeout is None:
+        return HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT
+    if isinstance(timeout, tuple):
+        return timeout
+    return min(HTTP_CONNECT_TIMEOUT, float(timeout)), float(timeout)
+
+
+def _count(host: str, key: str) -> None:
+    with _lock:
+        s = _stats.setdefault(host, {"requests": 0, "retries": 0, "errors": 0})
+        s[key] += 1
+
+
+def _backoff(attempt: int, retry_after: Optional[str] = None) -> float:
+    # "full jitter": случайная пауза до base * 2^attempt — повторы разных потоков не совпадают
+    if retry_after:
+        try:
+            return min(float(retry_after), HTTP_BACKOFF_MAX) + random.uniform(0, HTTP_BACKOFF_BASE)
+        except ValueError:
+            pass
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+
+
+def _is_idempotent(method: str, idempotent: Optional[bool]) -> bool:
+    return method.upper() in _IDEMPOTENT if idempotent is None else idempotent
+
+
+def _not_sent(e: requests.ConnectionError) -> bool:
+    # requests.ConnectionError оборачивает и обрыв уже отправленного запроса (RemoteDisconnected,
+    # ProtocolError) — запрос точно не ушёл, только если соединение не установлено
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    from urllib3.exceptions import MaxRetryError, NewConnectionError
+    reason = e.args[0] if e.args else None
+    if isinstance(reason, MaxRetryError):
+        reason = reason.reason
+    return isinstance(reason, NewConnectionError)   # в т.ч. NameResolutionError
+
+
+# ---------- sync (requests) ----------
+
+def _session(host: str) -> Tuple[requests.Session, threading.BoundedSemaphore]:
+    with _lock:
+        s = _sessions.get(host)
+        if s is None:
+            s = requests.Session()
+            # повторы делаем сами (с джиттером и учётом идемпотентности), urllib3 не повторяет
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(HTTP_POOL_SIZE, _limit(host)), max_retries=0)
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            _sessions[host] = s
+            _slots[host] = threading.BoundedSemaphore(_limit(host))
+        return s, _slots[host]
+
+
+def request(
+    method: str,
+    url: str,
+    *,
+    timeout: Timeout = None,
+    retries: Optional[int] = None,
+    idempotent: Optional[bool] = None,
+    **kwargs,
+) -> requests.Response:
+    """
+    requests.request через общий пул хоста. Ответ с ошибкой HTTP возвращается как есть (raise_for_status —
+    у вызывающего), исключение — только если повторы исчерпаны на ошибке соединения/таймауте.
+    """
+    host = _host(url)
+    session, slot = _session(host)
+    retries = HTTP_RETRIES if retries is None else retries
+    safe = _is_idempotent(method, idempotent)
+    attempt = 0
+    while True:
+        if not slot.acquire(timeout=HTTP_QUEUE_TIMEOUT):
+            _count(host, "errors")
+            raise requests.exceptions.ConnectTimeout(f"{host}: нет свободного слота за {HTTP_QUEUE_TIMEOUT:g} с")
+        _count(host, "requests")
+        try:
+            r = session.request(method, url, timeout=_timeouts(timeout), **kwargs)
+        except requests.ConnectionError as e:
+            err, can_retry = e, safe or _not_sent(e)
+        except (requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            err, can_retry = e, safe
+        else:
+            err, can_retry = None, safe and r.status_code in RETRY_STATUSES
+        finally:
+            slot.release()
+
+        if not can_retry or attempt >= retries:
+            if err is not None:
+                _count(host, "errors")
+                raise err
+            return r
+        _count(host, "retries")
+        time.sleep(_backoff(attempt, None if err is not None else r.headers.get("Retry-After")))
+        attempt += 1
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+
+def close() -> None:
+    with _lock:
+        for s in _sessions.values():
+            s.close()
+        _sessions.clear()
+        _slots.clear()
+
+
+# ---------- async (httpx) ----------
+
+def _async_client(host: str):
+    # httpx.AsyncClient и asyncio.Semaphore привязаны к event loop — свои на каждый loop
+    import httpx
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = httpx.AsyncClient(
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=HTTP_POOL_SIZE),
+        )
+    slots = _async_slots.setdefault(loop, {})
+    slot = slots.get(host)
+    if slot is None:
+        slot = slots[host] = asyncio.Semaphore(_limit(host))
+    return client, slot
+
+
+async def arequest(
+    method: str,
+    url: str,
+    *,
+    timeout: Timeout = None,
+    retries: Optional[int] = None,
+    idempotent: Optional[bool] = None,
+    **kwargs,
+):
+    """То же, что request(), для async-обработчиков: общий httpx.AsyncClient вместо клиента на вызов."""
+    import httpx
+    host = _host(url)
+    client, slot = _async_client(host)
+    connect_s, read_s = _timeouts(timeout)
+    retries = HTTP_RETRIES if retries is None else retries
+    safe = _is_idempotent(method, idempotent)
+    attempt = 0
+    while True:
+        try:
+            await asyncio.wait_for(slot.acquire(), HTTP_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            _count(host, "errors")
+            raise httpx.PoolTimeout(f"{host}: нет свободного слота за {HTTP_QUEUE_TIMEOUT:g} с")
+        _count(host, "requests")
+        try:
+            r = await client.request(method, url, timeout=httpx.Timeout(read_s, connect=connect_s), **kwargs)
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+            # соединение не установлено (или не получено из пула) — запрос не ушёл, повтор безопасен и для POST
+            err, can_retry = e, True
+        except httpx.TransportError as e:
+            err, can_retry = e, safe
+        else:
+            err, can_retry = None, safe and r.status_code in RETRY_STATUSES
+        finally:
+            slot.release()
+
+        if not can_retry or attempt >= retries:
+            if err is not None:
+                _count(host, "errors")
+                raise err
+            return r
+        _count(host, "retries")
+        await asyncio.sleep(_backoff(attempt, None if err is not None else r.headers.get("Retry-After")))
+        attempt += 1
+
+
+async def aclose() -> None:
+    loop = asyncio.get_running_loop()
+    client = _async_clients.pop(loop, None)
+    _async_slots.pop(loop, None)
+    if client is not None:
+        await client.aclose()
+
+
+def stats() -> Dict[str, Dict[str, int]]:
+    with _lock:
+        return {h: dict(s) for h, s in _stats.items()}
@@ -1,25 +1,19 @@
-import requests, re, urllib.parse, pandas as pd
-from bs4 import BeautifulSoup
-from pypdf import PdfReader
-from io import BytesIO
-import warnings
-from pdfminer.high_level import extract_text
-import logging, warnings
-from pypdf.errors import PdfReadWarning
+import re, urllib.parse
 import os
-import google.generativeai as genai
-import mimetypes
 from urllib.parse import urljoin
-import json   
+
+import http_client
+import scraping
 
 base_url = "https://www.alta.ru/tam/"
 base_svh_url = "https://www.alta.ru/"  
 
-proxies = {'http': '45.182.176.38:9947'}
+proxies = {'http': os.getenv("ALTA_PROXY", '45.182.176.38:9947')}
 headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Trident/7.0; rv:11.0) like Gecko'}
+ALTA_TIMEOUT = float(os.getenv("ALTA_TIMEOUT", "10"))
 
 def get_html_data(url):
-    r = requests.get(url, proxies=proxies, headers=headers)
+    r = http_client.get(url, proxies=proxies, headers=headers, timeout=ALTA_TIMEOUT)
     html_data = r.text
     return html_data
 
@@ -113,36 +107,19 @@ def _parse_svh_address(address: str):
         "StreetHouse": street_up,
     }
 
-def get_svh_data(kod_tp: str):
-    url  = urljoin(base_url, kod_tp) + "/"
-    html_data = get_html_data(url)
-    soup = BeautifulSoup(html_data, 'html.parser')
+def tp_url(kod_tp: str) -> str:
+    return urljoin(base_url, str(kod_tp).strip()) + "/"
+
+def parse_svh_page(html_data: str, kod_tp: str):
+    url = tp_url(kod_tp)
     svh_data = {}
 
-    for svh in soup.find_all("div", attrs={"boxSubstrate boxSubstrate-offset-0 p-10 mb10"}):
-        a = svh.find("a")
-        if not a:
-            continue
-
-        svh_url_part = a.get("href")
-        svh_url = urljoin(base_svh_url, svh_url_part)
-
-        name_el = svh.find("div", attrs={"h3"})
-        addr_el = svh.find(
-            "div",
-            attrs={
-                "pTam_fieldColumn pTam_fieldColumn-list "
-                "pTam_fieldColumn-left lightgray"
-            },
-        )
-        lic_el = svh.find(
-            "div",
-            attrs={"pTam_fieldColumn pTam_fieldColumn-list pTam_fieldColumn-right"},
-        )
-
-        name = (name_el.text if name_el else "").strip()
-        address = (addr_el.text if addr_el else "").strip()
-        lic = (lic_el.text if lic_el else "").strip()
+    for box in scraping.alta_svh_boxes(html_data):
+        svh_url = urljoin(base_svh_url, box["href"])
+
+        name = box["name"].strip()
+        address = box["address"].strip()
+        lic = box["license"].strip()
 
         address_norm = " ".join(address.split())
         lic_norm = " ".join(lic.split())
@@ -171,3 +148,20 @@ def get_svh_data(kod_tp: str):
         return svh_data
     
     return svh_data
+
+def get_svh_data(kod_tp: str):
+    return parse_svh_page(get_html_data(tp_url(kod_tp)), kod_tp)
+
+def parse_tp_name(html_data: str) -> str:
+    return scraping.alta_tp_title(html_data)
+
+_TP_HREF_RE = re.compile(r"/tam/(\d{2,8})/?$")
+
+def parse_tp_links(html_data: str):
+    # Ссылки на таможни и посты со страниц справочника alta.ru/tam/: [(код, текст ссылки)]
+    out = []
+    for href, text in scraping.alta_links(html_data):
+        m = _TP_HREF_RE.search(urllib.parse.urlparse(href).path)
+        if m:
+            out.append((m.group(1), " ".join(text.split())))
+    return out
@@ -1,11 +1,23 @@
 # parser_cbrf_fixed.py
-import requests
-from bs4 import BeautifulSoup
 from decimal import Decimal, InvalidOperation
 import re
-import csv
+import os
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+import http_client
+import scraping
+from singleflight import SingleFlight
+from refdata import currency_key, get_refdata
 
 BASE_URL = "https://www.cbr.ru/currency_base/daily/"
+CBR_RATES_LRU = int(os.getenv("CBR_RATES_LRU", "4096"))
+CBR_TABLES_MEM = int(os.getenv("CBR_TABLES_MEM", "400"))      # сколько загруженных таблиц (дат) помнить целиком
+CBR_RATES_DB = os.getenv("CBR_RATES_DB", "1") != "0"
+CBR_PUBLISH_HOUR_MSK = int(os.getenv("CBR_PUBLISH_HOUR_MSK", "17"))   # после этого часа курс на завтра уже опубликован
+_MSK = timezone(timedelta(hours=3))
 
 def _decimal_of_raw(s) -> Decimal:
     if s is None:
@@ -19,93 +31,44 @@ def _decimal_of_raw(s) -> Decimal:
     except (InvalidOperation, ValueError):
         return Decimal("0")
 
-def cb_rate(date_ddmmyyyy: str, currency_code: str) -> Decimal:
+def effective_code(currency_code: str) -> str:
+    # Буквенный код валюты по буквенному/цифровому коду или названию из классификатора валют
     inp = (currency_code or "").strip()
-    alpha = None
     if re.fullmatch(r"[A-Za-z]{3}", inp):
-        alpha = inp.upper()
-    else:
-        try:
-            with open(r"C:\Users\sidor\Desktop\streamlit\alta_classifiers\23 — КЛАССИФИКАТОР ВАЛЮТ.csv", "r", encoding="utf-8-sig", newline="") as f:
-                reader = csv.reader(f)
-                rows = list(reader)
-                i_num, i_alpha, i_name = 0, 1, 2
-                if rows and any("валют" in (c or "").lower() for c in rows[0]):
-                    data = rows[1:]
-                else:
-                    data = rows
-                lat2cyr = {
-                    "A": "А", "B": "В", "C": "С", "E": "Е", "H": "Н", "K": "К",
-                    "M": "М", "O": "О", "P": "Р", "T": "Т", "X": "Х", "Y": "У"
-                }
-
-                def fix_lookalikes(s: str) -> str:
-                    s = s.upper()
-                    return "".join(lat2cyr.get(ch, ch) for ch in s)
-
-                norm_inp = re.sub(r"\s+", " ", inp).strip()
-                norm_inp = fix_lookalikes(norm_inp)
-
-                digits_inp = re.sub(r"\D", "", inp)
-
-                for row in data:
-                    if len(row) <= 2:
-                        continue
-                    num   = (row[i_num]   or "").strip()
-                    alph  = (row[i_alpha] or "").strip().upper()
-                    name  = (row[i_name]  or "").strip()
-
-                    name_fixed = fix_lookalikes(re.sub(r"\s+", " ", name).strip())
-
-                    if not alph:
-                        continue
-                    if norm_inp and norm_inp == name_fixed:
-                        alpha = alph
-                        break
-                    if digits_inp and re.sub(r"\D", "", num) == digits_inp:
-                        alpha = alph
-                        break
-        except FileNotFoundError:
-            return "Файла нет"
-
-    effective_code = alpha if alpha else inp.upper()
+        return inp.upper()
+
+    ref = get_refdata()
+    alpha = ref.currency_alpha_by_name.get(currency_key(inp))
+    if not alpha:
+        digits = re.sub(r"\D", "", inp)
+        if digits:
+            alpha = ref.currency_alpha_by_num.get(digits.zfill(3))
+    return alpha if alpha else inp.upper()
+
+
+def fetch_cb_table(date_ddmmyyyy: str) -> List[List[str]]:
+    # Один запрос к cbr.ru: все строки таблицы курсов
+    # [цифр. код, букв. код, единиц, валюта, курс]
     params = {"UniDbQuery.Posted": "True", "UniDbQuery.To": date_ddmmyyyy}
-    r = requests.get(BASE_URL, params=params, timeout=20)
+    r = http_client.get(BASE_URL, params=params, timeout=20)
     r.raise_for_status()
-    soup = BeautifulSoup(r.text, "html.parser")
-
-    tbl = None
-    for t in soup.find_all("table"):
-        headers = " ".join([th.get_text(strip=True).upper() for th in t.find_all("th")])
-        if "ВАЛЮТА" in headers and "КУРС" in headers:
-            tbl = t
-            break
-    if tbl is None:
+    table = scraping.cbr_rate_rows(r.text)
+    if table is None:
         raise RuntimeError("Не удалось найти таблицу курсов на странице")
 
     rows = []
-    for tr in tbl.find_all("tr"):
-        tds = tr.find_all(["td", "th"])
-        if not tds:
-            continue
-        row = [td.get_text(" ", strip=True) for td in tds]
+    for row in table:
         if len(row) >= 5 and re.fullmatch(r"\d+", row[0].strip()):
             rows.append(row)
+    return rows
 
-    found = None
-    for row in rows:
-        col_upper = [c.strip().upper() for c in row]
-        if effective_code in col_upper:  
-            found = row
-            break
 
-    if not found:
-        return f"В таблице не найдена валюта {effective_code} на дату {date_ddmmyyyy}"
-    idx_rate = len(found) - 1
-    idx_units = 2 if len(found) > 2 else 2
+def _rate_per_unit(row: List[str]) -> Decimal:
+    idx_rate = len(row) - 1
+    idx_units = 2 if len(row) > 2 else 2
 
-    raw_rate = found[idx_rate]
-    raw_units = found[idx_units] if idx_units < len(found) else "1"
+    raw_rate = row[idx_rate]
+    raw_units = row[idx_units] if idx_units < len(row) else "1"
 
     rate = _decimal_of_raw(raw_rate)
     try:
@@ -114,5 +77,231 @@ def cb_rate(date_ddmmyyyy: str, currency_code: str) -> Decimal:
             units = 1
     except Exception:
         units = 1
-    rate_per_unit = rate / Decimal(units)
-    return rate_per_unit
+    return rate / Decimal(units)
+
+
+def _rates_by_alpha(rows: List[List[str]]) -> Dict[str, Decimal]:
+    out: Dict[str, Decimal] = {}
+    for row in rows:
+        alpha = row[1].strip().upper()
+        if re.fullmatch(r"[A-Z]{3}", alpha):
+            out.setdefault(alpha, _rate_per_unit(row))
+    return out
+
+
+def _rate_from_rows(rows: List[List[str]], effective_code: str, date_ddmmyyyy: str):
+    # код ищется в любой колонке строки: буквенный, цифровой или название валюты
+    for row in rows:
+        col_upper = [c.strip().upper() for c in row]
+        if effective_code in col_upper:
+            return _rate_per_unit(row)
+    return f"В таблице не найдена валюта {effective_code} на дату {date_ddmmyyyy}"
+
+
+def fetch_cb_rate(date_ddmmyyyy: str, effective_code: str):
+    # Курс одной валюты прямо с cbr.ru, без кэшей; строка вместо Decimal — валюта не найдена
+    return _rate_from_rows(fetch_cb_table(date_ddmmyyyy), effective_code, date_ddmmyyyy)
+
+
+# ---------- Кэш курсов: LRU в процессе -> таблица cbr_rates -> cbr.ru ----------
+# Промах по дате D загружает всю таблицу ЦБ на D и сохраняет курсы всех валют (за 1 единицу).
+# Курс на прошедшую дату не меняется, поэтому в cbr_rates пишутся только даты не позже сегодняшней (МСК)
+# и завтрашняя после CBR_PUBLISH_HOUR_MSK: раньше ЦБ может ещё не опубликовать курс, и страница
+# вернёт сегодняшний.
+# Валюты, которой нет в таблице загруженной даты, нет и при повторном запросе: ответ "не найдена"
+# берётся из запомненной таблицы (или из cbr_rates), без нового похода на cbr.ru.
+
+_lru: "OrderedDict[Tuple[str, str], Decimal]" = OrderedDict()
+_tables: "OrderedDict[str, List[List[str]]]" = OrderedDict()   # дата -> строки таблицы (постоянные даты)
+_lru_lock = threading.Lock()
+_table_flight = SingleFlight("cbr_table")
+_stats = {"lru": 0, "db": 0, "network": 0, "absent": 0}
+
+
+def _parse_date(date_ddmmyyyy) -> Optional[date]:
+    try:
+        return datetime.strptime(str(date_ddmmyyyy).strip(), "%d.%m.%Y").date()
+    except ValueError:
+        return None
+
+
+def _persistable(d: Optional[date]) -> bool:
+    if d is None:
+        return False
+    now = datetime.now(_MSK)
+    today = now.date()
+    return d <= today or (d == today + timedelta(days=1) and now.hour >= CBR_PUBLISH_HOUR_MSK)
+
+
+def _lru_get(key) -> Optional[Decimal]:
+    with _lru_lock:
+        v = _lru.get(key)
+        if v is not None:
+            _lru.move_to_end(key)
+        return v
+
+
+def _lru_put_many(date_key: str, rates: Dict[str, Decimal]) -> None:
+    with _lru_lock:
+        for code, value in rates.items():
+            _lru[(date_key, code)] = value
+            _lru.move_to_end((date_key, code))
+        while len(_lru) > CBR_RATES_LRU:
+            _lru.popitem(last=False)
+
+
+def _table_get(date_key: str) -> Optional[List[List[str]]]:
+    with _lru_lock:
+        rows = _tables.get(date_key)
+        if rows is not None:
+            _tables.move_to_end(date_key)
+        return rows
+
+
+def _table_put(date_key: str, rows: List[List[str]]) -> None:
+    with _lru_lock:
+        _tables[date_key] = rows
+        _tables.move_to_end(date_key)
+        while len(_tables) > CBR_TABLES_MEM:
+            _tables.popitem(last=False)
+
+
+def _db_has_date(d: date) -> bool:
+    if not CBR_RATES_DB:
+        return False
+    try:
+        from db import cbr_rates_dates
+        return bool(cbr_rates_dates(d, d))
+    except Exception as e:
+        print(f"[cbr] cbr_rates недоступна: {e!r}")
+        return False
+
+
+def _db_get(d: date, code: str) -> Optional[Decimal]:
+    if not CBR_RATES_DB:
+        return None
+    try:
+        from db import cbr_rate_get
+        return cbr_rate_get(d, code)
+    except Exception as e:
+        print(f"[cbr] cbr_rates недоступна: {e!r}")
+        return None
+
+
+def _db_put(d: date, rates: Dict[str, Decimal]) -> None:
+    if not CBR_RATES_DB:
+        return
+    try:
+        from db import cbr_rates_put
+        cbr_rates_put(d, rates)
+    except Exception as e:
+        print(f"[cbr] Не удалось сохранить курсы за {d}: {e!r}")
+
+
+def _load_table(date_ddmmyyyy: str, date_key: str, d: Optional[date], persistent: bool) -> List[List[str]]:
+    # одновременные промахи по одной дате (любые валюты) ждут одного похода на cbr.ru
+    return _table_flight.do(date_key, _fetch_table, date_ddmmyyyy, date_key, d, persistent)
+
+
+def _fetch_table(date_ddmmyyyy: str, date_key: str, d: Optional[date], persistent: bool) -> List[List[str]]:
+    _stats["network"] += 1
+    rows = fetch_cb_table(date_ddmmyyyy)
+    if persistent:
+        rates = _rates_by_alpha(rows)
+        _db_put(d, rates)
+        _lru_put_many(date_key, rates)
+        _table_put(date_key, rows)
+    return rows
+
+
+def cb_rate(date_ddmmyyyy: str, currency_code: str) -> Decimal:
+    code = effective_code(currency_code)
+    d = _parse_date(date_ddmmyyyy)
+    persistent = _persistable(d)
+    date_key = d.isoformat() if d else str(date_ddmmyyyy).strip()
+
+    v = _lru_get((date_key, code))
+    if v is not None:
+        _stats["lru"] += 1
+        return v
+
+    rows = _table_get(date_key) if persistent else None
+    if rows is not None:
+        # таблица этой даты уже загружена: курс (если вытеснен из LRU) или "не найдена" — из неё
+        v = _rate_from_rows(rows, code, date_ddmmyyyy)
+        _stats["lru" if isinstance(v, Decimal) else "absent"] += 1
+        return v
+
+    if persistent:
+        v = _db_get(d, code)
+        if v is not None:
+            _stats["db"] += 1
+            _lru_put_many(date_key, {code: v})
+            return v
+        # в cbr_rates хранятся курсы всех валют таблицы: если дата там есть, этой валюты у ЦБ нет
+        if re.fullmatch(r"[A-Z]{3}", code) and _db_has_date(d):
+            _stats["absent"] += 1
+            return f"В таблице не найдена валюта {code} на дату {date_ddmmyyyy}"
+
+    rows = _load_table(date_ddmmyyyy, date_key, d, persistent)
+    return _rate_from_rows(rows, code, date_ddmmyyyy)
+
+
+def prefetch(days_ahead: int = 1) -> Dict[str, int]:
+    # Загрузить таблицы на сегодня и следующие дни, чтобы расчёт графов не ждал cbr.ru.
+    # Даты, курс на которые ещё может измениться, пропускаются — их догрузит следующий запуск.
+    today = datetime.now(_MSK).date()
+    out: Dict[str, int] = {}
+    for i in range(days_ahead + 1):
+        d = today + timedelta(days=i)
+        if not _persistable(d):
+            continue
+        date_key = d.isoformat()
+        if _lru_get((date_key, "USD")) is not None or _db_get(d, "USD") is not None:
+            continue
+        rows = _load_table(d.strftime("%d.%m.%Y"), date_key, d, True)
+        out[date_key] = len(rows)
+    return out
+
+
+def backfill(date_from: date, date_to: date) -> Dict[str, object]:
+    # Загрузить в cbr_rates таблицы ЦБ за период: по одному запросу на каждую ещё не загруженную дату.
+    # Даты, курс на которые ещё может измениться, пропускаются.
+    if not CBR_RATES_DB:
+        raise RuntimeError("CBR_RATES_DB=0: таблица cbr_rates отключена")
+    from db import cbr_rates_dates
+
+    if date_to < date_from:
+        date_from, date_to = date_to, date_from
+    have = set(cbr_rates_dates(date_from, date_to))
+    loaded, skipped = 0, 0
+    errors: Dict[str, str] = {}
+    d = date_from
+    while d <= date_to:
+        if d in have or not _persistable(d):
+            skipped += 1
+        else:
+            try:
+                _load_table(d.strftime("%d.%m.%Y"), d.isoformat(), d, True)
+                loaded += 1
+            except Exception as e:
+                errors[d.isoformat()] = repr(e)
+        d += timedelta(days=1)
+    return {"from": date_from.isoformat(), "to": date_to.isoformat(),
+            "loaded": loaded, "skipped": skipped, "errors": errors}
+
+
+def cache_stats() -> Dict[str, int]:
+    with _lru_lock:
+        size, tables = len(_lru), len(_tables)
+    return {**_stats, "coalesced": _table_flight.stats()["shared"], "lru_size": size, "tables_size": tables}
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) != 4 or sys.argv[1] != "backfill":
+        print("usage: python parser_cbrf.py backfill YYYY-MM-DD YYYY-MM-DD")
+        sys.exit(2)
+    res = backfill(date.fromisoformat(sys.argv[2]), date.fromisoformat(sys.argv[3]))
+    print(f"[cbr] {res}")
+    sys.exit(1 if res["errors"] else 0)
@@ -0,0 +1,282 @@
+# refdata.py
+# Справочники classifier/*.csv: загружаются один раз в неизменяемые словари, перезагрузка — целиком.
+# Быстрый старт — из снимка classifier/refdata.snapshot.json (без pandas); CSV разбираются,
+# только если снимка нет или он не соответствует текущим CSV.
+#   python refdata.py build   — собрать снимок
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+CLASSIF_DIR = Path(__file__).resolve().parent / "classifier"
+SNAPSHOT_NAME = "refdata.snapshot.json"
+SNAPSHOT_FORMAT = 2
+
+COUNTRIES_CSV   = CLASSIF_DIR / "countries_classificator.csv"
+UNITS_CSV       = CLASSIF_DIR / "15 — КЛАССИФИКАТОР ЕДИНИЦ ИЗМЕРЕНИЯ.csv"
+INCOTERMS_CSV   = CLASSIF_DIR / "13 — КЛАССИФИКАТОР УСЛОВИЙ ПОСТАВКИ.csv"
+CURRENCIES_CSV  = CLASSIF_DIR / "23 — КЛАССИФИКАТОР ВАЛЮТ.csv"
+
+# латинские буквы, похожие на кириллические: "EBPO" из OCR -> "ЕВРО"
+_LAT2CYR = str.maketrans("ABCEHKMOPTXY", "АВСЕНКМОРТХУ")
+
+
+def _frozen(d: Dict[str, str]) -> Mapping[str, str]:
+    return MappingProxyType(dict(d))
+
+
+def csv_version(classif_dir: Path = CLASSIF_DIR) -> str:
+    # Хэш содержимого справочников: меняется при обновлении любого CSV в classifier/
+    h = hashlib.sha256()
+    for path in sorted(Path(classif_dir).glob("*.csv")):
+        h.update(path.name.encode("utf-8"))
+        h.update(path.read_bytes())
+    return h.hexdigest()[:16]
+
+
+def currency_key(name) -> str:
+    # Ключ названия валюты: верхний регистр, одинарные пробелы, латиница-двойники -> кириллица
+    return " ".join(str(name or "").upper().replace("Ё", "Е").split()).translate(_LAT2CYR)
+
+
+def load_units(units_csv_path) -> Tuple[Mapping[str, str], Mapping[str, str]]:
+    # (код -> условное обозначение, вариант написания -> код)
+    import pandas as pd
+
+    units_df = pd.read_csv(units_csv_path, dtype=str).fillna("")
+    code_to_short: Dict[str, str] = {}
+    variant_to_code: Dict[str, str] = {}
+
+    for _, row in units_df.iterrows():
+        code = str(row.get("Код", "")).strip()
+        name = str(row.get("Наименование", "")).strip()
+        short = str(row.get("Условное обозначение", "")).strip()
+
+        if code:
+            code_to_short[code] = short or name
+
+        for col in ("Наименование", "Условное обозначение", "Наименование_EN", "Сокращение_EN", "Дополнительно"):
+            val = row.get(col, "")
+            if not val:
+                continue
+            for v in str(val).split(","):
+                v_norm = str(v).strip().upper().replace("\u00A0", " ")
+                if v_norm:
+                    variant_to_code[v_norm] = code
+    return _frozen(code_to_short), _frozen(variant_to_code)
+
+
+class ReferenceData:
+    """Снимок справочников; после создания не меняется — перезагрузка подменяет объект целиком."""
+
+    def __init__(self, version: str, tables: Dict[str, Any], source: str = ""):
+        self.version = version
+        self.source = source  # snapshot | csv
+        self.country_short_by_any: Mapping[str, str] = _frozen(tables["country_short_by_any"])
+        self.country_alpha2_by_any: Mapping[str, str] = _frozen(tables["country_alpha2_by_any"])
+        self.country_name_by_code: Mapping[str, str] = _frozen(tables["country_name_by_code"])
+        self.country_values = frozenset(tables["country_values"])
+        self.unit_short_by_code: Mapping[str, str] = _frozen(tables["unit_short_by_code"])
+        self.unit_code_by_variant: Mapping[str, str] = _frozen(tables["unit_code_by_variant"])
+        self.incoterms_codes: Tuple[str, ...] = tuple(tables["incoterms_codes"])
+        self.currency_alpha_by_num: Mapping[str, str] = _frozen(tables["currency_alpha_by_num"])
+        self.currency_alpha_by_name: Mapping[str, str] = _frozen(tables["currency_alpha_by_name"])
+        self.currency_name_by_alpha: Mapping[str, str] = _frozen(tables["currency_name_by_alpha"])
+
+    def tables(self) -> Dict[str, Any]:
+        return {
+            "country_short_by_any": dict(self.country_short_by_any),
+            "country_alpha2_by_any": dict(self.country_alpha2_by_any),
+            "country_name_by_code": dict(self.country_name_by_code),
+            "country_values": sorted(self.country_values),
+            "unit_short_by_code": dict(self.unit_short_by_code),
+            "unit_code_by_variant": dict(self.unit_code_by_variant),
+            "incoterms_codes": list(self.incoterms_codes),
+            "currency_alpha_by_num": dict(self.currency_alpha_by_num),
+            "currency_alpha_by_name": dict(self.currency_alpha_by_name),
+            "currency_name_by_alpha": dict(self.currency_name_by_alpha),
+        }
+
+    def summary(self) -> Dict[str, object]:
+        return {
+            "version": self.version,
+            "source": self.source,
+            "countries": len(self.country_name_by_code),
+            "country_spellings": len(self.country_short_by_any),
+            "units": len(self.unit_short_by_code),
+            "unit_variants": len(self.unit_code_by_variant),
+            "incoterms": len(self.incoterms_codes),
+            "currencies": len(self.currency_name_by_alpha),
+        }
+
+
+def _country_tables(csv_path: Path) -> Dict[str, Any]:
+    import pandas as pd
+
+    countries = pd.read_csv(csv_path)
+
+    # любое написание (код, краткое/полное/ISO-название) -> краткое название
+    short_by_any: Dict[str, str] = {}
+    for _, row in countries.iterrows():
+        short = str(row["ShortName"]).strip()
+        for col in ["Numeric", "ShortName", "FullName",
+                    "Alpha2", "Alpha3", "ISO_Name", "ISO_ShortName"]:
+            val = row.get(col)
+            if pd.notna(val):
+                key = str(val).strip().upper()
+                if key:
+                    short_by_any[key] = short
+
+    # название или код -> Alpha2
+    alpha2_by_any: Dict[str, str] = {}
+    for _, row in countries.iterrows():
+        alpha2 = str(row["Alpha2"]).strip()
+        for col in ["ShortName", "Alpha2", "Alpha3", "ISO_Name", "ISO_ShortName"]:
+            val = row[col]
+            if pd.notna(val):
+                alpha2_by_any[str(val).strip().upper()] = alpha2
+
+    # Alpha2/Alpha3 -> краткое название (первая подходящая строка)
+    name_by_code: Dict[str, str] = {}
+    for _, row in countries.iterrows():
+        short = str(row.get("ShortName", "")).strip()
+        for col in ("Alpha2", "Alpha3"):
+            name_by_code.setdefault(str(row.get(col, "")).strip().upper(), short)
+
+    values = set()
+    for col in countries.columns:
+        values.update(countries[col].astype(str).str.upper().str.strip().tolist())
+
+    return {
+        "country_short_by_any": short_by_any,
+        "country_alpha2_by_any": alpha2_by_any,
+        "country_name_by_code": name_by_code,
+        # в новых pandas astype(str) оставляет NaN как float — строкам он всё равно не равен
+        "country_values": [c for c in values if isinstance(c, str) and c and c not in {"NONE", "NULL", "-", "—"}],
+    }
+
+
+def _currency_tables(csv_path: Path) -> Dict[str, Any]:
+    import pandas as pd
+
+    cur = pd.read_csv(csv_path, dtype=str).fillna("")
+    by_num: Dict[str, str] = {}
+    by_name: Dict[str, str] = {}
+    name_by_alpha: Dict[str, str] = {}
+    # колонки по порядку: цифровой код, буквенный код, наименование
+    for num, alpha, name in cur.iloc[:, :3].itertuples(index=False):
+        alpha = str(alpha).strip().upper()
+        if not alpha:
+            continue
+        num = str(num).strip()
+        if num.isdigit():
+            by_num.setdefault(num.zfill(3), alpha)
+        if str(name).strip():
+            by_name.setdefault(currency_key(name), alpha)
+            name_by_alpha.setdefault(alpha, str(name).strip())
+    return {
+        "currency_alpha_by_num": by_num,
+        "currency_alpha_by_name": by_name,
+        "currency_name_by_alpha": name_by_alpha,
+    }
+
+
+def parse_csv(classif_dir: Path = CLASSIF_DIR) -> ReferenceData:
+    import pandas as pd
+
+    classif_dir = Path(classif_dir)
+    version = csv_version(classif_dir)
+    tables = _country_tables(classif_dir / COUNTRIES_CSV.name)
+    tables["unit_short_by_code"], tables["unit_code_by_variant"] = load_units(classif_dir / UNITS_CSV.name)
+    inc = pd.read_csv(classif_dir / INCOTERMS_CSV.name, dtype=str)
+    tables["incoterms_codes"] = [str(x).strip().upper() for x in inc["Код условия поставки"].dropna().tolist()]
+    tables.update(_currency_tables(classif_dir / CURRENCIES_CSV.name))
+    return ReferenceData(version, tables, source="csv")
+
+
+def read_snapshot(path: Path) -> Optional[ReferenceData]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+        if raw.get("format") != SNAPSHOT_FORMAT:
+            return None
+        return ReferenceData(raw["version"], raw["tables"], source="snapshot")
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"[refdata] Снимок {path} не читается: {e!r}")
+        return None
+
+
+def write_snapshot(ref: ReferenceData, path: Path) -> None:
+    # Через временный файл: параллельно стартующие воркеры не увидят недописанный снимок
+    path = Path(path)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"format": SNAPSHOT_FORMAT, "version": ref.version, "tables": ref.tables()},
+                      f, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+def load(classif_dir: Path = CLASSIF_DIR, write: bool = True) -> ReferenceData:
+    classif_dir = Path(classif_dir)
+    snap_path = classif_dir / SNAPSHOT_NAME
+    version = csv_version(classif_dir)
+    ref = read_snapshot(snap_path)
+    if ref is not None and ref.version == version:
+        return ref
+
+    ref = parse_csv(classif_dir)
+    if write:
+        try:
+            write_snapshot(ref, snap_path)
+        except Exception as e:
+            print(f"[refdata] Не удалось записать снимок {snap_path}: {e!r}")
+    return ref
+
+
+_current: Optional[ReferenceData] = None
+_lock = threading.Lock()
+
+
+def get_refdata() -> ReferenceData:
+    ref = _current
+    if ref is None:
+        with _lock:
+            if _current is None:
+                _set(load())
+            ref = _current
+    return ref
+
+
+def reload_refdata() -> ReferenceData:
+    # Новый снимок строится целиком и только потом подменяет старый: читатели видят либо старый, либо новый
+    ref = load()
+    with _lock:
+        _set(ref)
+    print(f"[refdata] Справочники загружены: {ref.summary()}")
+    return ref
+
+
+def _set(ref: ReferenceData) -> None:
+    global _current
+    _current = ref
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] != ["build"]:
+        print("usage: python refdata.py build")
+        sys.exit(2)
+    t0 = time.perf_counter()
+    ref = parse_csv()
+    write_snapshot(ref, CLASSIF_DIR / SNAPSHOT_NAME)
+    print(f"[refdata] {CLASSIF_DIR / SNAPSHOT_NAME}: {ref.summary()} за {(time.perf_counter() - t0) * 1000:.0f} ms")
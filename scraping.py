@@ -0,0 +1,112 @@
+# scraping.py
+# Разбор HTML внешних сайтов (cbr.ru, alta.ru) на lxml. Все селекторы — в SELECTORS и компилируются
+# один раз при импорте: если сайт поменял вёрстку, править нужно только здесь.
+# Сравнение с прежним разбором на BeautifulSoup: python -m bench.bench_scraping
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from lxml import etree
+
+
+def _cls(value: str) -> str:
+    # точное совпадение атрибута class (как attrs={"..."} в BeautifulSoup), пробелы нормализуются
+    return f'normalize-space(@class)="{value}"'
+
+
+SELECTORS: Dict[str, str] = {
+    # cbr.ru/currency_base/daily/
+    "cbr.tables": "//table",
+    "cbr.header_cells": ".//th",
+    "cbr.rows": ".//tr",
+    "cbr.cells": ".//td | .//th",
+    # alta.ru/tam/<код>/ — карточки СВХ поста
+    "alta.svh_boxes": f'//div[{_cls("boxSubstrate boxSubstrate-offset-0 p-10 mb10")}]',
+    "alta.svh_link": "(.//a)[1]",
+    "alta.svh_name": f'(.//div[{_cls("h3")}])[1]',
+    "alta.svh_address": f'(.//div[{_cls("pTam_fieldColumn pTam_fieldColumn-list pTam_fieldColumn-left lightgray")}])[1]',
+    "alta.svh_license": f'(.//div[{_cls("pTam_fieldColumn pTam_fieldColumn-list pTam_fieldColumn-right")}])[1]',
+    # alta.ru/tam/<код>/ — название поста и ссылки справочника
+    "alta.tp_title": f'(//div[{_cls("pTam_right boxSubstrate boxSubstrate-offset-0 mb10")}]//h1)[1]',
+    "alta.any_h1": "(//h1)[1]",
+    "alta.links": "//a[@href]",
+}
+
+_XPATH = {name: etree.XPath(expr) for name, expr in SELECTORS.items()}
+
+# парсер lxml нельзя использовать из нескольких потоков одновременно — свой на поток
+_local = threading.local()
+
+
+def _parser() -> etree.HTMLParser:
+    p = getattr(_local, "parser", None)
+    if p is None:
+        p = _local.parser = etree.HTMLParser(encoding="utf-8")
+    return p
+
+
+def parse_html(html_data) -> etree._Element:
+    # str кодируем в байты: lxml не принимает str с объявлением кодировки (<?xml ... encoding=...?>)
+    data = html_data.encode("utf-8") if isinstance(html_data, str) else (html_data or b"")
+    root = etree.fromstring(data or b"<html/>", _parser())
+    return root if root is not None else etree.fromstring(b"<html/>", _parser())
+
+
+def select(name: str, node) -> list:
+    return _XPATH[name](node)
+
+
+def select_one(name: str, node):
+    found = _XPATH[name](node)
+    return found[0] if found else None
+
+
+def text_of(node, sep: str = "", strip: bool = True) -> str:
+    # аналог get_text(sep, strip=...) из BeautifulSoup
+    if node is None:
+        return ""
+    if not strip:
+        return sep.join(node.itertext())
+    return sep.join(t.strip() for t in node.itertext() if t.strip())
+
+
+# ---------- cbr.ru ----------
+
+def cbr_rate_rows(html_data) -> Optional[List[List[str]]]:
+    # Все строки таблицы курсов (текст ячеек); None — таблицы с заголовками "Валюта" и "Курс" нет
+    root = parse_html(html_data)
+    for t in select("cbr.tables", root):
+        headers = " ".join(text_of(th).upper() for th in select("cbr.header_cells", t))
+        if "ВАЛЮТА" in headers and "КУРС" in headers:
+            return [[text_of(c, " ") for c in select("cbr.cells", tr)] for tr in select("cbr.rows", t)]
+    return None
+
+
+# ---------- alta.ru ----------
+
+def alta_svh_boxes(html_data) -> List[Dict[str, str]]:
+    # Карточки СВХ как есть: ссылка, название, адрес, лицензия (без нормализации)
+    out = []
+    for box in select("alta.svh_boxes", parse_html(html_data)):
+        a = select_one("alta.svh_link", box)
+        if a is None:
+            continue
+        out.append({
+            "href": a.get("href"),
+            "name": text_of(select_one("alta.svh_name", box), strip=False),
+            "address": text_of(select_one("alta.svh_address", box), strip=False),
+            "license": text_of(select_one("alta.svh_license", box), strip=False),
+        })
+    return out
+
+
+def alta_tp_title(html_data) -> str:
+    root = parse_html(html_data)
+    h1 = select_one("alta.tp_title", root)
+    if h1 is None:
+        h1 = select_one("alta.any_h1", root)
+    return text_of(h1)
+
+
+def alta_links(html_data) -> List[Tuple[str, str]]:
+    # [(href, текст ссылки)]
+    return [(a.get("href"), text_of(a, " ")) for a in select("alta.links", parse_html(html_data))]
@@ -0,0 +1,72 @@
+# singleflight.py
+# Одновременные вызовы с одинаковым ключом выполняют функцию один раз: первый поток ("владелец")
+# делает запрос, остальные ждут его результат или исключение. Ничего не кэширует — следующий вызов
+# после завершения снова идёт к источнику (кэш — забота вызывающего).
+#   _flight = SingleFlight("cbr_table")
+#   rows = _flight.do(date_key, fetch_cb_table, date_ddmmyyyy)
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+_groups: List["SingleFlight"] = []
+_groups_lock = threading.Lock()
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Tuple[Future, int]] = {}   # ключ -> (результат, поток-владелец)
+        self._stats = {"calls": 0, "shared": 0}
+        with _groups_lock:
+            _groups.append(self)
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """
+        fn(*args, **kwargs) — один на ключ среди одновременных вызовов. timeout ограничивает только
+        ожидание чужого вызова (concurrent.futures.TimeoutError), сам вызов владельца не прерывается.
+        """
+        me = threading.get_ident()
+        with self._lock:
+            self._stats["calls"] += 1
+            call = self._calls.get(key)
+            if call is None:
+                fut: Future = Future()
+                self._calls[key] = (fut, me)
+            elif call[1] == me:
+                # повторный вход с тем же ключом из владельца — ждать самого себя нельзя
+                call = None
+                fut = None
+            else:
+                self._stats["shared"] += 1
+        if call is not None:
+            return call[0].result(timeout)
+        if fut is None:
+            return fn(*args, **kwargs)
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def in_flight(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._calls
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, "in_flight": len(self._calls)}
+
+
+def stats() -> Dict[str, Dict[str, int]]:
+    # по всем группам процесса, для /admin/metrics
+    with _groups_lock:
+        groups = list(_groups)
+    return {g.name: g.stats() for g in groups}
@@ -0,0 +1,163 @@
+# svh_cache.py
+# СВХ по коду таможенного поста (alta.ru) с кэшем: память процесса -> таблица svh_cache -> alta.ru.
+# Свежая запись (моложе SVH_TTL) отдаётся сразу; устаревшая (моложе SVH_MAX_STALE) тоже отдаётся сразу,
+# а обновляется в фоне — расчёт графов не ждёт alta.ru, если пост уже хоть раз загружался.
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from singleflight import SingleFlight
+
+SVH_TTL = float(os.getenv("SVH_TTL", str(7 * 24 * 3600)))
+SVH_EMPTY_TTL = float(os.getenv("SVH_EMPTY_TTL", "3600"))           # "СВХ не найдены" — возможно, сбой сайта
+SVH_MAX_STALE = float(os.getenv("SVH_MAX_STALE", str(90 * 24 * 3600)))
+SVH_RETRY_AFTER = float(os.getenv("SVH_RETRY_AFTER", "300"))         # пауза после неудачного обновления
+SVH_MEM_MAX = int(os.getenv("SVH_MEM_MAX", "2048"))
+SVH_CACHE_DB = os.getenv("SVH_CACHE_DB", "1") != "0"
+
+_mem: Dict[str, Tuple[Any, float]] = {}          # код поста -> (данные, время загрузки, unix)
+_lock = threading.Lock()
+_flight = SingleFlight("svh")
+_retry_at: Dict[str, float] = {}
+_refresh_pool = ThreadPoolExecutor(max_workers=int(os.getenv("SVH_REFRESH_WORKERS", "2")),
+                                   thread_name_prefix="svh-refresh")
+_stats = {"fresh": 0, "stale": 0, "miss": 0, "refreshed": 0, "refresh_errors": 0}
+
+
+def _is_empty(data) -> bool:
+    # get_svh_data на пост без СВХ отдаёт заглушку {"Наименование СВХ": "Не найдено СВХ..."}
+    return not data or "Наименование СВХ" in data
+
+
+def _ttl(data) -> float:
+    return SVH_EMPTY_TTL if _is_empty(data) else SVH_TTL
+
+
+def _mem_put(tp: str, data, fetched_at: float) -> None:
+    with _lock:
+        _mem.pop(tp, None)
+        _mem[tp] = (data, fetched_at)
+        while len(_mem) > SVH_MEM_MAX:
+            _mem.pop(next(iter(_mem)))
+
+
+def _db_get(tp: str) -> Optional[Tuple[Any, float]]:
+    if not SVH_CACHE_DB:
+        return None
+    try:
+        from db import svh_cache_get
+        row = svh_cache_get(tp)
+    except Exception as e:
+        print(f"[svh] svh_cache недоступна: {e!r}")
+        return None
+    if not row:
+        return None
+    return row["data_json"], row["fetched_at"].timestamp()
+
+
+def _db_put(tp: str, data) -> None:
+    if not SVH_CACHE_DB:
+        return
+    try:
+        from db import svh_cache_put
+        svh_cache_put(tp, data)
+    except Exception as e:
+        print(f"[svh] Не удалось сохранить СВХ поста {tp}: {e!r}")
+
+
+def _fetch(tp: str):
+    # одновременные загрузки одного поста (расчёт графов + фоновое обновление) — один поход на alta.ru
+    return _flight.do(tp, _load, tp)
+
+
+def _load(tp: str):
+    import parcer_alta_tam
+    try:
+        data = parcer_alta_tam.get_svh_data(tp)
+    except BaseException:
+        with _lock:
+            _retry_at[tp] = time.time() + SVH_RETRY_AFTER
+        raise
+    _mem_put(tp, data, time.time())
+    _db_put(tp, data)
+    with _lock:
+        _retry_at.pop(tp, None)
+    return data
+
+
+def _refresh(tp: str) -> None:
+    try:
+        _fetch(tp)
+        _stats["refreshed"] += 1
+    except Exception as e:
+        _stats["refresh_errors"] += 1
+        print(f"[svh] Фоновое обновление поста {tp} не удалось: {e!r}")
+
+
+def _schedule_refresh(tp: str) -> None:
+    if _flight.in_flight(tp):
+        return
+    with _lock:
+        if _retry_at.get(tp, 0) > time.time():
+            return
+    _refresh_pool.submit(_refresh, tp)
+
+
+def _lookup(tp: str) -> Optional[Tuple[Any, float]]:
+    with _lock:
+        hit = _mem.get(tp)
+    if hit is None:
+        hit = _db_get(tp)
+        if hit is not None:
+            _mem_put(tp, *hit)
+    return hit
+
+
+def get_svh(tp_code) -> Dict[str, Any]:
+    tp = str(tp_code or "").strip()
+    if not tp:
+        return {}
+
+    hit = _lookup(tp)
+    if hit is not None:
+        data, fetched_at = hit
+        age = time.time() - fetched_at
+        if age < _ttl(data):
+            _stats["fresh"] += 1
+            return data
+        if age < SVH_MAX_STALE:
+            _stats["stale"] += 1
+            _schedule_refresh(tp)
+            return data
+
+    _stats["miss"] += 1
+    try:
+        return _fetch(tp)
+    except Exception:
+        if hit is not None:
+            # совсем старая запись лучше, чем ошибка в g30
+            print(f"[svh] alta.ru недоступен, пост {tp}: отдаём запись старше SVH_MAX_STALE")
+            return hit[0]
+        raise
+
+
+def fetched_at(tp_code) -> Optional[float]:
+    # Время загрузки записи поста (unix) без похода на alta.ru; None — пост ещё не загружался.
+    # Кэш графов сравнивает его со временем, по которому считался g30; устаревшая запись заодно
+    # ставится на фоновое обновление, иначе графы из кэша её бы так и не обновили.
+    tp = str(tp_code or "").strip()
+    hit = _lookup(tp) if tp else None
+    if hit is None:
+        return None
+    data, loaded = hit
+    if time.time() - loaded >= _ttl(data):
+        _schedule_refresh(tp)
+    return loaded
+
+
+def cache_stats() -> Dict[str, int]:
+    with _lock:
+        return {**_stats, "mem_size": len(_mem)}
+
@@ -0,0 +1,84 @@
+# tests/test_customs_directory.py
+# Разбор страниц alta.ru и обход справочника постов по сохранённым страницам (bench/fixtures/alta), без сети и БД.
+#   python -m pytest tests
+from pathlib import Path
+
+import pytest
+
+import customs_directory
+import parcer_alta_tam
+
+FIXTURES = Path(__file__).resolve().parent.parent / "bench" / "fixtures" / "alta"
+
+
+@pytest.fixture(scope="module")
+def fetch():
+    return customs_directory.fixture_fetcher(FIXTURES)
+
+
+@pytest.fixture(scope="module")
+def crawled(fetch):
+    return customs_directory.crawl(fetch, save=False, delay=0.0)
+
+
+def test_parse_tp_links_index(fetch):
+    assert parcer_alta_tam.parse_tp_links(fetch(parcer_alta_tam.base_url)) == [
+        ("10700", "Дальневосточное таможенное управление"),
+        ("10100", "Центральное таможенное управление"),
+    ]
+
+
+def test_parse_tp_name(fetch):
+    html = fetch(parcer_alta_tam.tp_url("10702010"))
+    assert parcer_alta_tam.parse_tp_name(html) == "Т/П Морской порт Владивосток"
+
+
+def test_parse_svh_page(fetch):
+    svh = parcer_alta_tam.parse_svh_page(fetch(parcer_alta_tam.tp_url("10702010")), "10702010")
+    assert list(svh) == ['ООО "ПАСИФИК ЛОДЖИСТИК"', 'АО "ВМТП"']
+    first = svh['ООО "ПАСИФИК ЛОДЖИСТИК"']
+    assert first["Ссылка на сайт"] == "https://www.alta.ru/svh/1/"
+    assert first["Номер лицензии"] == "10702/110215/10025/1"
+    assert first["Дата лицензии"] == "2015-02-11"
+    assert (first["CountryCode"], first["Region"], first["City"]) == ("RU", "ПРИМОРСКИЙ КРАЙ", "Г. ВЛАДИВОСТОК")
+    assert first["StreetHouse"] == "УЛ. ВЕРХНЕПОРТОВАЯ, Д. 38"
+
+
+def test_parse_svh_page_without_svh(fetch):
+    svh = parcer_alta_tam.parse_svh_page(fetch(parcer_alta_tam.tp_url("10129000")), "10129000")
+    assert list(svh) == ["Наименование СВХ"]
+    assert customs_directory._no_svh(svh)
+
+
+def test_discover(fetch):
+    entries = customs_directory.discover(fetch)
+    by_code = {e["code"]: e for e in entries}
+    assert len(entries) == 9
+    assert sorted(c for c in by_code if len(c) == 8) == ["10129000", "10702010", "10702030", "10702070", "10714040"]
+    assert by_code["10700"]["parent_code"] is None
+    assert by_code["10702"]["parent_code"] == "10700"
+    assert by_code["10702070"] == {"code": "10702070", "name": "Т/П Уссурийский", "parent_code": "10702"}
+
+
+def test_crawl_dry_run(crawled):
+    assert crawled["discovered"] == 9
+    assert crawled["crawled"] == 5
+    assert crawled["errors"] == {}
+    posts = crawled["posts"]
+    assert sorted(posts) == ["10129000", "10702010", "10702030", "10702070", "10714040"]
+    assert posts["10702030"]["name"] == "Владивостокский таможенный пост (центр электронного декларирования)"
+    assert list(posts["10702030"]["svh"]) == ['ООО "СВХ ТЕСТ"']
+    assert list(posts["10702070"]["svh"]) == ['ООО "УССУРИЙСК ТЕРМИНАЛ"']
+    assert customs_directory._no_svh(posts["10714040"]["svh"])
+
+
+def test_crawl_limit(fetch):
+    res = customs_directory.crawl(fetch, save=False, limit=2, delay=0.0)
+    assert sorted(res["posts"]) == ["10129000", "10702010"]
+
+
+def test_search_over_crawled_posts(crawled):
+    index = customs_directory.PostIndex(list(crawled["posts"].values()))
+    assert [r["code"] for r in index.search("10702")] == ["10702010", "10702030", "10702070"]
+    assert [r["code"] for r in index.search("влад морс")] == ["10702010"]
+    assert [r["code"] for r in index.search("усурийский")] == ["10702070"]   # опечатка
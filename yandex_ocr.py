@@ -7,6 +7,9 @@ from hashlib import sha256
 from threading import Lock
 from PIL import Image
 
+import http_client
+from singleflight import SingleFlight
+
 YC_API_KEY   = os.getenv("YC_API_KEY")         
 YC_FOLDER_ID = os.getenv("YC_FOLDER_ID")     
 VISION_URL   = os.getenv(
@@ -19,6 +22,7 @@ OCR_MIN_INTERVAL_SEC = 1.1
 OCR_MAX_RETRIES      = 2
 OCR_BACKOFF_BASE     = 1.8
 OCR_BACKOFF_MAX      = 30
+OCR_READ_TIMEOUT     = float(os.getenv("OCR_READ_TIMEOUT", "120"))   # многостраничный PDF распознаётся долго
 
 
 MAX_PDF_BYTES        = 10 * 1024 * 1024   
@@ -31,6 +35,7 @@ JPEG_QUALITY         = 80
 _last_ocr_ts = 0.0
 _last_ocr_lock = Lock()
 _OCR_CACHE: Dict[str, Dict[str, Any]] = {}
+_ocr_flight = SingleFlight("ocr")
 
 class YCOCRError(Exception):
     pass
@@ -117,7 +122,9 @@ def _post_with_retry(url: str, headers: dict, payload: dict) -> requests.Respons
             _last_ocr_ts = time.time()
 
         try:
-            r = requests.post(url, headers=headers, json=payload)
+            # повторы и пауза между запросами — здесь, общий клиент только держит соединение
+            r = http_client.post(url, headers=headers, json=payload,
+                                 timeout=(http_client.HTTP_CONNECT_TIMEOUT, OCR_READ_TIMEOUT), retries=0)
         except (requests.ConnectionError,
                 requests.Timeout,
                 requests.exceptions.ChunkedEncodingError) as e:
@@ -256,6 +263,12 @@ def extract_text_smart(file_bytes: bytes, mime: str) -> str:
             raise
 
 def extract_text_with_meta(file_bytes: bytes, mime: str) -> Tuple[str, Dict[str, Any]]:
+    # один и тот же файл, загруженный одновременно (повторная отправка, несколько вкладок), распознаётся один раз
+    fp = _fp(file_bytes)
+    text, meta = _ocr_flight.do((fp, (mime or "").lower().strip()), _extract_text_with_meta, file_bytes, mime, fp)
+    return text, dict(meta)
+
+def _extract_text_with_meta(file_bytes: bytes, mime: str, fp: str) -> Tuple[str, Dict[str, Any]]:
     t0 = time.perf_counter()
     mime_norm = (mime or "").lower().strip()
     pages = get_pdf_page_count(file_bytes)
@@ -301,6 +314,5 @@ def extract_text_with_meta(file_bytes: bytes, mime: str) -> Tuple[str, Dict[str,
         "ms": int((time.perf_counter() - t0) * 1000),
         "cache_hit": False
     }
-    fp = _fp(file_bytes)
     _OCR_CACHE[fp] = {"text": text, "meta": meta}
     return text, meta